@@ -0,0 +1,727 @@
+'''
+Lectura y escritura de las tablas intermedias del pipeline ETL
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y centraliza el formato en el que se pasan los datos
+entre etapas (raw → curado → estandarizados → fact/dim).
+
+Formatos disponibles (variable de entorno `ETL_FORMATO_INTERMEDIO`):
+- `csv` (por defecto): el comportamiento original, texto plano.
+- `parquet`: columnar, comprimido con zstd y con el esquema (tipos) incluido en el fichero.
+- `arrow`: Arrow IPC/Feather v2 comprimido con zstd, el más rápido de leer y escribir.
+
+Los formatos columnares necesitan `pyarrow`. Las tablas finales de hechos y dimensiones se exportan
+siempre también a CSV.
+
+`leer_tabla` admite proyección de columnas (`columnas`) y filtros de filas (`filtros`, lista de tuplas
+`(columna, operador, valor)` con operadores `==`, `!=`, `in` y `not in`) con el mismo mecanismo para CSV y
+formatos columnares. Un filtro sobre una columna que la tabla no tiene es un error (`ValueError`) salvo que se pida
+ignorarlo expresamente (`ignorar_ausentes=True`): en Parquet/Arrow se aplican en el propio lector y en CSV se lee sólo lo necesario
+(`usecols`) y se filtra por bloques (lote a lote con el lector de Arrow), de modo que nunca se carga el fichero
+completo.
+
+Los CSV se leen con el lector multihilo de Arrow (`ETL_LECTOR_CSV=arrow`, por defecto si está instalado `pyarrow`;
+`pandas` para el lector original, con las mismas conversiones). Se leen como texto y después se convierten:
+- Los datasets del registro de esquemas (`esquemas_datasets.py`) con los tipos declarados: enteros con vacíos
+  (`Int64`), decimales, categorías y texto, con sus valores vacíos propios (`:`) y sin las banderas de Eurostat.
+- El resto (tablas de hechos, dimensiones...) infiriendo el tipo de cada columna igual que pandas.
+Las filas con un número de campos distinto al de la cabecera o con un valor que no se puede convertir no abortan la
+lectura: se descartan y, si se pide (`cuarentena=True`, al leer los ficheros raw), se guardan en
+`ficheros_cuarentena/<tabla>.csv` con el motivo.
+
+Los ficheros raw se guardan comprimidos (`ETL_COMPRESION_RAW`): `gzip` (por defecto, el mismo fichero que sirve
+Eurostat, sin recomprimir), `zstd` o `ninguna`. Los lectores (Arrow y pandas) los leen en streaming directamente del
+fichero comprimido, sin descomprimirlos a disco. En zstd el fichero se escribe en tramas independientes de unos
+4 MB sin comprimir, cortadas en finales de línea, seguidas de la tabla de saltos del formato *seekable* de zstd
+(una trama que los descompresores ignoran), de modo que se puede empezar a leer en cualquier trama y saber el
+tamaño descomprimido sin leer el fichero. Con el lector de pandas, zstd necesita el paquete `zstandard`.
+
+Los ficheros escritos se anotan en la medición activa (`metricas.py`) para registrar los bytes escritos.
+
+'''
+
+import glob
+import gzip
+import importlib.util
+import os
+import shutil
+import struct
+
+import pandas as pd
+
+from esquemas_datasets import esquema_de, tipo_columna
+from metricas import anotar_salida
+
+
+# Formato de las tablas intermedias y extensión de fichero de cada formato
+FORMATO_INTERMEDIO = os.environ.get("ETL_FORMATO_INTERMEDIO", "csv").lower()
+EXTENSIONES = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+COMPRESION = "zstd"
+
+# Compresión de los ficheros raw y extensión que se añade al CSV con cada compresión
+COMPRESION_RAW = os.environ.get("ETL_COMPRESION_RAW", "gzip").lower()
+EXTENSIONES_COMPRESION = {"ninguna": "", "gzip": ".gz", "zstd": ".zst"}
+NIVEL_GZIP = 6
+NIVEL_ZSTD = 3
+
+# Tamaño sin comprimir de cada trama zstd de los ficheros raw y números mágicos de la tabla de saltos
+TAMANO_TRAMA_ZSTD = 4 * 1024 * 1024
+MAGICO_TRAMA_SALTABLE = 0x184D2A5E
+MAGICO_ZSTD_SEEKABLE = 0x8F92EAB1
+
+# Filas por bloque al filtrar un CSV mientras se lee
+FILAS_BLOQUE_LECTURA = 250_000
+
+# Lector de CSV: Arrow (multihilo, con el registro de esquemas) o pandas
+LECTOR_CSV = os.environ.get("ETL_LECTOR_CSV",
+                            "arrow" if importlib.util.find_spec("pyarrow") is not None else "pandas").lower()
+
+# Tamaño de cada bloque que parsea un hilo del lector de Arrow
+TAMANO_BLOQUE_ARROW = 4 * 1024 * 1024
+
+# Filas que no se han podido leer, con el motivo
+CARPETA_CUARENTENA = "ficheros_cuarentena"
+
+# Valores que se leen como vacíos en cualquier CSV (los mismos que pandas)
+NULOS_CSV = ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+             "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+
+# Expresiones de los valores numéricos y de las banderas de Eurostat que pueden acompañarlos
+PATRON_ENTERO = r"^[+-]?\d{1,18}$"
+PATRON_DECIMAL = r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$|^[+-]?(inf|Inf|INF|nan|NaN)$"
+PATRON_BANDERA = r"\s+[a-z]{1,3}$"
+
+if FORMATO_INTERMEDIO not in EXTENSIONES:
+    raise ValueError(f"ETL_FORMATO_INTERMEDIO no válido: {FORMATO_INTERMEDIO}. Opciones: {list(EXTENSIONES)}")
+if COMPRESION_RAW not in EXTENSIONES_COMPRESION:
+    raise ValueError(f"ETL_COMPRESION_RAW no válido: {COMPRESION_RAW}. Opciones: {list(EXTENSIONES_COMPRESION)}")
+
+
+# Función para comprobar que está instalado pyarrow antes de usar un formato columnar
+def _comprobar_pyarrow(formato):
+    if formato != "csv" and importlib.util.find_spec("pyarrow") is None:
+        raise ImportError(f"El formato '{formato}' necesita pyarrow (pip install pyarrow)")
+
+
+# Compresión de un fichero según su extensión ("ninguna" si no está comprimido)
+def compresion_de(ruta):
+    for compresion, ext in EXTENSIONES_COMPRESION.items():
+        if ext and ruta.lower().endswith(ext):
+            return compresion
+    return "ninguna"
+
+
+# Ruta sin la extensión de la compresión
+def _sin_compresion(ruta):
+    ext = EXTENSIONES_COMPRESION[compresion_de(ruta)]
+    return ruta[:len(ruta) - len(ext)]
+
+
+# Formato de un fichero según su extensión (sólo los CSV pueden estar comprimidos)
+def formato_de(ruta):
+    extension = os.path.splitext(_sin_compresion(ruta))[1].lower()
+    for formato, ext in EXTENSIONES.items():
+        if ext == extension and (formato == "csv" or compresion_de(ruta) == "ninguna"):
+            return formato
+    raise ValueError(f"Extensión no soportada: {ruta}")
+
+
+# Nombre de la tabla (nombre del fichero sin extensión ni compresión)
+def nombre_tabla(ruta):
+    return os.path.splitext(os.path.basename(_sin_compresion(ruta)))[0]
+
+
+# Ruta de una tabla dentro de una carpeta en el formato indicado
+def ruta_tabla(carpeta, nombre, formato=None):
+    formato = formato or FORMATO_INTERMEDIO
+    return os.path.join(carpeta, f"{nombre}{EXTENSIONES[formato]}")
+
+
+# Tablas de una carpeta. Si una tabla existe en varios formatos se devuelve la del formato configurado
+def listar_tablas(carpeta, formato=None):
+    formato = formato or FORMATO_INTERMEDIO
+    preferencia = [formato] + [f for f in EXTENSIONES if f != formato]
+    tablas = {}
+    for f in reversed(preferencia):
+        for ruta in glob.glob(os.path.join(carpeta, f"*{EXTENSIONES[f]}")):
+            tablas[nombre_tabla(ruta)] = ruta
+    return sorted(tablas.values())
+
+
+# Ruta de un fichero raw (CSV) dentro de una carpeta con la compresión indicada (por defecto la configurada)
+def ruta_raw(carpeta, nombre, compresion=None):
+    return os.path.join(carpeta, f"{nombre}.csv{EXTENSIONES_COMPRESION[compresion or COMPRESION_RAW]}")
+
+
+# Ficheros raw (CSV con cualquier compresión) de una carpeta. Si un dataset está con varias compresiones se
+# devuelve el de la compresión configurada
+def listar_raw(carpeta):
+    preferencia = [COMPRESION_RAW] + [c for c in EXTENSIONES_COMPRESION if c != COMPRESION_RAW]
+    tablas = {}
+    for compresion in reversed(preferencia):
+        for ruta in glob.glob(os.path.join(carpeta, f"*.csv{EXTENSIONES_COMPRESION[compresion]}")):
+            tablas[nombre_tabla(ruta)] = ruta
+    return sorted(tablas.values())
+
+
+# Fichero raw existente de un dataset con cualquier compresión (None si no hay ninguno)
+def buscar_raw(carpeta, nombre):
+    for ruta in listar_raw(carpeta):
+        if nombre_tabla(ruta) == nombre:
+            return ruta
+    return None
+
+
+# Apertura de un CSV para leerlo en binario, descomprimiéndolo en streaming si está comprimido
+def abrir_csv(ruta):
+    compresion = compresion_de(ruta)
+    if compresion == "gzip":
+        return gzip.open(ruta, "rb")
+    if compresion == "zstd":
+        import pyarrow as pa
+        return pa.input_stream(ruta, compression="zstd")
+    return open(ruta, "rb")
+
+
+# Columnas de la cabecera de un CSV (comprimido o no)
+def cabecera_csv(ruta, sep=","):
+    with abrir_csv(ruta) as f:
+        return list(pd.read_csv(f, nrows=0, sep=sep).columns)
+
+
+# Tabla de saltos del formato seekable de zstd: una trama saltable con el tamaño comprimido y sin comprimir de
+# cada trama, el número de tramas, un descriptor (sin checksums) y el número mágico del formato
+def _tabla_saltos(tramas):
+    entradas = b"".join(struct.pack("<II", comprimido, original) for comprimido, original in tramas)
+    entradas += struct.pack("<IBI", len(tramas), 0, MAGICO_ZSTD_SEEKABLE)
+    return struct.pack("<II", MAGICO_TRAMA_SALTABLE, len(entradas)) + entradas
+
+
+# Tramas de un fichero zstd seekable como lista de (bytes comprimidos, bytes sin comprimir). None si el fichero
+# no tiene tabla de saltos
+def tramas_zstd(ruta):
+    with open(ruta, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        tamano = f.tell()
+        if tamano < 9:
+            return None
+        f.seek(tamano - 9)
+        n, descriptor, magico = struct.unpack("<IBI", f.read(9))
+        ancho = 12 if descriptor & 0x80 else 8
+        if magico != MAGICO_ZSTD_SEEKABLE or tamano < 9 + n * ancho:
+            return None
+        f.seek(tamano - 9 - n * ancho)
+        entradas = f.read(n * ancho)
+    return [struct.unpack_from("<II", entradas, i * ancho) for i in range(n)]
+
+
+# Tamaño sin comprimir de un CSV: en gzip el del trailer y en zstd el de la tabla de saltos. Si no se conoce (o el
+# del trailer no es creíble: sólo guarda el último miembro y módulo 2^32) se estima como 5 veces el comprimido
+def tamano_csv(ruta):
+    tamano = os.path.getsize(ruta)
+    compresion = compresion_de(ruta)
+    original = None
+    if compresion == "gzip" and tamano >= 18:
+        with open(ruta, "rb") as f:
+            f.seek(-4, os.SEEK_END)
+            original = struct.unpack("<I", f.read(4))[0]
+    elif compresion == "zstd":
+        tramas = tramas_zstd(ruta)
+        original = sum(n for _, n in tramas) if tramas else None
+    elif compresion == "ninguna":
+        return tamano
+    return original if original is not None and original >= tamano else tamano * 5
+
+
+# Filtros que se pueden aplicar sobre `columnas`. Los filtros sobre columnas inexistentes dan error salvo que se
+# pida ignorarlos con `ignorar_ausentes`
+def filtros_aplicables(filtros, columnas, ignorar_ausentes=False):
+    ausentes = [columna for columna, _, _ in filtros if columna not in columnas]
+    if ausentes and not ignorar_ausentes:
+        raise ValueError(f"Filtro sobre columnas que no existen en la tabla: {', '.join(dict.fromkeys(ausentes))}")
+    return [filtro for filtro in filtros if filtro[0] in columnas]
+
+
+# Máscara de filas que cumplen todos los filtros
+def mascara_filtros(df, filtros, ignorar_ausentes=False):
+    mascara = pd.Series(True, index=df.index)
+    for columna, operador, valor in filtros_aplicables(filtros, set(df.columns), ignorar_ausentes):
+        if operador == "==":
+            mascara &= df[columna] == valor
+        elif operador == "!=":
+            mascara &= df[columna] != valor
+        elif operador == "in":
+            mascara &= df[columna].isin(valor)
+        elif operador == "not in":
+            mascara &= ~df[columna].isin(valor)
+        else:
+            raise ValueError(f"Operador de filtro no soportado: {operador}")
+    return mascara
+
+
+# Expresión de filtro de pyarrow equivalente a `mascara_filtros`
+def _expresion_arrow(filtros, columnas_disponibles, ignorar_ausentes=False):
+    import pyarrow.dataset as ds
+
+    expresion = None
+    for columna, operador, valor in filtros_aplicables(filtros, set(columnas_disponibles), ignorar_ausentes):
+        campo = ds.field(columna)
+        if operador == "==":
+            condicion = campo == valor
+        elif operador == "!=":
+            condicion = campo != valor
+        elif operador == "in":
+            condicion = campo.isin(list(valor))
+        elif operador == "not in":
+            condicion = ~campo.isin(list(valor))
+        else:
+            raise ValueError(f"Operador de filtro no soportado: {operador}")
+        expresion = condicion if expresion is None else expresion & condicion
+    return expresion
+
+
+# Conversión de una columna de texto de Arrow a un tipo del registro de esquemas. Devuelve la columna convertida y
+# la máscara de los valores que no se han podido convertir
+def _convertir_columna(valores, tipo, esquema, categorias=True):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if tipo in ("entero", "decimal"):
+        valores = pc.utf8_trim_whitespace(valores)
+        if esquema.get("banderas"):
+            valores = pc.replace_substring_regex(valores, pattern=PATRON_BANDERA, replacement="")
+        if esquema.get("nulos"):
+            valores = pc.if_else(pc.is_in(valores, value_set=pa.array(esquema["nulos"], pa.string())),
+                                 pa.scalar(None, pa.string()), valores)
+        if tipo == "entero":
+            # Los años escritos como decimales ("2020.0") también son enteros
+            valores = pc.replace_substring_regex(valores, pattern=r"\.0*$", replacement="")
+        validos = pc.match_substring_regex(valores, PATRON_ENTERO if tipo == "entero" else PATRON_DECIMAL)
+        invalidos = pc.fill_null(pc.invert(validos), False)
+        valores = pc.if_else(invalidos, pa.scalar(None, pa.string()), valores)
+        return pc.cast(valores, pa.int64() if tipo == "entero" else pa.float64()), invalidos
+
+    if esquema.get("nulos"):
+        valores = pc.if_else(pc.is_in(valores, value_set=pa.array(esquema["nulos"], pa.string())),
+                             pa.scalar(None, pa.string()), valores)
+    if tipo == "categoria" and categorias:
+        valores = pc.dictionary_encode(valores)
+    return valores, None
+
+
+# Tipo de una columna de texto de Arrow inferido como lo hace pandas: entero (decimal si tiene vacíos), decimal,
+# booleano o texto. Las columnas vacías se leen como decimales (NaN)
+def _inferir_columna(valores):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    presentes = pc.drop_null(valores)
+    if len(presentes) == 0:
+        return pc.cast(valores, pa.float64())
+    if pc.all(pc.match_substring_regex(presentes, PATRON_ENTERO)).as_py():
+        return pc.cast(valores, pa.int64() if valores.null_count == 0 else pa.float64())
+    if pc.all(pc.match_substring_regex(presentes, PATRON_DECIMAL)).as_py():
+        return pc.cast(valores, pa.float64())
+    if pc.all(pc.is_in(pc.utf8_lower(presentes), value_set=pa.array(["true", "false"]))).as_py():
+        return pc.equal(pc.utf8_lower(valores), "true")
+    return valores
+
+
+# Aplica a una tabla de Arrow leída como texto el esquema de su dataset (o la inferencia de tipos si no tiene).
+# Devuelve el DataFrame con las filas válidas y otro con las filas apartadas y el motivo
+def aplicar_esquema(tabla, esquema=None, categorias=True):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if esquema is None:
+        columnas = {nombre: _inferir_columna(tabla.column(nombre)) for nombre in tabla.column_names}
+        return pa.table(columnas).to_pandas(), pd.DataFrame()
+
+    columnas, motivos, invalidas = {}, [], None
+    for nombre in tabla.column_names:
+        convertida, invalidos = _convertir_columna(tabla.column(nombre), tipo_columna(esquema, nombre), esquema,
+                                                   categorias)
+        columnas[nombre] = convertida
+        if invalidos is not None and pc.any(invalidos).as_py():
+            motivos.append((nombre, invalidos))
+            invalidas = invalidos if invalidas is None else pc.or_(invalidas, invalidos)
+
+    apartadas = pd.DataFrame()
+    tabla_tipada = pa.table(columnas)
+    if invalidas is not None:
+        apartadas = tabla.filter(invalidas).to_pandas()
+        motivo = pd.Series("", index=apartadas.index)
+        for nombre, invalidos in motivos:
+            marcadas = pd.Series(invalidos.filter(invalidas).to_numpy(zero_copy_only=False), index=apartadas.index)
+            motivo[marcadas] = motivo[marcadas] + f"valor no válido en {nombre} ({tipo_columna(esquema, nombre)}); "
+        apartadas.insert(0, "motivo", motivo.str.rstrip("; "))
+        tabla_tipada = tabla_tipada.filter(pc.invert(invalidas))
+
+    df = tabla_tipada.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+    return df, apartadas
+
+
+# Equivalente de `aplicar_esquema` para un DataFrame leído como texto por el lector de pandas: mismas conversiones,
+# mismos valores vacíos y mismas filas apartadas
+def aplicar_esquema_pandas(df, esquema, categorias=True):
+    columnas, motivos = {}, []
+    invalidas = pd.Series(False, index=df.index)
+    nulos = esquema.get("nulos") or []
+    for nombre in df.columns:
+        tipo = tipo_columna(esquema, nombre)
+        valores = df[nombre]
+        if tipo in ("entero", "decimal"):
+            valores = valores.str.strip()
+            if esquema.get("banderas"):
+                valores = valores.str.replace(PATRON_BANDERA, "", regex=True)
+            valores = valores.mask(valores.isin(nulos))
+            if tipo == "entero":
+                # Los años escritos como decimales ("2020.0") también son enteros
+                valores = valores.str.replace(r"\.0*$", "", regex=True)
+            validos = valores.str.match(PATRON_ENTERO if tipo == "entero" else PATRON_DECIMAL)
+            invalidos = valores.notna() & ~validos.astype("boolean").fillna(True).astype(bool)
+            valores = pd.to_numeric(valores.mask(invalidos), dtype_backend="numpy_nullable")
+            columnas[nombre] = valores.astype("Int64" if tipo == "entero" else "float64")
+            if invalidos.any():
+                motivos.append((nombre, invalidos))
+                invalidas |= invalidos
+            continue
+        valores = valores.mask(valores.isin(nulos))
+        columnas[nombre] = valores.astype("category") if tipo == "categoria" and categorias else valores
+
+    tipado = pd.DataFrame(columnas, index=df.index)
+    apartadas = pd.DataFrame()
+    if invalidas.any():
+        apartadas = df[invalidas].reset_index(drop=True)
+        motivo = pd.Series("", index=apartadas.index)
+        for nombre, invalidos in motivos:
+            marcadas = invalidos[invalidas].to_numpy()
+            motivo[marcadas] = motivo[marcadas] + f"valor no válido en {nombre} ({tipo_columna(esquema, nombre)}); "
+        apartadas.insert(0, "motivo", motivo.str.rstrip("; "))
+        tipado = tipado[~invalidas]
+    return tipado.reset_index(drop=True), apartadas
+
+
+# Guarda (o borra, si no hay ninguna) las filas apartadas de una tabla en `ficheros_cuarentena/<tabla>.csv`
+def guardar_cuarentena(nombre, apartadas):
+    ruta = os.path.join(CARPETA_CUARENTENA, f"{nombre}.csv")
+    apartadas = [df for df in apartadas if not df.empty]
+    if not apartadas:
+        if os.path.exists(ruta):
+            os.remove(ruta)
+        return None
+    os.makedirs(CARPETA_CUARENTENA, exist_ok=True)
+    pd.concat(apartadas, ignore_index=True).to_csv(ruta, index=False)
+    return ruta
+
+
+# Filas con un número de campos distinto al de la cabecera, como filas apartadas
+def _filas_mal_formadas(filas):
+    return pd.DataFrame({"motivo": [f"{fila.actual_columns} campos (se esperaban {fila.expected_columns})"
+                                    for fila in filas],
+                         "texto": [fila.text for fila in filas]})
+
+
+# Opciones del lector de Arrow para un CSV. Las filas mal formadas se van añadiendo a `mal_formadas`
+def _opciones_arrow(ruta, sep, columnas, tamano_bloque=None):
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    mal_formadas = []
+
+    def apartar(fila):
+        mal_formadas.append(fila)
+        return "skip"
+
+    cabecera = cabecera_csv(ruta, sep)
+    incluidas = [c for c in cabecera if columnas is None or c in columnas]
+    opciones = {
+        "read_options": pacsv.ReadOptions(use_threads=True, block_size=tamano_bloque or TAMANO_BLOQUE_ARROW),
+        "parse_options": pacsv.ParseOptions(delimiter=sep, invalid_row_handler=apartar),
+        "convert_options": pacsv.ConvertOptions(include_columns=incluidas,
+                                                column_types={c: pa.string() for c in incluidas},
+                                                null_values=NULOS_CSV, strings_can_be_null=True,
+                                                quoted_strings_can_be_null=True),
+    }
+    return opciones, mal_formadas
+
+
+# Filtros con los valores como texto, para aplicarlos sobre un CSV leído como texto
+def _filtros_texto(filtros):
+    return [(c, op, [str(v) for v in valor] if op in ("in", "not in") else str(valor)) for c, op, valor in filtros]
+
+
+# Lectura de un CSV con el lector de Arrow: se parsea en streaming como texto, se filtra lote a lote (sólo se
+# guardan en memoria las filas que pasan los filtros) y se convierte con el esquema de su dataset
+def _leer_csv_arrow(ruta, columnas, filtros, estadisticas, cuarentena=False, usar_esquema=True,
+                    ignorar_ausentes=False, sep=","):
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    necesarias = None if columnas is None else set(columnas) | {columna for columna, _, _ in filtros}
+    opciones, mal_formadas = _opciones_arrow(ruta, sep, necesarias)
+    lector = pacsv.open_csv(ruta, **opciones)
+
+    # Los filtros se aplican sobre el texto, antes de convertir (las filas descartadas no van a cuarentena)
+    expresion = _expresion_arrow(_filtros_texto(filtros), lector.schema.names, ignorar_ausentes)
+    lotes, filas_leidas = [], 0
+    for lote in lector:
+        filas_leidas += lote.num_rows
+        lotes.append(lote if expresion is None else lote.filter(expresion))
+    tabla = pa.Table.from_batches(lotes, schema=lector.schema)
+    estadisticas["filas_leidas"] = filas_leidas + len(mal_formadas)
+    if columnas is not None:
+        tabla = tabla.select([c for c in tabla.column_names if c in set(columnas)])
+
+    df, apartadas = aplicar_esquema(tabla, esquema_de(nombre_tabla(ruta)) if usar_esquema else None)
+    estadisticas["filas_cuarentena"] = len(apartadas) + len(mal_formadas)
+    if cuarentena:
+        guardar_cuarentena(nombre_tabla(ruta), [_filas_mal_formadas(mal_formadas), apartadas])
+    return df
+
+
+# Lectura de un CSV por bloques de unas `filas` filas con el lector de Arrow. Con `como_texto` (o si el dataset no
+# tiene esquema) todas las columnas se devuelven como texto; si no, se convierten con el esquema del dataset (sin
+# categorías, para que todos los bloques tengan el mismo esquema). Las filas apartadas se cuentan en
+# `estadisticas` y, si se pide, se guardan en cuarentena al terminar
+def leer_csv_por_bloques(ruta, filas, sep=",", como_texto=False, cuarentena=False, estadisticas=None):
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+
+    with abrir_csv(ruta) as f:
+        muestra = f.read(1024 * 1024)
+    bytes_por_fila = len(muestra) / max(muestra.count(b"\n"), 1)
+    opciones, mal_formadas = _opciones_arrow(ruta, sep, None, max(int(filas * bytes_por_fila), 64 * 1024))
+    esquema = esquema_de(nombre_tabla(ruta))
+    estadisticas = {} if estadisticas is None else estadisticas
+    apartadas = []
+    for lote in pacsv.open_csv(ruta, **opciones):
+        tabla = pa.Table.from_batches([lote])
+        if como_texto or esquema is None:
+            yield tabla.to_pandas()
+            continue
+        df, apartadas_lote = aplicar_esquema(tabla, esquema, categorias=False)
+        apartadas.append(apartadas_lote)
+        yield df
+    estadisticas["filas_cuarentena"] = len(mal_formadas) + sum(len(df) for df in apartadas)
+    if cuarentena:
+        guardar_cuarentena(nombre_tabla(ruta), [_filas_mal_formadas(mal_formadas)] + apartadas)
+
+
+# Lectura de un CSV por bloques de `filas` filas con el lector de pandas, con los mismos tipos que
+# `leer_csv_por_bloques`: se lee como texto y se convierte con el esquema del dataset (sin categorías)
+def leer_csv_por_bloques_pandas(ruta, filas, cuarentena=False, estadisticas=None, **kwargs_csv):
+    esquema = esquema_de(nombre_tabla(ruta))
+    estadisticas = {} if estadisticas is None else estadisticas
+    apartadas = []
+    for bloque in pd.read_csv(ruta, chunksize=filas, dtype=str, **kwargs_csv):
+        if esquema is None:
+            yield bloque
+            continue
+        df, apartadas_bloque = aplicar_esquema_pandas(bloque, esquema, categorias=False)
+        apartadas.append(apartadas_bloque)
+        yield df
+    estadisticas["filas_cuarentena"] = sum(len(df) for df in apartadas)
+    if cuarentena:
+        guardar_cuarentena(nombre_tabla(ruta), apartadas)
+
+
+# Lectura de una tabla en cualquiera de los formatos soportados, leyendo sólo las columnas y filas pedidas.
+# Si se pasa el diccionario `estadisticas`, se anotan en él las filas leídas antes de aplicar los filtros y las
+# apartadas por no poder leerse. Con `cuarentena` las filas apartadas de un CSV se guardan en `ficheros_cuarentena`;
+# con `usar_esquema=False` los tipos del CSV se infieren aunque el dataset tenga esquema. Con `ignorar_ausentes` los
+# filtros sobre columnas que no tiene la tabla no se aplican (si no, dan error)
+def leer_tabla(ruta, columnas=None, filtros=None, estadisticas=None, cuarentena=False, usar_esquema=True,
+               ignorar_ausentes=False, **kwargs_csv):
+    formato = formato_de(ruta)
+    filtros = filtros or []
+    estadisticas = {} if estadisticas is None else estadisticas
+
+    if formato == "csv" and LECTOR_CSV == "arrow" and set(kwargs_csv) <= {"sep"}:
+        return _leer_csv_arrow(ruta, columnas, filtros, estadisticas, cuarentena, usar_esquema, ignorar_ausentes,
+                               **kwargs_csv)
+
+    if formato == "csv":
+        # Como con Arrow, los datasets con esquema se leen como texto, se filtran sobre el texto y se convierten
+        esquema = esquema_de(nombre_tabla(ruta)) if usar_esquema else None
+        if esquema is not None:
+            kwargs_csv["dtype"] = str
+            filtros = _filtros_texto(filtros)
+        kwargs_csv.setdefault("low_memory", False)
+        if columnas is not None:
+            necesarias = set(columnas) | {columna for columna, _, _ in filtros}
+            kwargs_csv["usecols"] = lambda c: c in necesarias
+        if not filtros:
+            df = pd.read_csv(ruta, **kwargs_csv)
+            estadisticas["filas_leidas"] = len(df)
+        else:
+            bloques = []
+            estadisticas["filas_leidas"] = 0
+            for bloque in pd.read_csv(ruta, chunksize=FILAS_BLOQUE_LECTURA, **kwargs_csv):
+                estadisticas["filas_leidas"] += len(bloque)
+                bloques.append(bloque[mascara_filtros(bloque, filtros, ignorar_ausentes)])
+            df = pd.concat(bloques, ignore_index=True) if bloques else pd.read_csv(ruta, nrows=0, **kwargs_csv)
+            if columnas is not None:
+                df = df[[c for c in df.columns if c in set(columnas)]]
+        if esquema is None:
+            return df
+
+        df, apartadas = aplicar_esquema_pandas(df, esquema)
+        estadisticas["filas_cuarentena"] = len(apartadas)
+        if cuarentena:
+            guardar_cuarentena(nombre_tabla(ruta), [apartadas])
+        return df
+
+    _comprobar_pyarrow(formato)
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(ruta, format="parquet" if formato == "parquet" else "ipc")
+    disponibles = dataset.schema.names
+    if columnas is not None:
+        columnas = [c for c in disponibles if c in set(columnas)]
+    tabla = dataset.to_table(columns=columnas, filter=_expresion_arrow(filtros, disponibles, ignorar_ausentes))
+    estadisticas["filas_leidas"] = dataset.count_rows() if filtros else tabla.num_rows
+    return tabla.to_pandas()
+
+
+# Escritura de una tabla en el formato indicado (por defecto el intermedio). Devuelve la ruta escrita
+def escribir_tabla(df, carpeta, nombre, formato=None):
+    formato = formato or FORMATO_INTERMEDIO
+    _comprobar_pyarrow(formato)
+    ruta = ruta_tabla(carpeta, nombre, formato)
+    if formato == "csv":
+        df.to_csv(ruta, index=False)
+    elif formato == "parquet":
+        df.to_parquet(ruta, index=False, compression=COMPRESION)
+    else:
+        df.reset_index(drop=True).to_feather(ruta, compression=COMPRESION)
+    anotar_salida(ruta)
+    return ruta
+
+
+# Escritura de una tabla final (hechos y dimensiones): siempre en CSV y, si se usa un formato columnar,
+# también en ese formato. Devuelve la ruta del CSV
+def escribir_tabla_final(df, carpeta, nombre):
+    ruta = escribir_tabla(df, carpeta, nombre, formato="csv")
+    if FORMATO_INTERMEDIO != "csv":
+        escribir_tabla(df, carpeta, nombre)
+    return ruta
+
+
+# Escritura incremental de una tabla por bloques (curado en streaming). Se escribe en un fichero temporal
+# que sólo sustituye al definitivo al cerrar sin errores
+class EscritorTabla:
+
+    def __init__(self, carpeta, nombre, formato=None):
+        self.formato = formato or FORMATO_INTERMEDIO
+        _comprobar_pyarrow(self.formato)
+        self.ruta = ruta_tabla(carpeta, nombre, self.formato)
+        self.ruta_tmp = f"{self.ruta}.part"
+        self.escritor = None
+        self.esquema = None
+        self.filas = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_error, error, traza):
+        self.cerrar(correcto=tipo_error is None)
+
+    # Añade un bloque. El primero fija las columnas y, en formatos columnares, el esquema
+    def escribir(self, df):
+        if self.formato == "csv":
+            primero = self.escritor is None
+            if primero:
+                self.escritor = open(self.ruta_tmp, "w", encoding="utf-8", newline="")
+            df.to_csv(self.escritor, index=False, header=primero)
+        else:
+            import pyarrow as pa
+
+            if self.esquema is None:
+                tabla = pa.Table.from_pandas(df, preserve_index=False)
+                self.esquema = tabla.schema
+                if self.formato == "parquet":
+                    import pyarrow.parquet as pq
+                    self.escritor = pq.ParquetWriter(self.ruta_tmp, self.esquema, compression=COMPRESION)
+                else:
+                    import pyarrow.ipc as ipc
+                    opciones = ipc.IpcWriteOptions(compression=COMPRESION)
+                    self.escritor = ipc.new_file(self.ruta_tmp, self.esquema, options=opciones)
+            else:
+                tabla = pa.Table.from_pandas(df, schema=self.esquema, preserve_index=False)
+            self.escritor.write_table(tabla)
+        self.filas += len(df)
+
+    def cerrar(self, correcto=True):
+        if self.escritor is not None:
+            self.escritor.close()
+            self.escritor = None
+        if correcto and os.path.exists(self.ruta_tmp):
+            os.replace(self.ruta_tmp, self.ruta)
+            anotar_salida(self.ruta)
+        elif os.path.exists(self.ruta_tmp):
+            os.remove(self.ruta_tmp)
+
+
+# Escritura en streaming de un fichero raw con la compresión indicada (por defecto la de su extensión). En zstd los
+# datos se agrupan en tramas independientes de `TAMANO_TRAMA_ZSTD` bytes cortadas en finales de línea y al cerrar
+# se añade la tabla de saltos
+class EscritorRaw:
+
+    def __init__(self, ruta, compresion=None):
+        self.compresion = compresion or compresion_de(ruta)
+        self.f = gzip.open(ruta, "wb", compresslevel=NIVEL_GZIP) if self.compresion == "gzip" else open(ruta, "wb")
+        self.pendiente = bytearray()
+        self.tramas = []
+        self.bytes_sin_comprimir = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_error, error, traza):
+        self.close()
+
+    def write(self, datos):
+        self.bytes_sin_comprimir += len(datos)
+        if self.compresion != "zstd":
+            self.f.write(datos)
+            return
+        self.pendiente += datos
+        while len(self.pendiente) >= TAMANO_TRAMA_ZSTD:
+            corte = self.pendiente.rfind(b"\n", 0, TAMANO_TRAMA_ZSTD) + 1 or TAMANO_TRAMA_ZSTD
+            self._escribir_trama(bytes(self.pendiente[:corte]))
+            del self.pendiente[:corte]
+
+    def _escribir_trama(self, datos):
+        import pyarrow as pa
+
+        comprimido = pa.Codec("zstd", NIVEL_ZSTD).compress(datos, asbytes=True)
+        self.f.write(comprimido)
+        self.tramas.append((len(comprimido), len(datos)))
+
+    def close(self):
+        if self.f is None:
+            return
+        if self.compresion == "zstd":
+            if self.pendiente:
+                self._escribir_trama(bytes(self.pendiente))
+                self.pendiente.clear()
+            self.f.write(_tabla_saltos(self.tramas))
+        self.f.close()
+        self.f = None
+
+
+# Recompresión de un fichero raw a la compresión indicada (por defecto la configurada), en streaming y sin pasar
+# por un CSV descomprimido en disco. Sustituye al original y devuelve la ruta nueva
+def comprimir_raw(ruta, compresion=None):
+    compresion = compresion or COMPRESION_RAW
+    destino = ruta_raw(os.path.dirname(ruta), nombre_tabla(ruta), compresion)
+    if destino == ruta:
+        return ruta
+    ruta_tmp = f"{destino}.part"
+    with abrir_csv(ruta) as origen, EscritorRaw(ruta_tmp, compresion) as escritor:
+        shutil.copyfileobj(origen, escritor, TAMANO_BLOQUE_ARROW)
+    os.replace(ruta_tmp, destino)
+    os.remove(ruta)
+    anotar_salida(destino)
+    return destino
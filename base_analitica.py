@@ -0,0 +1,364 @@
+'''
+Base analítica local sobre las tablas de hechos y dimensiones
+-----------------------------------------------------------------------
+
+Este script forma parte del pipeline ETL del TFM y carga las tablas de `ficheros_fact` y `ficheros_dim` en una
+base de datos embebida (`ficheros_analitica/analitica.<motor>`) para que los cuadros de mando consulten tablas
+indexadas y agregados ya calculados en lugar de leer los CSV completos en cada consulta:
+
+1. **Motor (`ETL_MOTOR_ANALITICA`):** `duckdb` (por defecto si está instalado) o `sqlite` (librería estándar).
+   Las consultas y agregados usan SQL común a los dos.
+
+2. **Tablas y vistas:**
+   - Cada tabla de hechos y de dimensiones se carga tal cual, con índices sobre las columnas de geo, periodo y
+     contaminante que tenga (`id_geo`, `id_time_period`, `id_airpol` o sus códigos si no se usan claves).
+   - `v_<tabla de hechos>` es la vista con las claves subrogadas sustituidas por el código y la descripción de
+     cada dimensión, que es lo que se consulta normalmente.
+
+3. **Agregados materializados (`AGREGADOS`):** emisiones por país, año y contaminante e intensidad de emisiones
+   sobre el PIB de `fact_gdp`. Se definen en SQL sobre las vistas y se guardan como tablas indexadas. La intensidad
+   tiene una fila por (geo, TIME_PERIOD): las emisiones se pasan a toneladas con los factores de
+   `tabla_intensidad.UNIDADES` y, si un par está en varias unidades, se usa la primera según ese orden.
+
+4. **Actualización incremental:**
+   - Sólo se recargan las tablas cuyo fichero ha cambiado (huellas en la propia base, tabla `_estado_analitica`).
+   - Para cada tabla recargada se calculan los pares (geo, TIME_PERIOD) cuyas filas han cambiado, y en los
+     agregados que dependen de ella sólo se borran y recalculan esos pares; los cambios se propagan a los
+     agregados que dependen de otros agregados.
+   - Si cambia la definición de un agregado, o una tabla no tiene geo y periodo, el agregado se recalcula entero.
+
+`consultar(sql)` devuelve el resultado de una consulta como DataFrame.
+
+'''
+
+import hashlib
+import importlib.util
+import json
+import os
+
+import pandas as pd
+
+from almacenamiento import leer_tabla, listar_tablas, nombre_tabla
+from huellas import ha_cambiado, huella_fichero
+from metricas import anotar, medir
+from proceso_normalizacion import CARPETA_DIM, CARPETA_FACT, columna_clave, dim_cols
+from tabla_intensidad import UNIDADES
+
+
+# Motor de la base analítica y ruta del fichero
+MOTOR = os.environ.get("ETL_MOTOR_ANALITICA", "duckdb" if importlib.util.find_spec("duckdb") else "sqlite").lower()
+CARPETA_ANALITICA = "ficheros_analitica"
+EXTENSIONES_MOTOR = {"duckdb": ".duckdb", "sqlite": ".sqlite"}
+
+if MOTOR not in EXTENSIONES_MOTOR:
+    raise ValueError(f"ETL_MOTOR_ANALITICA no válido: {MOTOR}. Opciones: {list(EXTENSIONES_MOTOR)}")
+
+TABLA_ESTADO = "_estado_analitica"
+
+# Columnas por las que se consulta (código de la dimensión) y que se indexan en hechos y agregados
+COLUMNAS_INDICE = ["geo", "TIME_PERIOD", "airpol"]
+# Pares que identifican las filas de un agregado para la actualización incremental
+COLUMNAS_CLAVE = ["geo", "TIME_PERIOD"]
+
+# Unidades de masa de las emisiones: factor a toneladas y orden de preferencia, como expresiones SQL sobre `unidad`
+UNIDADES_MASA = [unidad for unidad, (magnitud, _) in UNIDADES.items() if magnitud == "masa"]
+FACTOR_TONELADAS = "CASE unidad " + " ".join(f"WHEN '{u}' THEN {UNIDADES[u][1]}" for u in UNIDADES_MASA) + " END"
+PREFERENCIA_UNIDAD = "CASE unidad " + " ".join(f"WHEN '{u}' THEN {i}" for i, u in enumerate(UNIDADES_MASA)) + " END"
+
+# Agregados materializados. En `sql` cada origen se escribe como `{nombre}`: una tabla de hechos (se lee su vista
+# con las dimensiones decodificadas) u otro agregado definido antes
+AGREGADOS = {
+    # Emisiones por país, año y contaminante de las cuentas de emisiones (total de actividades y hogares)
+    "agg_emisiones_pais_anio": {
+        "origenes": ["fact_aea"],
+        "sql": '''
+            SELECT geo, TIME_PERIOD, airpol, "Unit of measure" AS unidad,
+                   SUM(OBS_VALUE) AS emisiones, COUNT(*) AS observaciones
+            FROM {fact_aea}
+            WHERE nace_r2 = 'TOTAL_HH'
+            GROUP BY geo, TIME_PERIOD, airpol, "Unit of measure"
+        ''',
+        "indice": ["geo", "TIME_PERIOD", "airpol"],
+    },
+    # Emisiones totales de GEI (toneladas) por millón de euros de PIB a precios corrientes, una fila por país y año
+    # (si el PIB de un par aparece repetido se toma el mayor)
+    "agg_intensidad_emisiones": {
+        "origenes": ["agg_emisiones_pais_anio", "fact_gdp"],
+        "sql": f'''
+            SELECT e.geo, e.TIME_PERIOD, e.emisiones_t, p.pib_meur,
+                   e.emisiones_t / NULLIF(p.pib_meur, 0) AS intensidad_t_meur
+            FROM (
+                SELECT geo, TIME_PERIOD, emisiones * {FACTOR_TONELADAS} AS emisiones_t,
+                       ROW_NUMBER() OVER (PARTITION BY geo, TIME_PERIOD ORDER BY {PREFERENCIA_UNIDAD}) AS orden
+                FROM {{agg_emisiones_pais_anio}}
+                WHERE airpol = 'GHG' AND {PREFERENCIA_UNIDAD} IS NOT NULL
+            ) e
+            JOIN (
+                SELECT geo, TIME_PERIOD, MAX(OBS_VALUE) AS pib_meur
+                FROM {{fact_gdp}}
+                WHERE "National accounts indicator (ESA 2010)" = 'Gross domestic product at market prices'
+                  AND "Unit of measure" = 'Current prices, million euro'
+                GROUP BY geo, TIME_PERIOD
+            ) p ON p.geo = e.geo AND p.TIME_PERIOD = e.TIME_PERIOD
+            WHERE e.orden = 1
+        ''',
+        "indice": ["geo", "TIME_PERIOD"],
+    },
+}
+
+
+def ruta_base(motor=None):
+    motor = motor or MOTOR
+    return os.path.join(CARPETA_ANALITICA, f"analitica{EXTENSIONES_MOTOR[motor]}")
+
+
+def _q(nombre):
+    return '"' + nombre.replace('"', '""') + '"'
+
+
+# Conexión a la base analítica con las pocas operaciones que dependen del motor
+class BaseAnalitica:
+
+    def __init__(self, ruta=None, motor=None):
+        self.motor = motor or MOTOR
+        self.ruta = ruta or ruta_base(self.motor)
+        os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+        if self.motor == "duckdb":
+            import duckdb
+            self.conexion = duckdb.connect(self.ruta)
+        else:
+            import sqlite3
+            self.conexion = sqlite3.connect(self.ruta)
+            # Las tablas se recargan borrándolas y renombrando la nueva, aunque las usen las vistas
+            self.conexion.execute("PRAGMA legacy_alter_table = ON")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_error, error, traza):
+        self.cerrar()
+
+    def cerrar(self):
+        if self.conexion is not None:
+            self.conexion.commit()
+            self.conexion.close()
+            self.conexion = None
+
+    def ejecutar(self, sql, parametros=()):
+        self.conexion.execute(sql, parametros)
+
+    def consulta(self, sql, parametros=()):
+        if self.motor == "duckdb":
+            return self.conexion.execute(sql, parametros).df()
+        return pd.read_sql_query(sql, self.conexion, params=parametros)
+
+    def valor(self, sql, parametros=()):
+        fila = self.conexion.execute(sql, parametros).fetchone()
+        return None if fila is None else fila[0]
+
+    def existe(self, nombre):
+        if self.motor == "duckdb":
+            sql = "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?"
+        else:
+            sql = "SELECT COUNT(*) FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?"
+        return self.valor(sql, (nombre,)) > 0
+
+    def columnas(self, nombre):
+        return list(self.consulta(f"SELECT * FROM {_q(nombre)} LIMIT 0").columns)
+
+    # Crea (o sustituye) una tabla con el contenido de un DataFrame
+    def cargar_dataframe(self, nombre, df):
+        # Las categorías se cargan como texto para poder comparar las tablas entre sí
+        df = df.copy()
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype(object).where(df[col].notna(), None)
+        self.ejecutar(f"DROP TABLE IF EXISTS {_q(nombre)}")
+        if self.motor == "duckdb":
+            self.conexion.register("_df_carga", df)
+            self.ejecutar(f"CREATE TABLE {_q(nombre)} AS SELECT * FROM _df_carga")
+            self.conexion.unregister("_df_carga")
+        else:
+            df.to_sql(nombre, self.conexion, index=False)
+
+    def indexar(self, tabla, columnas):
+        columnas = [c for c in columnas if c in self.columnas(tabla)]
+        if columnas:
+            self.ejecutar(f"CREATE INDEX IF NOT EXISTS {_q(f'idx_{tabla}')} ON {_q(tabla)} "
+                          f"({', '.join(_q(c) for c in columnas)})")
+
+    # Estado guardado en la propia base (huellas de los ficheros cargados y firmas de los agregados)
+    def leer_estado(self):
+        if not self.existe(TABLA_ESTADO):
+            return {}
+        filas = self.conexion.execute(f"SELECT clave, valor FROM {TABLA_ESTADO}").fetchall()
+        return {clave: json.loads(valor) for clave, valor in filas}
+
+    def guardar_estado(self, clave, valor):
+        self.ejecutar(f"CREATE TABLE IF NOT EXISTS {TABLA_ESTADO} (clave VARCHAR PRIMARY KEY, valor VARCHAR)")
+        self.ejecutar(f"DELETE FROM {TABLA_ESTADO} WHERE clave = ?", (clave,))
+        self.ejecutar(f"INSERT INTO {TABLA_ESTADO} VALUES (?, ?)", (clave, json.dumps(valor, sort_keys=True)))
+
+
+# SELECT de una tabla de hechos con las claves subrogadas sustituidas por las columnas de su dimensión
+def sql_decodificado(base, tabla):
+    columnas = base.columnas(tabla)
+    select, joins = [], []
+    for col in columnas:
+        dim = next((d for d in dim_cols if columna_clave(d) == col), None)
+        if dim is None or not base.existe(f"dim_{dim}"):
+            select.append(f"h.{_q(col)}")
+            continue
+        alias = f"d_{dim}"
+        columnas_dim = [c for c in dim_cols[dim] if c in base.columnas(f"dim_{dim}") and c not in columnas]
+        select += [f"{alias}.{_q(c)}" for c in columnas_dim]
+        joins.append(f"LEFT JOIN {_q(f'dim_{dim}')} {alias} ON {alias}.{_q(col)} = h.{_q(col)}")
+    return f"SELECT {', '.join(select)} FROM {_q(tabla)} h {' '.join(joins)}"
+
+
+def _crear_vista(base, tabla):
+    base.ejecutar(f"DROP VIEW IF EXISTS {_q(f'v_{tabla}')}")
+    base.ejecutar(f"CREATE VIEW {_q(f'v_{tabla}')} AS {sql_decodificado(base, tabla)}")
+
+
+# Pares (geo, TIME_PERIOD) con filas distintas entre dos versiones de una tabla de hechos, en una tabla temporal.
+# Devuelve su nombre, o None si la tabla no tiene esas columnas o ha cambiado su estructura (recálculo completo)
+def _claves_cambiadas(base, tabla, tabla_nueva):
+    if base.columnas(tabla) != base.columnas(tabla_nueva):
+        return None
+    anterior, nueva = sql_decodificado(base, tabla), sql_decodificado(base, tabla_nueva)
+    if not set(COLUMNAS_CLAVE) <= set(base.columnas(f"v_{tabla}")):
+        return None
+    claves = ", ".join(_q(c) for c in COLUMNAS_CLAVE)
+    nombre_cambios = f"_cambios_{tabla}"
+    base.ejecutar(f"DROP TABLE IF EXISTS {_q(nombre_cambios)}")
+    base.ejecutar(f"CREATE TABLE {_q(nombre_cambios)} AS "
+                  f"SELECT {claves} FROM (SELECT * FROM ({nueva}) n EXCEPT SELECT * FROM ({anterior}) a) nuevas "
+                  f"UNION SELECT {claves} FROM (SELECT * FROM ({anterior}) a EXCEPT SELECT * FROM ({nueva}) n) borradas")
+    return nombre_cambios
+
+
+# Carga (o recarga si ha cambiado su fichero) las tablas de una carpeta. Devuelve {tabla: cambios} de las
+# recargadas, con el nombre de la tabla de pares cambiados o None si hay que recalcular todo lo que depende de ella
+def cargar_tablas(base, carpeta, estado, forzar=False, hechos=True):
+    recargadas = {}
+    for ruta in listar_tablas(carpeta):
+        tabla = nombre_tabla(ruta)
+        clave_estado = f"fichero:{tabla}"
+        if not forzar and base.existe(tabla) and not ha_cambiado(ruta, estado.get(clave_estado)):
+            continue
+        # Tablas de hechos sin columnas (datasets sin hechos)
+        try:
+            df = leer_tabla(ruta)
+        except pd.errors.EmptyDataError:
+            continue
+        if df.columns.empty:
+            continue
+
+        existia = base.existe(tabla) and not forzar
+        base.cargar_dataframe(f"_nueva_{tabla}", df)
+        cambios = _claves_cambiadas(base, tabla, f"_nueva_{tabla}") if existia and hechos else None
+        base.ejecutar(f"DROP TABLE IF EXISTS {_q(tabla)}")
+        base.ejecutar(f"ALTER TABLE {_q(f'_nueva_{tabla}')} RENAME TO {_q(tabla)}")
+
+        if hechos:
+            base.indexar(tabla, [columna_clave(d) for d in ["geo", "time_period", "airpol"]] + COLUMNAS_INDICE)
+            _crear_vista(base, tabla)
+        else:
+            base.indexar(tabla, [c for c in base.columnas(tabla) if c.startswith("id_")][:1])
+        base.guardar_estado(clave_estado, huella_fichero(ruta, estado.get(clave_estado)))
+        recargadas[tabla] = cambios
+        print(f"📥 {tabla}: {len(df)} filas cargadas")
+    return recargadas
+
+
+def _firma(definicion):
+    return hashlib.sha256(json.dumps(definicion, sort_keys=True).encode()).hexdigest()
+
+
+# Relación con la que se sustituye un origen en el SQL de un agregado (filtrada a los pares cambiados)
+def _relacion(base, origen, claves=None):
+    relacion = _q(f"v_{origen}") if base.existe(f"v_{origen}") else _q(origen)
+    if claves is None:
+        return relacion
+    condicion = " AND ".join(f"c.{_q(c)} = r.{_q(c)}" for c in COLUMNAS_CLAVE)
+    return f"(SELECT * FROM {relacion} r WHERE EXISTS (SELECT 1 FROM {_q(claves)} c WHERE {condicion}))"
+
+
+# Actualiza los agregados afectados por los cambios. `cambios` = {tabla: tabla de pares cambiados o None}
+def actualizar_agregados(base, cambios, estado, forzar=False):
+    actualizados = {}
+    for nombre, definicion in AGREGADOS.items():
+        origenes = definicion["origenes"]
+        if not all(base.existe(o) for o in origenes):
+            print(f"⚠️  {nombre}: faltan tablas de origen ({', '.join(o for o in origenes if not base.existe(o))})")
+            continue
+
+        firma = _firma(definicion)
+        completo = (forzar or not base.existe(nombre) or estado.get(f"agregado:{nombre}") != firma
+                    or any(o in cambios and cambios[o] is None for o in origenes))
+        cambiados = [cambios[o] for o in origenes if o in cambios]
+        if not completo and not cambiados:
+            continue
+
+        if completo:
+            sql = definicion["sql"].format(**{o: _relacion(base, o) for o in origenes})
+            base.ejecutar(f"DROP TABLE IF EXISTS {_q(nombre)}")
+            base.ejecutar(f"CREATE TABLE {_q(nombre)} AS {sql}")
+            base.indexar(nombre, definicion.get("indice", COLUMNAS_INDICE))
+            cambios[nombre] = None
+            print(f"🧮 {nombre}: recalculado ({base.valor(f'SELECT COUNT(*) FROM {_q(nombre)}')} filas)")
+        else:
+            # Pares cambiados en cualquiera de los orígenes: se borran y se vuelven a calcular
+            claves = f"_cambios_{nombre}"
+            columnas = ", ".join(_q(c) for c in COLUMNAS_CLAVE)
+            base.ejecutar(f"DROP TABLE IF EXISTS {_q(claves)}")
+            base.ejecutar(f"CREATE TABLE {_q(claves)} AS "
+                          + " UNION ".join(f"SELECT {columnas} FROM {_q(c)}" for c in cambiados))
+            condicion = " AND ".join(f"c.{_q(c)} = {_q(nombre)}.{_q(c)}" for c in COLUMNAS_CLAVE)
+            base.ejecutar(f"DELETE FROM {_q(nombre)} WHERE EXISTS (SELECT 1 FROM {_q(claves)} c WHERE {condicion})")
+            sql = definicion["sql"].format(**{o: _relacion(base, o, claves) for o in origenes})
+            base.ejecutar(f"INSERT INTO {_q(nombre)} {sql}")
+            cambios[nombre] = claves
+            print(f"🔁 {nombre}: {base.valor(f'SELECT COUNT(*) FROM {_q(claves)}')} pares (geo, año) actualizados")
+
+        base.guardar_estado(f"agregado:{nombre}", firma)
+        actualizados[nombre] = "completo" if completo else "incremental"
+    return actualizados
+
+
+# Actualización de la base analítica: dimensiones, hechos que han cambiado y agregados afectados
+def actualizar_base(ruta=None, motor=None, forzar=False):
+    with medir("base_analitica"), BaseAnalitica(ruta, motor) as base:
+        estado = base.leer_estado()
+        dimensiones = cargar_tablas(base, CARPETA_DIM, estado, forzar, hechos=False)
+        # Si cambian las dimensiones las vistas se rehacen (pueden tener dimensiones nuevas)
+        if dimensiones:
+            for ruta_hechos in listar_tablas(CARPETA_FACT):
+                if base.existe(nombre_tabla(ruta_hechos)):
+                    _crear_vista(base, nombre_tabla(ruta_hechos))
+        cambios = cargar_tablas(base, CARPETA_FACT, estado, forzar)
+        agregados = actualizar_agregados(base, dict(cambios), estado, forzar)
+
+        # Las tablas temporales de pares cambiados ya no hacen falta
+        for tabla in list(cambios) + list(agregados):
+            base.ejecutar(f"DROP TABLE IF EXISTS {_q(f'_cambios_{tabla}')}")
+        anotar(tablas_recargadas=len(dimensiones) + len(cambios), agregados_actualizados=len(agregados))
+
+    print(f"✅ Base analítica actualizada en {base.ruta}")
+    return {"tablas": list(dimensiones) + list(cambios), "agregados": agregados}
+
+
+# Consulta sobre la base analítica (sólo lectura)
+def consultar(sql, parametros=(), ruta=None, motor=None):
+    with BaseAnalitica(ruta, motor) as base:
+        return base.consulta(sql, parametros)
+
+
+#Proceso de ejecución
+def main(forzar=False):
+    return actualizar_base(forzar=forzar)
+
+
+if __name__ == "__main__":
+    main()
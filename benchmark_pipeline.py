@@ -0,0 +1,289 @@
+'''
+Benchmark del pipeline ETL
+-----------------------------------------------------------------------
+
+Este script forma parte del pipeline ETL del TFM y mide el rendimiento de cada etapa (curado, estandarización y
+normalización) sobre datos sintéticos (`generador_sintetico.py`), para saber si un cambio en el código hace el
+pipeline más rápido o más lento:
+
+1. **Ejecución:**
+   - Para cada escala (`ETL_BENCH_FILAS`, filas totales separadas por comas, p. ej. `1e5,1e6`) se genera (o se
+     reutiliza) un árbol raw en `benchmarks/datos_<filas>` y se borran las salidas de ejecuciones anteriores.
+   - Cada etapa se lanza en un proceso aparte con esa carpeta como directorio de trabajo, igual que al ejecutar
+     los scripts a mano. Su salida se guarda en `benchmarks/datos_<filas>/benchmark_<etapa>.log`.
+   - Con `ETL_BENCH_PERFILADO=1` se mide también el data profiling.
+
+2. **Métricas por etapa:** tiempo (incluye arrancar Python e importar los módulos), filas y bytes de entrada y
+   salida, rendimiento (filas/s y MB/s de entrada) y pico de memoria del proceso (máximo RSS; sólo en sistemas
+   con `os.wait4`, en Windows queda vacío). La configuración `ETL_*` de la ejecución se guarda con las métricas.
+
+3. **Comparación con la línea base:**
+   - Cada ejecución se añade a `benchmarks/resultados.jsonl` y se compara con `benchmarks/linea_base.json`.
+   - Se marca como regresión cualquier etapa cuyo tiempo, pico de memoria o tamaño de salida empeore más de
+     `ETL_BENCH_TOLERANCIA` (10 % por defecto). Si hay regresiones el script termina con código 1.
+   - La primera ejecución de cada escala se guarda como línea base; `ETL_BENCH_GUARDAR_BASE=1` la sustituye por
+     la ejecución actual.
+
+'''
+
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from almacenamiento import abrir_csv, formato_de, listar_raw, listar_tablas
+from generador_sintetico import generar
+
+
+# Paths (relativos al árbol de datos sintéticos de cada escala)
+CARPETA_RAW_EUROSTAT = os.path.join("ficheros_raw", "eurostat")
+CARPETA_RAW_EEA = os.path.join("ficheros_raw", "eea")
+CARPETA_CURADO_EUROSTAT = os.path.join("ficheros_curado", "eurostat")
+CARPETA_CURADO_EEA = os.path.join("ficheros_curado", "eea")
+CARPETA_ESTANDARIZADOS = "ficheros_estandarizados"
+CARPETA_FACT = "ficheros_fact"
+CARPETA_DIM = "ficheros_dim"
+
+# Salidas que se borran antes de cada ejecución (todo menos los datos raw), incluidas las carpetas de gráficos del
+# perfilado con su caché, para no medir sólo aciertos de caché
+SALIDAS = ["ficheros_curado", CARPETA_ESTANDARIZADOS, CARPETA_FACT, CARPETA_DIM, ".etl_cache",
+           "data_resumen", "data_profilling", "graficos_*"]
+
+# Carpeta del benchmark y opciones
+CARPETA_BENCH = os.environ.get("ETL_BENCH_CARPETA", "benchmarks")
+ESCALAS = [int(float(f)) for f in os.environ.get("ETL_BENCH_FILAS", "1e5").split(",") if f.strip()]
+TOLERANCIA = float(os.environ.get("ETL_BENCH_TOLERANCIA", 0.10))
+GUARDAR_BASE = os.environ.get("ETL_BENCH_GUARDAR_BASE", "0") == "1"
+PERFILADO = os.environ.get("ETL_BENCH_PERFILADO", "0") == "1"
+
+RUTA_RESULTADOS = os.path.join(CARPETA_BENCH, "resultados.jsonl")
+RUTA_LINEA_BASE = os.path.join(CARPETA_BENCH, "linea_base.json")
+
+# Variables `ETL_*` que no son configuración: el identificador de la ejecución (`metricas.py`) cambia en cada una
+VARIABLES_NO_CONFIGURACION = ["ETL_ID_EJECUCION"]
+
+# Métricas que se comparan con la línea base (cuanto menor, mejor)
+METRICAS_COMPARADAS = ["tiempo_s", "pico_memoria_mb", "bytes_salida"]
+
+# Etapas en orden de ejecución: (nombre, módulo, carpetas de entrada, carpetas de salida)
+ETAPAS = [
+    ("curado_eurostat", "proceso_curado_eurostat", [CARPETA_RAW_EUROSTAT], [CARPETA_CURADO_EUROSTAT]),
+    ("curado_eea", "proceso_curado_eea", [CARPETA_RAW_EEA], [CARPETA_CURADO_EEA]),
+    ("estandarizacion", "proceso_estandarizacion", [CARPETA_CURADO_EUROSTAT, CARPETA_CURADO_EEA],
+     [CARPETA_ESTANDARIZADOS]),
+    ("normalizacion", "proceso_normalizacion", [CARPETA_ESTANDARIZADOS], [CARPETA_FACT, CARPETA_DIM]),
+]
+ETAPA_PERFILADO = ("perfilado", "proceso_data_profiling", [CARPETA_RAW_EUROSTAT, CARPETA_RAW_EEA],
+                   ["data_resumen", "data_profilling"])
+
+TAMANO_BLOQUE = 16 * 1024 * 1024
+
+
+# Filas de una tabla sin cargarla: saltos de línea en CSV (sin la cabecera) y metadatos en Parquet/Arrow
+def contar_filas(ruta):
+    formato = formato_de(ruta)
+    if formato == "parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(ruta).metadata.num_rows
+    if formato == "arrow":
+        import pyarrow as pa
+        with pa.memory_map(ruta) as fuente:
+            lector = pa.ipc.open_file(fuente)
+            return sum(lector.get_batch(i).num_rows for i in range(lector.num_record_batches))
+
+    lineas, ultimo = 0, b"\n"
+    with abrir_csv(ruta) as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b""):
+            lineas += bloque.count(b"\n")
+            ultimo = bloque[-1:]
+    # Última línea sin salto final
+    if ultimo != b"\n":
+        lineas += 1
+    return max(lineas - 1, 0)
+
+
+# Tablas de unas carpetas: las raw son siempre CSV (comprimidos o no) y el resto están en el formato intermedio
+def _tablas(carpetas):
+    tablas = []
+    for carpeta in carpetas:
+        if os.path.isdir(carpeta):
+            tablas += listar_raw(carpeta) if carpeta.startswith("ficheros_raw") else listar_tablas(carpeta)
+    return tablas
+
+
+# Bytes de todos los ficheros de unas carpetas
+def _bytes(carpetas):
+    total = 0
+    for carpeta in carpetas:
+        for raiz, _, ficheros in os.walk(carpeta):
+            total += sum(os.path.getsize(os.path.join(raiz, f)) for f in ficheros)
+    return total
+
+
+# Lanza un módulo (`modulo.main()`) en otro proceso. Devuelve (código de salida, pico de memoria en MB o None)
+def _ejecutar_proceso(modulo, carpeta, ruta_log):
+    entorno = dict(os.environ)
+    directorio_codigo = os.path.dirname(os.path.abspath(__file__))
+    entorno["PYTHONPATH"] = os.pathsep.join(filter(None, [directorio_codigo, entorno.get("PYTHONPATH")]))
+    with open(ruta_log, "w", encoding="utf-8") as log:
+        proceso = subprocess.Popen([sys.executable, "-c", f"import {modulo}; {modulo}.main()"], cwd=carpeta,
+                                   env=entorno, stdout=log, stderr=subprocess.STDOUT)
+        if not hasattr(os, "wait4"):
+            return proceso.wait(), None
+        _, estado, uso = os.wait4(proceso.pid, 0)
+        proceso.returncode = os.waitstatus_to_exitcode(estado)
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return proceso.returncode, round(uso.ru_maxrss / divisor, 1)
+
+
+# Ejecuta y mide una etapa en la carpeta de datos
+def medir_etapa(etapa, carpeta):
+    nombre, modulo, entradas, salidas = etapa
+    directorio = os.getcwd()
+    os.chdir(carpeta)
+    try:
+        tablas_entrada = _tablas(entradas)
+        filas_entrada = sum(contar_filas(t) for t in tablas_entrada)
+        bytes_entrada = _bytes(entradas)
+
+        inicio = time.perf_counter()
+        codigo, pico = _ejecutar_proceso(modulo, ".", f"benchmark_{nombre}.log")
+        tiempo = time.perf_counter() - inicio
+
+        filas_salida = sum(contar_filas(t) for t in _tablas(salidas))
+        bytes_salida = _bytes(salidas)
+    finally:
+        os.chdir(directorio)
+
+    return {
+        "etapa": nombre,
+        "codigo_salida": codigo,
+        "tiempo_s": round(tiempo, 3),
+        "filas_entrada": filas_entrada,
+        "filas_salida": filas_salida,
+        "bytes_entrada": bytes_entrada,
+        "bytes_salida": bytes_salida,
+        "filas_por_s": round(filas_entrada / tiempo, 1) if tiempo else None,
+        "mb_por_s": round(bytes_entrada / 1024 ** 2 / tiempo, 2) if tiempo else None,
+        "pico_memoria_mb": pico,
+    }
+
+
+# Configuración que afecta al rendimiento (se guarda con cada ejecución)
+def configuracion():
+    return {
+        "entorno": {v: os.environ[v] for v in sorted(os.environ)
+                    if v.startswith("ETL_") and not v.startswith("ETL_BENCH") and v not in VARIABLES_NO_CONFIGURACION},
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "cpus": os.cpu_count(),
+    }
+
+
+# Configuración ETL_* de un resultado (las líneas base antiguas pueden incluir variables que no son configuración)
+def _entorno(resultado):
+    return {v: valor for v, valor in resultado["configuracion"]["entorno"].items()
+            if v not in VARIABLES_NO_CONFIGURACION}
+
+
+# Benchmark completo de una escala: genera los datos, borra las salidas anteriores y mide cada etapa
+def ejecutar_benchmark(filas, etapas=None):
+    etapas = etapas or ETAPAS + ([ETAPA_PERFILADO] if PERFILADO else [])
+    carpeta = os.path.join(CARPETA_BENCH, f"datos_{filas}")
+    generar(carpeta, filas)
+    for salida in SALIDAS:
+        for ruta in glob.glob(os.path.join(carpeta, salida)):
+            shutil.rmtree(ruta, ignore_errors=True)
+
+    metricas = []
+    for etapa in etapas:
+        print(f"⏱️  {etapa[0]} ({filas} filas)...")
+        metricas.append(medir_etapa(etapa, carpeta))
+        if metricas[-1]["codigo_salida"] != 0:
+            print(f"❌ La etapa {etapa[0]} ha fallado, ver {carpeta}/benchmark_{etapa[0]}.log")
+            break
+
+    return {
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "filas": filas,
+        "configuracion": configuracion(),
+        "etapas": metricas,
+    }
+
+
+# Compara una ejecución con su línea base. Devuelve la tabla de comparación y la lista de regresiones
+def comparar(resultado, base, tolerancia=None):
+    tolerancia = TOLERANCIA if tolerancia is None else tolerancia
+    etapas_base = {m["etapa"]: m for m in base["etapas"]}
+    filas, regresiones = [], []
+    for actual in resultado["etapas"]:
+        anterior = etapas_base.get(actual["etapa"])
+        if anterior is None:
+            continue
+        for metrica in METRICAS_COMPARADAS:
+            if not actual.get(metrica) or not anterior.get(metrica):
+                continue
+            ratio = actual[metrica] / anterior[metrica]
+            estado = "regresión" if ratio > 1 + tolerancia else "mejora" if ratio < 1 - tolerancia else "igual"
+            filas.append({"etapa": actual["etapa"], "métrica": metrica, "base": anterior[metrica],
+                          "actual": actual[metrica], "ratio": round(ratio, 3), "estado": estado})
+            if estado == "regresión":
+                regresiones.append(f"{actual['etapa']}.{metrica}")
+    return pd.DataFrame(filas), regresiones
+
+
+def _cargar_lineas_base():
+    if not os.path.exists(RUTA_LINEA_BASE):
+        return {}
+    with open(RUTA_LINEA_BASE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+#Proceso de ejecución
+def main(escalas=None):
+    os.makedirs(CARPETA_BENCH, exist_ok=True)
+    lineas_base = _cargar_lineas_base()
+    regresiones = []
+
+    for filas in escalas or ESCALAS:
+        resultado = ejecutar_benchmark(filas)
+        with open(RUTA_RESULTADOS, "a", encoding="utf-8") as f:
+            f.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+        print(pd.DataFrame(resultado["etapas"]).to_string(index=False))
+
+        base = lineas_base.get(str(filas))
+        fallida = any(m["codigo_salida"] != 0 for m in resultado["etapas"])
+        if (base is None or GUARDAR_BASE) and fallida:
+            print(f"⚠️  Alguna etapa ha fallado: la ejecución no se guarda como línea base para {filas} filas.")
+            continue
+        if base is None or GUARDAR_BASE:
+            lineas_base[str(filas)] = resultado
+            print(f"📌 Línea base guardada para {filas} filas.")
+            continue
+        if _entorno(base) != _entorno(resultado):
+            print("⚠️  La configuración ETL_* es distinta a la de la línea base.")
+        tabla, regresiones_escala = comparar(resultado, base)
+        if not tabla.empty:
+            print(tabla.to_string(index=False))
+        regresiones += [f"{filas}:{r}" for r in regresiones_escala]
+
+    with open(RUTA_LINEA_BASE, "w", encoding="utf-8") as f:
+        json.dump(lineas_base, f, indent=2, ensure_ascii=False)
+
+    if regresiones:
+        print(f"❌ Regresiones respecto a la línea base: {regresiones}")
+    else:
+        print("✅ Sin regresiones respecto a la línea base.")
+    return regresiones
+
+
+if __name__ == "__main__":
+    sys.exit(1 if main() else 0)
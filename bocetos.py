@@ -0,0 +1,260 @@
+'''
+Resúmenes probabilísticos (sketches) para el perfilado por bloques
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y contiene las estructuras que usa `motor_perfilado.py` para
+perfilar ficheros que no caben en memoria. Todas ocupan una memoria fija (no dependen del número de filas), se
+actualizan con bloques completos (numpy/pandas vectorizado) y se pueden fusionar entre sí, de modo que un
+fichero se puede perfilar por partes. Cada una informa de la cota de error de su resultado:
+
+- `HyperLogLog`: valores distintos. Exacto hasta `LIMITE_EXACTO` distintos; a partir de ahí error relativo
+  típico de 1,04/√m (m = 2^precisión registros, 0,81 % con la precisión por defecto).
+- `CuantilesKLL`: cuantiles y mediana con compactadores al estilo KLL. Exacto mientras no se compacta; después
+  el error de rango está acotado por la suma de los pesos de las compactaciones, que se va acumulando.
+- `FrecuentesMG`: valores más frecuentes (Misra-Gries). La frecuencia real de cada valor está entre la estimada
+  y la estimada más el decremento acumulado.
+- `Momentos`: recuento, media y desviación con la actualización por bloques de Welford/Chan (exacto salvo
+  redondeo), más mínimo, máximo y ceros.
+
+'''
+
+import numpy as np
+import pandas as pd
+
+
+# Huellas de 64 bits de un array de valores
+def huellas_valores(valores):
+    return pd.util.hash_array(np.asarray(valores))
+
+
+class HyperLogLog:
+
+    PRECISION = 14
+    LIMITE_EXACTO = 2 ** 14
+
+    def __init__(self, precision=None):
+        self.precision = precision or self.PRECISION
+        self.m = 2 ** self.precision
+        self.registros = None
+        # Mientras hay pocos distintos se guardan sus huellas y el recuento es exacto
+        self.exactas = np.empty(0, dtype=np.uint64)
+
+    def actualizar(self, valores):
+        if len(valores):
+            self.actualizar_huellas(huellas_valores(valores))
+
+    def actualizar_huellas(self, huellas):
+        if self.registros is not None:
+            self._anotar(huellas)
+            return
+        self.exactas = np.union1d(self.exactas, huellas)
+        # Al superar el límite se pasa a estimar con los registros
+        if len(self.exactas) > self.LIMITE_EXACTO:
+            huellas, self.exactas = self.exactas, np.empty(0, dtype=np.uint64)
+            self.registros = np.zeros(self.m, dtype=np.uint8)
+            self._anotar(huellas)
+
+    def _anotar(self, huellas):
+        p = np.uint64(self.precision)
+        indices = (huellas >> (np.uint64(64) - p)).astype(np.int64)
+        # Bits restantes con un bit de guarda para que nunca sean cero
+        resto = (huellas << p) | (np.uint64(1) << (p - np.uint64(1)))
+        bits = np.floor(np.log2(resto.astype(np.float64))).astype(np.int64)
+        # La conversión a float puede redondear hacia la siguiente potencia de 2
+        bits[(resto >> bits.astype(np.uint64)) == 0] -= 1
+        rangos = (64 - bits).astype(np.uint8)
+        np.maximum.at(self.registros, indices, rangos)
+
+    def fusionar(self, otro):
+        if otro.registros is None:
+            self.actualizar_huellas(otro.exactas)
+        elif self.registros is None:
+            exactas = self.exactas
+            self.registros = otro.registros.copy()
+            self.exactas = np.empty(0, dtype=np.uint64)
+            self._anotar(exactas)
+        else:
+            np.maximum(self.registros, otro.registros, out=self.registros)
+        return self
+
+    @property
+    def exacto(self):
+        return self.registros is None
+
+    # Error relativo típico (0 si el recuento es exacto)
+    @property
+    def error_relativo(self):
+        return 0.0 if self.exacto else 1.04 / np.sqrt(self.m)
+
+    def estimar(self):
+        if self.exacto:
+            return len(self.exactas)
+        alfa = 0.7213 / (1 + 1.079 / self.m)
+        estimacion = alfa * self.m ** 2 / np.sum(np.ldexp(1.0, -self.registros.astype(np.int64)))
+        vacios = int(np.count_nonzero(self.registros == 0))
+        # Corrección para cardinalidades pequeñas (conteo lineal)
+        if estimacion <= 2.5 * self.m and vacios:
+            estimacion = self.m * np.log(self.m / vacios)
+        return int(round(estimacion))
+
+
+class CuantilesKLL:
+
+    CAPACIDAD = 2048
+
+    def __init__(self, capacidad=None, semilla=0):
+        self.capacidad = capacidad or self.CAPACIDAD
+        self.niveles = [np.empty(0)]
+        self.n = 0
+        # Cota del error de rango absoluto acumulado por las compactaciones
+        self.error_rango = 0
+        self.aleatorio = np.random.default_rng(semilla)
+
+    def actualizar(self, valores):
+        valores = np.asarray(valores, dtype=np.float64)
+        if len(valores) == 0:
+            return
+        self.n += len(valores)
+        self.niveles[0] = np.concatenate([self.niveles[0], valores])
+        self._compactar()
+
+    # Un nivel lleno se ordena y se conserva uno de cada dos elementos (con desplazamiento aleatorio), que pasan
+    # al nivel siguiente con el doble de peso. Cada compactación del nivel h cambia los rangos como mucho en 2^h
+    def _compactar(self):
+        nivel = 0
+        while nivel < len(self.niveles):
+            elementos = self.niveles[nivel]
+            if len(elementos) >= self.capacidad:
+                elementos = np.sort(elementos)
+                sobrante = elementos[-1:] if len(elementos) % 2 else elementos[:0]
+                pares = elementos[:len(elementos) - len(sobrante)]
+                conservados = pares[self.aleatorio.integers(2)::2]
+                self.niveles[nivel] = sobrante
+                if nivel + 1 == len(self.niveles):
+                    self.niveles.append(np.empty(0))
+                self.niveles[nivel + 1] = np.concatenate([self.niveles[nivel + 1], conservados])
+                self.error_rango += 2 ** nivel
+            nivel += 1
+
+    def fusionar(self, otro):
+        for nivel, elementos in enumerate(otro.niveles):
+            if nivel == len(self.niveles):
+                self.niveles.append(np.empty(0))
+            self.niveles[nivel] = np.concatenate([self.niveles[nivel], elementos])
+        self.n += otro.n
+        self.error_rango += otro.error_rango
+        self._compactar()
+        return self
+
+    @property
+    def exacto(self):
+        return self.error_rango == 0
+
+    # Cota del error de rango normalizado (fracción de filas) de cualquier cuantil
+    @property
+    def error_rango_relativo(self):
+        return self.error_rango / self.n if self.n else 0.0
+
+    def cuantil(self, q):
+        if self.n == 0:
+            return np.nan
+        if self.exacto:
+            return float(np.quantile(self.niveles[0], q))
+        valores = np.concatenate(self.niveles)
+        pesos = np.concatenate([np.full(len(e), 2 ** nivel) for nivel, e in enumerate(self.niveles)])
+        orden = np.argsort(valores, kind="stable")
+        acumulado = np.cumsum(pesos[orden])
+        posicion = min(np.searchsorted(acumulado, q * acumulado[-1]), len(valores) - 1)
+        return float(valores[orden][posicion])
+
+    def mediana(self):
+        return self.cuantil(0.5)
+
+
+class FrecuentesMG:
+
+    CAPACIDAD = 1000
+
+    def __init__(self, capacidad=None):
+        self.capacidad = capacidad or self.CAPACIDAD
+        self.conteos = pd.Series(dtype="int64")
+        # Cuánto puede faltar como mucho a cualquier conteo
+        self.decremento = 0
+
+    def actualizar(self, valores):
+        if len(valores) == 0:
+            return
+        self.actualizar_conteos(pd.Series(valores).value_counts(sort=False))
+
+    # Suma conteos ya agregados (Series valor → conteo)
+    def actualizar_conteos(self, conteos):
+        if len(self.conteos):
+            conteos = self.conteos.add(conteos, fill_value=0).astype("int64")
+        # Con más valores de los que caben se resta a todos el conteo del primero que no cabe
+        if len(conteos) > self.capacidad:
+            umbral = int(np.partition(conteos.to_numpy(), len(conteos) - self.capacidad - 1)[len(conteos) - self.capacidad - 1])
+            conteos = conteos - umbral
+            conteos = conteos[conteos > 0]
+            self.decremento += umbral
+        self.conteos = conteos
+
+    def fusionar(self, otro):
+        self.decremento += otro.decremento
+        self.actualizar_conteos(otro.conteos)
+        return self
+
+    @property
+    def exacto(self):
+        return self.decremento == 0
+
+    # Valor más frecuente (el menor en caso de empate) y su conteo estimado
+    def moda(self):
+        if self.conteos.empty:
+            return None, 0
+        maximo = int(self.conteos.max())
+        empatados = list(self.conteos.index[self.conteos.to_numpy() == maximo])
+        try:
+            return min(empatados), maximo
+        except TypeError:
+            return empatados[0], maximo
+
+
+class Momentos:
+
+    def __init__(self):
+        self.n = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.minimo = np.nan
+        self.maximo = np.nan
+        self.ceros = 0
+
+    def actualizar(self, valores):
+        valores = np.asarray(valores, dtype=np.float64)
+        if len(valores) == 0:
+            return
+        otro = Momentos()
+        otro.n = len(valores)
+        otro.media = float(valores.mean())
+        otro.m2 = float(((valores - otro.media) ** 2).sum())
+        otro.minimo = float(valores.min())
+        otro.maximo = float(valores.max())
+        otro.ceros = int(np.count_nonzero(valores == 0))
+        self.fusionar(otro)
+
+    # Combinación de dos conjuntos de momentos (Chan et al.)
+    def fusionar(self, otro):
+        if otro.n == 0:
+            return self
+        n = self.n + otro.n
+        delta = otro.media - self.media
+        self.media += delta * otro.n / n
+        self.m2 += otro.m2 + delta ** 2 * self.n * otro.n / n
+        self.n = n
+        self.minimo = np.fmin(self.minimo, otro.minimo)
+        self.maximo = np.fmax(self.maximo, otro.maximo)
+        self.ceros += otro.ceros
+        return self
+
+    def desviacion(self):
+        return float(np.sqrt(self.m2 / (self.n - 1))) if self.n > 1 else np.nan
@@ -0,0 +1,319 @@
+'''
+Captura de cambios (CDC) entre publicaciones de un dataset
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM. Cuando Eurostat vuelve a publicar un dataflow normalmente sólo
+cambian unos pocos años u observaciones revisadas, así que en lugar de volver a curar y normalizar el fichero
+completo se aplica sólo la diferencia (`ETL_CDC=1`):
+
+1. **Captura** (después de la descarga, `capturar_cambios`): el fichero raw nuevo se compara con la instantánea de
+   la publicación anterior (`ficheros_raw/cdc/<dataset>.instantanea.*`). Cada fila se identifica por la huella de
+   sus columnas clave (dimensiones + `TIME_PERIOD`, es decir, todas menos las de valor declaradas en el registro de
+   esquemas) y se compara la huella de la fila completa. El resultado es un delta
+   (`ficheros_raw/cdc/<dataset>.delta.*`) con las filas insertadas, actualizadas y borradas (éstas con sus valores
+   anteriores), registrado en `ficheros_raw/cdc/estado_cdc.json` con la versión (sha256 del raw) de la que parte y
+   la que alcanza.
+2. **Curado** (`aplicar_delta_curado`): si el fichero curado se generó a partir de la versión de la que parte el
+   delta, se quitan de él las filas de las claves actualizadas o borradas y se añaden las filas nuevas, curadas con
+   las mismas reglas. El delta curado se guarda junto al fichero curado para la normalización.
+3. **Normalización** (`delta_normalizacion`): si la tabla de hechos se generó a partir de esa misma versión, se
+   aplica el delta curado sobre ella de la misma forma.
+
+Cada salida guarda en `<carpeta>/.cdc/<tabla>.json` la versión del raw con la que se generó y su huella (también sin
+`ETL_CDC`: el curado independiente lo usa, junto a la huella de su código, para omitir los ficheros cuyo raw no ha
+cambiado, `salida_al_dia`). Si algo no
+cuadra (no hay delta, la salida se ha modificado por otro camino, las claves no son únicas, cambian las columnas...)
+la etapa procesa el fichero completo como siempre. El orden de las filas de una salida actualizada con un delta
+puede ser distinto al de un procesado completo; su contenido es el mismo.
+
+Uso independiente: `python captura_cambios.py` captura los cambios de todos los ficheros raw.
+
+'''
+
+import hashlib
+import importlib.util
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from almacenamiento import (EXTENSIONES, LECTOR_CSV, aplicar_esquema, cabecera_csv, escribir_tabla,
+                            leer_csv_por_bloques, leer_tabla, listar_raw, nombre_tabla, ruta_tabla)
+from esquemas_datasets import columnas_valor, esquema_de, opciones_lectura
+from huellas import cargar_estado, guardar_estado, ha_cambiado, huella_fichero, huella_modulo
+from metricas import anotar
+
+
+# Aplicar los cambios de forma incremental (ETL_CDC=1)
+CDC_ACTIVO = os.environ.get("ETL_CDC", "0") == "1"
+
+# Paths
+CARPETAS_RAW = [os.path.join("ficheros_raw", "eurostat"), os.path.join("ficheros_raw", "eea")]
+CARPETAS_CURADO = [os.path.join("ficheros_curado", "eurostat"), os.path.join("ficheros_curado", "eea")]
+CARPETA_CDC = os.path.join("ficheros_raw", "cdc")
+RUTA_ESTADO = os.path.join(CARPETA_CDC, "estado_cdc.json")
+CARPETA_VERSIONES = ".cdc"
+
+# Instantáneas y deltas en Parquet si está pyarrow (el texto se comprime mucho); si no, en CSV
+FORMATO_CDC = "parquet" if importlib.util.find_spec("pyarrow") is not None else "csv"
+
+# Columna con el tipo de cambio de cada fila del delta
+COLUMNA_CAMBIO = "_cambio"
+INSERCION = "insercion"
+ACTUALIZACION = "actualizacion"
+BORRADO = "borrado"
+
+# Filas por bloque al leer un raw como texto
+FILAS_BLOQUE = 500_000
+
+
+# Representación en texto de una columna para calcular huellas con independencia del tipo con el que se haya leído
+# (categorías, enteros leídos como decimales por tener vacíos...)
+def texto_normalizado(serie):
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        serie = serie.astype(serie.cat.categories.dtype)
+    if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+        serie = serie.astype("Int64")
+    return serie.astype("string").fillna("")
+
+
+# Huella (uint64) de cada fila de un DataFrame sobre las columnas indicadas
+def huellas_filas(df, columnas):
+    if df.empty:
+        return np.empty(0, dtype=np.uint64)
+    texto = pd.DataFrame({c: texto_normalizado(df[c]) for c in columnas}, index=df.index)
+    return pd.util.hash_pandas_object(texto, index=False).to_numpy()
+
+
+# Unión de las filas que se conservan de una tabla y las nuevas o actualizadas del delta, manteniendo como
+# categorías las columnas que lo eran en la tabla (con las categorías nuevas del delta al final)
+def concatenar(conservadas, altas):
+    df = pd.concat([conservadas, altas], ignore_index=True)
+    for col in conservadas.columns:
+        if isinstance(conservadas[col].dtype, pd.CategoricalDtype) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            categorias = conservadas[col].cat.categories
+            nuevas = pd.Index(altas[col].dropna().unique()).difference(categorias, sort=False)
+            df[col] = pd.Categorical(df[col], categories=categorias.append(nuevas))
+    return df
+
+
+# Columnas clave de un dataset: todas menos las de valor de su esquema
+def columnas_clave(nombre, columnas):
+    valor = set(columnas_valor(nombre))
+    return [c for c in columnas if c not in valor and c != COLUMNA_CAMBIO]
+
+
+def _ruta_cdc(nombre, tipo):
+    return ruta_tabla(CARPETA_CDC, f"{nombre}.{tipo}", FORMATO_CDC)
+
+
+# Lectura de un raw con todas las columnas como texto
+def _leer_texto(ruta):
+    opciones = opciones_lectura(nombre_tabla(ruta))
+    if LECTOR_CSV == "arrow":
+        bloques = list(leer_csv_por_bloques(ruta, FILAS_BLOQUE, como_texto=True, **opciones))
+        if bloques:
+            return pd.concat(bloques, ignore_index=True)
+        return pd.DataFrame(columns=cabecera_csv(ruta, **opciones), dtype=str)
+    return pd.read_csv(ruta, dtype=str, **opciones)
+
+
+# Lectura de una instantánea o un delta (todo texto)
+def _leer_cdc(ruta):
+    if FORMATO_CDC == "parquet":
+        return pd.read_parquet(ruta)
+    return pd.read_csv(ruta, dtype=str)
+
+
+# Delta entre dos versiones de un dataset leídas como texto. Devuelve (delta, motivo): el delta es None si no se
+# puede calcular y el motivo lo explica
+def calcular_delta(nombre, anterior, nuevo):
+    if list(anterior.columns) != list(nuevo.columns):
+        return None, "columnas_distintas"
+    anterior, nuevo = anterior.drop_duplicates(), nuevo.drop_duplicates()
+    claves = columnas_clave(nombre, list(nuevo.columns))
+    claves_anterior, claves_nuevo = huellas_filas(anterior, claves), huellas_filas(nuevo, claves)
+    if pd.Series(claves_anterior).duplicated().any() or pd.Series(claves_nuevo).duplicated().any():
+        return None, "claves_duplicadas"
+
+    todas = list(nuevo.columns)
+    filas_anterior = pd.Series(huellas_filas(anterior, todas), index=claves_anterior)
+    filas_nuevo = huellas_filas(nuevo, todas)
+
+    existia = np.isin(claves_nuevo, claves_anterior)
+    insertadas = ~existia
+    actualizadas = existia.copy()
+    actualizadas[existia] = filas_anterior.reindex(claves_nuevo[existia]).to_numpy() != filas_nuevo[existia]
+    borradas = ~np.isin(claves_anterior, claves_nuevo)
+
+    partes = [nuevo[insertadas].assign(**{COLUMNA_CAMBIO: INSERCION}),
+              nuevo[actualizadas].assign(**{COLUMNA_CAMBIO: ACTUALIZACION}),
+              anterior[borradas].assign(**{COLUMNA_CAMBIO: BORRADO})]
+    delta = pd.concat(partes, ignore_index=True)
+    return delta[[COLUMNA_CAMBIO] + todas], None
+
+
+# Captura de los cambios de un fichero raw respecto a su instantánea anterior. Devuelve la entrada del estado CDC
+def capturar_cambios(ruta_raw, estado=None):
+    nombre = nombre_tabla(ruta_raw)
+    estado = cargar_estado(RUTA_ESTADO) if estado is None else estado
+    anterior = estado.get(nombre, {})
+    huella = huella_fichero(ruta_raw, anterior.get("huella"))
+    if huella["sha256"] == anterior.get("version") and os.path.exists(_ruta_cdc(nombre, "instantanea")):
+        return anterior
+
+    nuevo = _leer_texto(ruta_raw)
+    entrada = {"huella": huella, "version": huella["sha256"], "filas": len(nuevo),
+               "fecha": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")}
+    ruta_delta = _ruta_cdc(nombre, "delta")
+    if os.path.exists(ruta_delta):
+        os.remove(ruta_delta)
+
+    ruta_instantanea = _ruta_cdc(nombre, "instantanea")
+    if anterior.get("version") and os.path.exists(ruta_instantanea):
+        delta, motivo = calcular_delta(nombre, _leer_cdc(ruta_instantanea), nuevo)
+        if delta is None:
+            entrada["estado"] = motivo
+        else:
+            escribir_tabla(delta, CARPETA_CDC, f"{nombre}.delta", FORMATO_CDC)
+            cambios = delta[COLUMNA_CAMBIO].value_counts()
+            entrada.update(estado="delta", base=anterior["version"], delta=ruta_delta,
+                           **{tipo: int(cambios.get(tipo, 0)) for tipo in [INSERCION, ACTUALIZACION, BORRADO]})
+    else:
+        entrada["estado"] = "inicial"
+
+    os.makedirs(CARPETA_CDC, exist_ok=True)
+    escribir_tabla(nuevo, CARPETA_CDC, f"{nombre}.instantanea", FORMATO_CDC)
+    estado[nombre] = entrada
+    return entrada
+
+
+# Delta pendiente de aplicar a una salida generada a partir de la versión `version` del raw `ruta_raw`: sólo si el
+# raw sigue siendo la versión que alcanza el delta
+def delta_pendiente(ruta_raw, version):
+    entrada = cargar_estado(RUTA_ESTADO).get(nombre_tabla(ruta_raw), {})
+    if (not version or entrada.get("estado") != "delta" or entrada.get("base") != version
+            or not os.path.exists(entrada.get("delta", ""))):
+        return None
+    if huella_fichero(ruta_raw, entrada.get("huella"))["sha256"] != entrada["version"]:
+        return None
+    return entrada
+
+
+# Versión del raw con la que se generó una salida (None si no se registró o la salida ha cambiado desde entonces)
+def leer_version(carpeta, nombre, ruta_salida):
+    registro = cargar_estado(os.path.join(carpeta, CARPETA_VERSIONES, f"{nombre}.json"))
+    if not registro or ha_cambiado(ruta_salida, registro.get("salida")):
+        return None
+    return registro
+
+
+# Registra la versión del raw con la que se ha generado una salida (y, si se aplicó un delta, de qué versión partía
+# y dónde está el delta ya procesado)
+def registrar_version(carpeta, nombre, ruta_salida, version, **extra):
+    registro = {"version": version, "salida": huella_fichero(ruta_salida), **extra}
+    guardar_estado(registro, os.path.join(carpeta, CARPETA_VERSIONES, f"{nombre}.json"))
+
+
+# Versión del raw de la que parte un fichero curado (registrada por el curado), buscándolo en las carpetas de curado
+def version_curado(nombre):
+    for carpeta in CARPETAS_CURADO:
+        for extension in EXTENSIONES.values():
+            ruta = os.path.join(carpeta, f"{nombre}{extension}")
+            if os.path.exists(ruta):
+                return leer_version(carpeta, nombre, ruta)
+    return None
+
+
+# Versión del raw de un fichero (sha256)
+def version_raw(ruta_raw):
+    return huella_fichero(ruta_raw)["sha256"]
+
+
+# Versión del código de una etapa: huella conjunta de sus módulos
+def version_codigo(modulos):
+    return hashlib.sha256("".join(huella_modulo(m) for m in modulos).encode()).hexdigest()
+
+
+# Indica si la salida `carpeta/nombre` existe, no se ha modificado y se generó con la versión `codigo` del código a
+# partir del contenido actual del raw
+def salida_al_dia(carpeta, nombre, ruta_salida, archivo, codigo):
+    registro = leer_version(carpeta, nombre, ruta_salida)
+    return (bool(registro and registro.get("version")) and registro.get("codigo") == codigo
+            and version_raw(archivo) == registro["version"])
+
+
+# Aplica al fichero curado `carpeta/nombre` el delta pendiente del raw `archivo`. `preparar` aplica a las filas del
+# delta (ya con los tipos del esquema) las reglas de curado y conserva la columna del tipo de cambio.
+# Devuelve False si no hay delta que aplicar y hay que curar el fichero completo
+def aplicar_delta_curado(archivo, carpeta, nombre, preparar):
+    if not CDC_ACTIVO:
+        return False
+    ruta = ruta_tabla(carpeta, nombre)
+    version = leer_version(carpeta, nombre, ruta)
+    entrada = delta_pendiente(archivo, version and version.get("version"))
+    if entrada is None:
+        return False
+
+    import pyarrow as pa
+
+    delta = _leer_cdc(entrada["delta"])
+    tabla = pa.Table.from_pandas(delta, preserve_index=False)
+    tabla = tabla.cast(pa.schema([(c, pa.string()) for c in tabla.column_names]))
+    tipado, apartadas = aplicar_esquema(tabla, esquema_de(nombre))
+    claves = columnas_clave(nombre, list(tipado.columns))
+
+    actual = leer_tabla(ruta)
+    if list(actual.columns) != [c for c in tipado.columns if c != COLUMNA_CAMBIO]:
+        return False
+    quitar = huellas_filas(tipado[tipado[COLUMNA_CAMBIO] != INSERCION], claves)
+    conservadas = actual[~np.isin(huellas_filas(actual, claves), quitar)]
+
+    curadas = preparar(tipado)
+    altas = curadas[curadas[COLUMNA_CAMBIO] != BORRADO].drop(columns=COLUMNA_CAMBIO)
+    df = concatenar(conservadas, altas)
+    escribir_tabla(df, carpeta, nombre)
+
+    carpeta_versiones = os.path.join(carpeta, CARPETA_VERSIONES)
+    os.makedirs(carpeta_versiones, exist_ok=True)
+    ruta_delta = escribir_tabla(curadas, carpeta_versiones, f"{nombre}.delta")
+    registrar_version(carpeta, nombre, ruta, entrada["version"], base=entrada["base"], delta=ruta_delta)
+    anotar(modo="cdc", filas_leidas=len(delta), filas_cuarentena=len(apartadas),
+           **{tipo: entrada.get(tipo, 0) for tipo in [INSERCION, ACTUALIZACION, BORRADO]},
+           filas_quitadas=len(actual) - len(conservadas), filas_escritas=len(df))
+    return True
+
+
+# Delta curado que se puede aplicar a una tabla de hechos generada a partir de la versión `version_hechos` del raw
+# de `nombre`. Devuelve (registro del curado, DataFrame del delta curado) o None
+def delta_curado(nombre, version_hechos):
+    if not CDC_ACTIVO or not version_hechos:
+        return None
+    curado = version_curado(nombre)
+    if not curado or curado.get("base") != version_hechos or not os.path.exists(curado.get("delta", "")):
+        return None
+    return curado, leer_tabla(curado["delta"])
+
+
+# Captura de los cambios de todos los ficheros raw (o de `archivos`)
+def main(archivos=None):
+    if archivos is None:
+        archivos = sorted(ruta for carpeta in CARPETAS_RAW for ruta in listar_raw(carpeta))
+    estado = cargar_estado(RUTA_ESTADO)
+    for archivo in archivos:
+        version = estado.get(nombre_tabla(archivo), {}).get("version")
+        entrada = capturar_cambios(archivo, estado)
+        if entrada.get("version") == version:
+            continue
+        if entrada["estado"] == "delta":
+            print(f"🔀 {nombre_tabla(archivo)}: {entrada[INSERCION]} inserciones, {entrada[ACTUALIZACION]} "
+                  f"actualizaciones y {entrada[BORRADO]} borrados")
+        else:
+            print(f"📸 {nombre_tabla(archivo)}: instantánea guardada ({entrada['estado']})")
+    guardar_estado(estado, RUTA_ESTADO)
+    return estado
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+'''
+Catálogo de datasets del pipeline ETL
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y reúne en un único sitio la definición de cada dataset:
+de dónde se descarga, qué filtros se aplican en el servidor y con qué nombre acaba su tabla de hechos.
+Sustituye a la lista `dataset_urls` de `proceso_descarga_api.py` y al diccionario `nombres_fact` de
+`proceso_normalizacion.py`, que ahora se generan a partir de aquí.
+
+Campos de cada entrada (la clave es el identificador del dataflow / nombre del fichero sin extensión):
+- `fact`: sufijo de la tabla de hechos (`fact_<fact>.csv`).
+- `fuente`: `eurostat` o `eea`.
+- `api`: URL base de la API SDMX 3.0 (Eurostat general o Comext). Sin `api` ni `url` el dataset no se descarga.
+- `url`: URL fija para fuentes que no son SDMX.
+- `filtros`: filtros por dimensión que se envían a la API (`c[dim]=valor1,valor2`). Ejemplos:
+  `{"freq": "A"}`, `{"freq": "A", "geo": ["ES", "FR", "EU27_2020"]}`, `{"airpol": "GHG"}`.
+- `inicio` / `fin`: primer y último año pedidos (`c[TIME_PERIOD]=ge:<inicio>+le:<fin>`).
+- `particiones`: columnas por las que se particiona su tabla de hechos cuando se escriben particionadas
+  (`ETL_FACT_PARTICIONADO=1`, ver `particionado.py`). Por defecto `PARTICIONES_POR_DEFECTO`.
+
+Los filtros se aplican en el servidor, así que sólo se transfieren, descomprimen y leen las observaciones necesarias.
+
+'''
+
+
+# URLs base de la API SDMX 3.0 de Eurostat
+URL_API_EUROSTAT = "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT"
+URL_API_COMEXT = "https://ec.europa.eu/eurostat/api/comext/dissemination/sdmx/3.0/data/dataflow/ESTAT"
+VERSION_DATAFLOW = "1.0"
+
+# Parámetros comunes: CSV SDMX 2.0 comprimido con etiquetas en inglés
+PARAMETROS_SDMX = "compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name"
+
+# Sólo se usan datos anuales (antes se filtraban en `proceso_curado_eurostat.py` tras descargarlo todo)
+FILTRO_ANUAL = {"freq": "A"}
+
+# Columnas de partición de las tablas de hechos que no indican otras
+PARTICIONES_POR_DEFECTO = ["TIME_PERIOD"]
+
+
+# Catálogo de datasets. Ver excel "dataset"
+CATALOGO = {
+    "env_ac_ainah_r2": {"fact": "aea", "fuente": "eurostat", "api": URL_API_EUROSTAT, "filtros": FILTRO_ANUAL,
+                        "particiones": ["TIME_PERIOD", "geo"]},
+    "sdg_13_10": {"fact": "ghe", "fuente": "eurostat", "api": URL_API_EUROSTAT, "filtros": FILTRO_ANUAL},
+    "env_ac_aeint_r2": {"fact": "aei", "fuente": "eurostat", "api": URL_API_EUROSTAT, "filtros": FILTRO_ANUAL},
+    "nrg_ind_fecf": {"fact": "share_energy_cons", "fuente": "eurostat", "api": URL_API_EUROSTAT, "filtros": FILTRO_ANUAL},
+    "sdg_07_10": {"fact": "energy_cons", "fuente": "eurostat", "api": URL_API_EUROSTAT, "filtros": FILTRO_ANUAL},
+    "nrg_ind_ren": {"fact": "share_ren", "fuente": "eurostat", "api": URL_API_EUROSTAT, "filtros": FILTRO_ANUAL},
+    "sdg_13_40": {"fact": "losses", "fuente": "eurostat", "api": URL_API_EUROSTAT, "filtros": FILTRO_ANUAL},
+    "ds-059331$defaultview": {"fact": "import_export", "fuente": "eurostat", "api": URL_API_COMEXT, "filtros": FILTRO_ANUAL},
+    "nama_10_gdp": {"fact": "gdp", "fuente": "eurostat", "api": URL_API_EUROSTAT, "filtros": FILTRO_ANUAL},
+    "datahubitem-view": {"fuente": "eea", "url": "https://www.eea.europa.eu/en/datahub/datahubitem-view/6f1efaf1-ae32-48cb-b962-0891f84b1f5f"},
+    "nrg_ind_eff": {"fact": "eff", "fuente": "eurostat", "api": URL_API_EUROSTAT, "filtros": FILTRO_ANUAL},
+    # Datasets que no se descargan desde la API pero sí se normalizan
+    "env_ac_aibrid_r2": {"fact": "aea_brid", "fuente": "eurostat"},
+    "UNFCCC_v28_3": {"fact": "ghg_unfccc", "fuente": "eea", "particiones": ["TIME_PERIOD", "geo"]},
+}
+
+
+# Función para construir la URL de descarga de un dataset con sus filtros de clave y periodo
+def construir_url(dataset_id, entrada=None):
+    entrada = entrada if entrada is not None else CATALOGO[dataset_id]
+    if entrada.get("url"):
+        return entrada["url"]
+
+    filtros = []
+    for dimension, valores in entrada.get("filtros", {}).items():
+        if isinstance(valores, (list, tuple, set)):
+            valores = ",".join(valores)
+        filtros.append(f"c[{dimension}]={valores}")
+
+    periodo = []
+    if entrada.get("inicio") is not None:
+        periodo.append(f"ge:{entrada['inicio']}")
+    if entrada.get("fin") is not None:
+        periodo.append(f"le:{entrada['fin']}")
+    if periodo:
+        filtros.append(f"c[TIME_PERIOD]={'+'.join(periodo)}")
+
+    query = "&".join(filtros + [PARAMETROS_SDMX])
+    return f"{entrada['api']}/{dataset_id}/{VERSION_DATAFLOW}?{query}"
+
+
+# Datasets que se descargan: {identificador: url}
+def urls_descarga(catalogo=CATALOGO):
+    return {
+        dataset_id: construir_url(dataset_id, entrada)
+        for dataset_id, entrada in catalogo.items()
+        if entrada.get("api") or entrada.get("url")
+    }
+
+
+# Diccionario de nombres de las tablas de hechos usado en `proceso_normalizacion.py`
+nombres_fact = {dataset_id: entrada["fact"] for dataset_id, entrada in CATALOGO.items() if entrada.get("fact")}
+
+
+# Columnas de partición de la tabla de hechos de un dataset
+def particiones_de(dataset_id, catalogo=CATALOGO):
+    return list(catalogo.get(dataset_id, {}).get("particiones", PARTICIONES_POR_DEFECTO))
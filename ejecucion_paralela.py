@@ -0,0 +1,87 @@
+'''
+Ejecución en paralelo de las etapas que trabajan fichero a fichero
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM. El curado, la estandarización y la normalización
+procesan cada fichero de forma independiente, así que pueden repartirse entre varios procesos
+(`ProcessPoolExecutor`) para aprovechar todos los núcleos de la máquina.
+
+- El número de procesos se configura con la variable de entorno `ETL_WORKERS` (por defecto 1, en serie).
+- Los errores no detienen la etapa: se recogen por fichero y se devuelven junto a los resultados.
+- Con `etapa`, cada fichero y la etapa completa se miden y se registran en el fichero de métricas
+  (`metricas.py`), incluidos los errores.
+
+'''
+
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+from tqdm import tqdm
+
+from metricas import anotar, medir, registrar_error
+
+
+# Número de procesos por defecto (1 = ejecución en serie, como el pipeline original)
+WORKERS = int(os.environ.get("ETL_WORKERS", 1))
+
+
+# Envoltorio que mide un fichero y captura su error para devolverlo al proceso principal
+def _ejecutar_seguro(funcion, archivo, etapa=None):
+    try:
+        with medir(etapa, archivo) if etapa else nullcontext():
+            return funcion(archivo), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+
+
+# Ejecuta `funcion(archivo)` para cada fichero, en serie o en un pool de procesos. Con `etapa` se registran
+# las métricas de cada fichero y de la etapa completa.
+# Devuelve dos diccionarios: {archivo: resultado} de los correctos y {archivo: error} de los fallidos
+def ejecutar_por_archivo(funcion, archivos, workers=None, desc=None, etapa=None):
+    workers = workers or WORKERS
+    with medir(etapa, ficheros=len(archivos), workers=workers) if etapa else nullcontext():
+        resultados, errores = _ejecutar_todos(funcion, archivos, workers, desc, etapa)
+        if etapa:
+            anotar(ficheros_con_error=len(errores))
+    return resultados, errores
+
+
+def _ejecutar_todos(funcion, archivos, workers, desc, etapa):
+    resultados, errores = {}, {}
+
+    if workers <= 1 or len(archivos) <= 1:
+        for archivo in tqdm(archivos, desc=desc):
+            resultado, error = _ejecutar_seguro(funcion, archivo, etapa)
+            if error is None:
+                resultados[archivo] = resultado
+            else:
+                errores[archivo] = error
+        return resultados, errores
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(archivos))) as executor:
+        futuros = {executor.submit(_ejecutar_seguro, funcion, archivo, etapa): archivo for archivo in archivos}
+        for futuro in tqdm(as_completed(futuros), total=len(futuros), desc=desc):
+            archivo = futuros[futuro]
+            try:
+                resultado, error = futuro.result()
+            except Exception as e:
+                # El proceso hijo murió o el resultado no se pudo serializar
+                resultado, error = None, f"{type(e).__name__}: {e}"
+                if etapa:
+                    registrar_error(etapa, archivo, error)
+            if error is None:
+                resultados[archivo] = resultado
+            else:
+                errores[archivo] = error
+    return resultados, errores
+
+
+# Resumen de los errores de una etapa
+def informar_errores(errores, etapa):
+    if not errores:
+        return
+    print(f"❌ {len(errores)} fichero(s) con errores en {etapa}:")
+    for archivo, error in sorted(errores.items()):
+        print(f"   - {archivo}: {error.splitlines()[0]}")
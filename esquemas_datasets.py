@@ -0,0 +1,127 @@
+'''
+Registro de esquemas de los datasets del pipeline ETL
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y define, para cada dataset del catálogo (`catalogo_datasets.py`)
+y para los ficheros de la EEA, cómo se leen sus CSV: separador, tipo de cada columna y valores que cuentan como
+vacíos. Lo usa el lector CSV de `almacenamiento.py` para no tener que inferir los tipos en cada lectura.
+
+Campos de cada esquema:
+- `sep`: separador del fichero raw (los ficheros intermedios se escriben siempre con comas).
+- `tipos`: tipo de cada columna conocida:
+  - `entero`: entero con vacíos (`Int64`), p. ej. `TIME_PERIOD` o `Year`.
+  - `decimal`: `float64`, p. ej. `OBS_VALUE` o `emissions`.
+  - `categoria`: códigos y etiquetas con pocos valores distintos (`category`).
+  - `texto`: texto libre.
+- `defecto`: tipo de las columnas que no aparecen en `tipos`.
+- `nulos`: valores que, además de los vacíos habituales (`""`, `NA`, `NaN`...), se leen como vacíos. En Eurostat
+  `:` indica un dato no disponible.
+- `banderas`: si los valores numéricos pueden llevar detrás una bandera de Eurostat separada por un espacio
+  (`12.3 p`, `: c`). La bandera se descarta al convertir el valor (en los CSV SDMX ya viene en `OBS_FLAG`).
+- `valores`: columnas de valor (observación, banderas, notas...). El resto son las columnas clave que identifican
+  cada fila, las que usa la captura de cambios (`captura_cambios.py`).
+
+Las filas con un valor que no se puede convertir al tipo de su columna (o con un número de campos distinto al de
+la cabecera) no abortan la lectura: se apartan a un fichero de cuarentena (ver `almacenamiento.py`).
+
+'''
+
+from catalogo_datasets import CATALOGO
+
+
+# Tipos de columna admitidos en los esquemas (el registro se comprueba al importar el módulo)
+TIPOS = ["entero", "decimal", "categoria", "texto"]
+
+# Esquema de los CSV SDMX 2.0 de Eurostat: columnas de dimensión (código + etiqueta), periodo, valor y banderas
+ESQUEMA_SDMX = {
+    "sep": ",",
+    "tipos": {
+        "STRUCTURE": "categoria", "STRUCTURE_ID": "categoria", "STRUCTURE_NAME": "categoria",
+        "freq": "categoria", "Time frequency": "categoria",
+        "geo": "categoria", "Geopolitical entity (reporting)": "categoria",
+        "unit": "categoria", "Unit of measure": "categoria",
+        "TIME_PERIOD": "entero", "Time": "categoria",
+        "OBS_VALUE": "decimal", "Observation value": "categoria",
+        "OBS_FLAG": "categoria", "Observation status (Flag) V2 structure": "categoria",
+        "CONF_STATUS": "categoria", "Confidentiality status (flag)": "categoria",
+    },
+    # El resto de columnas son las dimensiones propias de cada dataset (airpol, nace_r2, na_item...) y sus etiquetas
+    "defecto": "categoria",
+    "nulos": [":"],
+    "banderas": True,
+    "valores": ["OBS_VALUE", "Observation value", "OBS_FLAG", "Observation status (Flag) V2 structure",
+                "CONF_STATUS", "Confidentiality status (flag)"],
+}
+
+# Inventario de gases de efecto invernadero (UNFCCC) de la EEA
+ESQUEMA_UNFCCC = {
+    "sep": ",",
+    "tipos": {
+        "Country_code": "categoria", "Country": "categoria", "Format_name": "categoria",
+        "Pollutant_name": "categoria", "Sector_code": "categoria", "Sector_name": "categoria",
+        "Parent_sector_code": "categoria", "Unit": "categoria", "Year": "entero", "emissions": "decimal",
+        "Notation": "categoria", "PublicationDate": "texto", "DataSource": "categoria",
+    },
+    "defecto": "texto",
+    "nulos": [],
+    "banderas": False,
+    "valores": ["emissions", "Notation", "PublicationDate", "DataSource"],
+}
+
+# Base de datos del régimen de comercio de derechos de emisión (ETS) de la EEA, separada por tabuladores.
+# `year` se lee como texto porque incluye filas de totales ("Total 2005-2020") que se eliminan en el curado
+ESQUEMA_ETS = {
+    "sep": "\t",
+    "tipos": {
+        "country_code": "categoria", "country": "categoria", "main activity sector name": "categoria",
+        "ETS information": "categoria", "unit": "categoria", "value": "decimal", "year": "texto",
+    },
+    "defecto": "texto",
+    "nulos": [],
+    "banderas": False,
+    "valores": ["value"],
+}
+
+# Columnas de valor de los datasets sin esquema
+VALORES_POR_DEFECTO = ["OBS_VALUE", "OBS_FLAG", "CONF_STATUS"]
+
+# Registro de esquemas: {nombre del fichero sin extensión: esquema}
+ESQUEMAS = {dataset_id: ESQUEMA_SDMX for dataset_id, entrada in CATALOGO.items() if entrada["fuente"] == "eurostat"}
+ESQUEMAS.update({
+    "UNFCCC_v28_3": ESQUEMA_UNFCCC,
+    "ETS_Database_v51_May23": ESQUEMA_ETS,
+})
+
+
+# Comprueba que todos los tipos de un esquema (los de sus columnas y el de por defecto) son tipos admitidos
+def validar_esquema(nombre, esquema):
+    tipos = dict(esquema["tipos"], **{"(defecto)": esquema.get("defecto", "texto")})
+    desconocidos = {columna: tipo for columna, tipo in tipos.items() if tipo not in TIPOS}
+    if desconocidos:
+        raise ValueError(f"Tipos no admitidos en el esquema de {nombre}: {desconocidos}. Opciones: {TIPOS}")
+
+
+for nombre_esquema, esquema_registrado in ESQUEMAS.items():
+    validar_esquema(nombre_esquema, esquema_registrado)
+
+
+# Esquema de un dataset (None si no está registrado: sus columnas se infieren al leerlo)
+def esquema_de(nombre):
+    return ESQUEMAS.get(nombre)
+
+
+# Tipo de una columna según el esquema
+def tipo_columna(esquema, columna):
+    return esquema["tipos"].get(columna, esquema.get("defecto", "texto"))
+
+
+# Columnas de valor de un dataset (las que no forman parte de la clave de cada fila)
+def columnas_valor(nombre):
+    esquema = esquema_de(nombre)
+    return list(esquema.get("valores", [])) if esquema else list(VALORES_POR_DEFECTO)
+
+
+# Opciones de lectura del fichero raw de un dataset
+def opciones_lectura(nombre):
+    esquema = esquema_de(nombre)
+    return {"sep": esquema["sep"]} if esquema and esquema.get("sep", ",") != "," else {}
@@ -0,0 +1,265 @@
+'''
+Línea de comandos del pipeline ETL
+-----------------------------------------------------------------------
+
+Este script forma parte del proceso ETL del Trabajo de Fin de Máster (TFM) y es el punto de entrada único para
+lanzar cualquier etapa del pipeline sin ejecutar cada script por separado:
+
+    python etl.py download [datasets...]        descarga de Eurostat (manifiesto y peticiones condicionales)
+    python etl.py curate [ficheros...]          curado de los ficheros raw de Eurostat y la EEA
+    python etl.py standardize [ficheros...]     estandarización de los ficheros curados
+    python etl.py normalize [ficheros...]       tablas de hechos y dimensiones
+    python etl.py indicators                    tabla de intensidad de emisiones (`tabla_intensidad.py`)
+    python etl.py profile [ficheros...]         data profiling de los ficheros raw
+    python etl.py run                           pipeline completo con caché (`orquestador.py`)
+
+1. **Arranque rápido:**
+   - Este módulo sólo importa la librería estándar. Cada subcomando importa los módulos de su etapa cuando se
+     ejecuta, así que curar un fichero no carga pandas hasta que hace falta ni las librerías del perfilado
+     (`ydata_profiling`, `matplotlib`), y `--help` responde al momento.
+   - Como la configuración se lee de las variables de entorno al importar cada módulo, `-e VARIABLE=valor` (antes
+     del subcomando) la cambia para esa ejecución, p. ej. `python etl.py -e ETL_FORMATO_INTERMEDIO=parquet run`.
+
+2. **Opciones de las etapas:**
+   - Ficheros: cada etapa admite una lista de ficheros, por ruta o por nombre de dataset (`nama_10_gdp`). Sin
+     ficheros se procesan todos los de su carpeta de entrada.
+   - `--workers`: número de procesos (por defecto `ETL_WORKERS`).
+   - `--dry-run`: muestra qué se procesaría sin ejecutar nada. En `run` indica, según la caché del orquestador, los
+     ficheros pendientes de cada etapa.
+
+El código de salida es 1 si algún fichero termina con errores y 2 si los argumentos no son válidos.
+
+'''
+
+import argparse
+import os
+import sys
+
+
+# Paths en local
+CARPETA_RAW_EUROSTAT = os.path.join("ficheros_raw", "eurostat")
+CARPETA_RAW_EEA = os.path.join("ficheros_raw", "eea")
+CARPETA_CURADO_EUROSTAT = os.path.join("ficheros_curado", "eurostat")
+CARPETA_CURADO_EEA = os.path.join("ficheros_curado", "eea")
+CARPETA_ESTANDARIZADOS = "ficheros_estandarizados"
+
+
+class ErrorArgumentos(Exception):
+    pass
+
+
+# Selección de ficheros: rutas o nombres de tabla dentro de los `disponibles` (todos si no se indica ninguno)
+def seleccionar(ficheros, disponibles):
+    from almacenamiento import nombre_tabla
+
+    if not ficheros:
+        return list(disponibles)
+    por_ruta = {os.path.normpath(ruta): ruta for ruta in disponibles}
+    por_nombre = {nombre_tabla(ruta): ruta for ruta in disponibles}
+    seleccion = []
+    for fichero in ficheros:
+        ruta = por_ruta.get(os.path.normpath(fichero)) or por_nombre.get(nombre_tabla(fichero))
+        if ruta is None:
+            raise ErrorArgumentos(f"No se encontró '{fichero}' entre los ficheros de entrada de la etapa")
+        if ruta not in seleccion:
+            seleccion.append(ruta)
+    return seleccion
+
+
+# Ficheros de entrada de una etapa agrupados por el módulo que los procesa
+def _por_modulo(grupos, ficheros):
+    seleccion = seleccionar(ficheros, [ruta for _, rutas in grupos for ruta in rutas])
+    return [(modulo, [ruta for ruta in seleccion if ruta in rutas]) for modulo, rutas in grupos]
+
+
+def _mostrar(etapa, archivos):
+    print(f"🔎 {etapa}: {len(archivos)} fichero(s)")
+    for archivo in archivos:
+        print(f"   {archivo}")
+
+
+# Ejecuta `modulo.main` con los ficheros de cada grupo (sólo se importan los módulos con ficheros). Devuelve los errores
+def _ejecutar_grupos(grupos, args, **opciones):
+    import importlib
+
+    errores = {}
+    for modulo, archivos in grupos:
+        if args.dry_run:
+            _mostrar(modulo, archivos)
+        elif archivos:
+            _, errores_modulo = importlib.import_module(modulo).main(workers=args.workers, archivos=archivos,
+                                                                     **opciones)
+            errores.update(errores_modulo)
+    return errores
+
+
+def comando_download(args):
+    import catalogo_datasets
+
+    urls = catalogo_datasets.urls_descarga()
+    desconocidos = [d for d in args.datasets if d not in urls]
+    if desconocidos:
+        raise ErrorArgumentos(f"Datasets que no se descargan desde el catálogo: {desconocidos}. Opciones: {list(urls)}")
+    seleccion = [urls[d] for d in args.datasets or urls]
+    if args.dry_run:
+        _mostrar("descarga", seleccion)
+        return {}
+    if args.forzar:
+        os.environ["ETL_FORZAR_DESCARGA"] = "1"
+
+    import proceso_descarga_api
+    os.makedirs(CARPETA_RAW_EUROSTAT, exist_ok=True)
+    opciones = {"max_workers": args.workers} if args.workers else {}
+    estados = proceso_descarga_api.descargar_datasets(seleccion, CARPETA_RAW_EUROSTAT, **opciones)
+    return {url: estado for url, estado in estados.items() if estado == proceso_descarga_api.ESTADO_ERROR}
+
+
+def comando_curate(args):
+    from almacenamiento import listar_raw
+
+    grupos = [("proceso_curado_eurostat", listar_raw(CARPETA_RAW_EUROSTAT)),
+              ("proceso_curado_eea", listar_raw(CARPETA_RAW_EEA))]
+    return _ejecutar_grupos(_por_modulo(grupos, args.ficheros), args)
+
+
+def comando_standardize(args):
+    from almacenamiento import listar_tablas
+
+    entradas = listar_tablas(CARPETA_CURADO_EUROSTAT) + listar_tablas(CARPETA_CURADO_EEA)
+    return _ejecutar_grupos([("proceso_estandarizacion", seleccionar(args.ficheros, entradas))], args)
+
+
+def comando_normalize(args):
+    from almacenamiento import listar_tablas
+
+    archivos = seleccionar(args.ficheros, listar_tablas(CARPETA_ESTANDARIZADOS))
+    import proceso_normalizacion
+
+    # Sin ficheros indicados se deja que la etapa los elija (en modo incremental, los nuevos o modificados)
+    incremental = args.incremental or proceso_normalizacion.NORMALIZACION_INCREMENTAL
+    if args.dry_run:
+        if incremental and not args.ficheros:
+            from huellas import cargar_estado, ha_cambiado
+            estado = cargar_estado(proceso_normalizacion.RUTA_ESTADO)
+            archivos = [archivo for archivo in archivos if ha_cambiado(archivo, estado.get(archivo))]
+        _mostrar("normalizacion", archivos)
+        return {}
+    return proceso_normalizacion.main(workers=args.workers, incremental=incremental,
+                                      archivos=archivos if args.ficheros else None)[1]
+
+
+def comando_indicators(args):
+    if args.dry_run:
+        print("🔎 tabla_intensidad: se actualizaría la tabla de intensidad de emisiones")
+        return {}
+    import tabla_intensidad
+    tabla_intensidad.actualizar_tabla(forzar=args.forzar)
+    return {}
+
+
+def comando_profile(args):
+    from almacenamiento import listar_raw
+
+    carpetas = args.carpetas or [CARPETA_RAW_EUROSTAT, CARPETA_RAW_EEA]
+    archivos = seleccionar(args.ficheros, [ruta for carpeta in carpetas for ruta in listar_raw(carpeta)])
+    if args.dry_run:
+        _mostrar("perfilado", archivos)
+        return {}
+    # `ydata_profiling` y `matplotlib` sólo se cargan aquí (y sólo si hacen falta)
+    import proceso_data_profiling
+    proceso_data_profiling.main(rapido=args.rapido or None, archivos=archivos)
+    return {}
+
+
+def comando_run(args):
+    import orquestador
+
+    if not args.dry_run:
+        return orquestador.main(workers=args.workers, descargar=args.descargar or None,
+                                en_memoria=args.en_memoria or None, forzar=args.forzar,
+                                analitica=args.analitica or None, indicadores=False if args.sin_indicadores else None)
+
+    # Ficheros pendientes de cada etapa según la caché (las etapas siguientes pueden tener más al ejecutar las
+    # anteriores). El estado no se guarda
+    from huellas import cargar_estado
+    estado = cargar_estado(orquestador.RUTA_ESTADO)
+    for etapa in orquestador.ETAPAS:
+        entradas = etapa.entradas()
+        pendientes = orquestador.ficheros_pendientes(dict(estado.get(etapa.nombre, {})), entradas, etapa.firma(),
+                                                     etapa.salida, args.forzar)
+        print(f"🔎 {etapa.nombre}: {len(pendientes)} fichero(s) pendientes, {len(entradas) - len(pendientes)} sin cambios")
+        for archivo in pendientes:
+            print(f"   {archivo}")
+    return {}
+
+
+# Definición de la línea de comandos: {subcomando: (alias en castellano, ayuda, función)}
+SUBCOMANDOS = {
+    "download": (["descarga"], "Descarga los datasets de Eurostat del catálogo", comando_download),
+    "curate": (["curado"], "Cura los ficheros raw", comando_curate),
+    "standardize": (["estandarizacion"], "Estandariza los ficheros curados", comando_standardize),
+    "normalize": (["normalizacion"], "Genera las tablas de hechos y dimensiones", comando_normalize),
+    "indicators": (["indicadores"], "Actualiza la tabla de intensidad de emisiones", comando_indicators),
+    "profile": (["perfilado"], "Data profiling de los ficheros raw", comando_profile),
+    "run": (["ejecutar"], "Ejecuta el pipeline completo con caché", comando_run),
+}
+
+
+def crear_parser():
+    parser = argparse.ArgumentParser(prog="etl", description="Pipeline ETL del TFM (emisiones GEI en la UE)")
+    parser.add_argument("-e", "--entorno", action="append", default=[], metavar="VARIABLE=valor",
+                        help="Variable de entorno ETL_* para esta ejecución (se puede repetir)")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    subparsers_por_comando = {}
+    for nombre, (alias, ayuda, funcion) in SUBCOMANDOS.items():
+        sub = subparsers.add_parser(nombre, aliases=alias, help=ayuda, description=ayuda)
+        sub.set_defaults(funcion=funcion)
+        sub.add_argument("--dry-run", action="store_true", help="Muestra qué se procesaría sin ejecutarlo")
+        sub.add_argument("--workers", type=int, default=None, help="Número de procesos (por defecto ETL_WORKERS)")
+        subparsers_por_comando[nombre] = sub
+
+    subparsers_por_comando["download"].add_argument("datasets", nargs="*", help="Datasets del catálogo (todos)")
+    subparsers_por_comando["download"].add_argument("--forzar", action="store_true",
+                                                    help="Descarga aunque el servidor indique que no hay cambios")
+    for nombre in ["curate", "standardize", "normalize", "profile"]:
+        subparsers_por_comando[nombre].add_argument("ficheros", nargs="*",
+                                                    help="Rutas o nombres de dataset (todos los de la etapa)")
+    subparsers_por_comando["normalize"].add_argument("--incremental", action="store_true",
+                                                     help="Sólo los ficheros estandarizados nuevos o modificados")
+    subparsers_por_comando["indicators"].add_argument("--forzar", action="store_true", help="Recalcula la tabla entera")
+    subparsers_por_comando["profile"].add_argument("--rapido", action="store_true", help="Sin el informe HTML")
+    subparsers_por_comando["profile"].add_argument("--carpetas", nargs="+", help="Carpetas de ficheros raw")
+
+    run = subparsers_por_comando["run"]
+    run.add_argument("--descargar", action="store_true", help="Descarga los datasets antes de procesarlos")
+    run.add_argument("--en-memoria", action="store_true", help="Pasa los datos entre etapas en memoria")
+    run.add_argument("--forzar", action="store_true", help="Ignora la caché y reprocesa todos los ficheros")
+    run.add_argument("--analitica", action="store_true", help="Actualiza la base analítica al terminar")
+    run.add_argument("--sin-indicadores", action="store_true", help="No actualiza la tabla de intensidad")
+    return parser
+
+
+#Proceso de ejecución
+def main(argv=None):
+    parser = crear_parser()
+    args = parser.parse_args(argv)
+
+    # La configuración se aplica antes de importar ningún módulo del pipeline
+    for asignacion in args.entorno:
+        variable, separador, valor = asignacion.partition("=")
+        if not separador or not variable.startswith("ETL_"):
+            parser.error(f"-e espera ETL_VARIABLE=valor: {asignacion}")
+        os.environ[variable] = valor
+    if args.workers:
+        os.environ["ETL_WORKERS"] = str(args.workers)
+
+    try:
+        errores = args.funcion(args)
+    except ErrorArgumentos as e:
+        parser.error(str(e))
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+'''
+Generador de datos sintéticos para pruebas de rendimiento
+-----------------------------------------------------------------------
+
+Este script forma parte del pipeline ETL del TFM y genera un árbol `ficheros_raw` con datos inventados pero con
+la forma de los reales, para medir el pipeline a distintas escalas (de 1e5 a 1e8 filas) sin descargar nada:
+
+- Eurostat (`ficheros_raw/eurostat`): CSV SDMX 2.0 con etiquetas (`STRUCTURE`, `STRUCTURE_ID`, `freq`, `geo`,
+  `TIME_PERIOD`, `OBS_VALUE`, `OBS_FLAG`... cada código seguido de su descripción) para `env_ac_ainah_r2`,
+  `nama_10_gdp` y `sdg_13_10`, con sus propias dimensiones.
+- EEA (`ficheros_raw/eea`): `UNFCCC_v28_3.csv` con la estructura del inventario UNFCCC y
+  `ETS_Database_v51_May23.csv` separado por tabuladores.
+
+Como en los datos reales, cada fila tiene una clave distinta (dimensiones + país + periodo): las claves se recorren
+en un orden desordenado pero fijo y, si a una escala no bastan las combinaciones de los códigos reales, se añaden
+regiones inventadas de cada país (`ES001`, `ES002`...). Para que el curado tenga trabajo real se incluyen filas
+trimestrales, observaciones sin valor, años nulos en el UNFCCC y filas "Total" en el ETS (como mucho una por serie,
+sin repetir claves) y un pequeño porcentaje de filas duplicadas, las únicas claves repetidas.
+
+Los ficheros se escriben con la compresión de la capa raw (`ETL_COMPRESION_RAW`, ver `almacenamiento.py`), como
+los que deja la descarga.
+
+Las filas (`ETL_SINTETICO_FILAS`, total del árbol) se reparten entre los ficheros según `PROPORCIONES` y se
+escriben por bloques, así que la memoria no depende de la escala. Con la misma semilla (`ETL_SINTETICO_SEMILLA`)
+se generan siempre los mismos ficheros; si la carpeta ya contiene un árbol con las mismas opciones no se vuelve
+a generar.
+
+'''
+
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+from almacenamiento import COMPRESION_RAW, EscritorRaw, ruta_raw
+
+
+# Opciones por defecto de la ejecución como script
+FILAS = int(float(os.environ.get("ETL_SINTETICO_FILAS", 100_000)))
+CARPETA = os.environ.get("ETL_SINTETICO_CARPETA", "datos_sinteticos")
+SEMILLA = int(os.environ.get("ETL_SINTETICO_SEMILLA", 0))
+
+# Cambiar al modificar la forma de los datos, para que no se reutilicen árboles generados con la versión anterior
+VERSION_GENERADOR = 3
+FILAS_BLOQUE = 500_000
+
+# Fracción de las filas totales que va a cada fichero
+PROPORCIONES = {
+    "env_ac_ainah_r2": 0.50,
+    "nama_10_gdp": 0.15,
+    "sdg_13_10": 0.05,
+    "UNFCCC_v28_3": 0.20,
+    "ETS_Database_v51_May23": 0.10,
+}
+
+# Ruido de los datos
+PROPORCION_TRIMESTRAL = 0.05
+PROPORCION_SIN_VALOR = 0.02
+PROPORCION_DUPLICADOS = 0.001
+PROPORCION_ANIO_NULO = 0.01
+PROPORCION_TOTALES_ETS = 0.02
+
+ANIOS = np.arange(1990, 2024)
+
+PAISES = [
+    ("AT", "Austria"), ("BE", "Belgium"), ("BG", "Bulgaria"), ("CY", "Cyprus"), ("CZ", "Czechia"),
+    ("DE", "Germany"), ("DK", "Denmark"), ("EE", "Estonia"), ("EL", "Greece"), ("ES", "Spain"),
+    ("FI", "Finland"), ("FR", "France"), ("HR", "Croatia"), ("HU", "Hungary"), ("IE", "Ireland"),
+    ("IT", "Italy"), ("LT", "Lithuania"), ("LU", "Luxembourg"), ("LV", "Latvia"), ("MT", "Malta"),
+    ("NL", "Netherlands"), ("PL", "Poland"), ("PT", "Portugal"), ("RO", "Romania"), ("SE", "Sweden"),
+    ("SI", "Slovenia"), ("SK", "Slovakia"), ("IS", "Iceland"), ("NO", "Norway"), ("CH", "Switzerland"),
+    ("EU27_2020", "European Union - 27 countries (from 2020)"),
+]
+
+BANDERAS = ["", "p", "e", "b"]
+PROBABILIDAD_BANDERAS = [0.85, 0.07, 0.05, 0.03]
+
+# Dimensiones propias de cada dataset de Eurostat (código, etiqueta, [(valor, descripción)]), en orden de columnas
+DIMENSIONES_EUROSTAT = {
+    "env_ac_ainah_r2": [
+        ("airpol", "Air pollutants and greenhouse gases",
+         [("GHG", "Greenhouse gases (CO2, N2O in CO2 equivalent, CH4 in CO2 equivalent, HFC in CO2 equivalent, "
+                  "PFC in CO2 equivalent, SF6 in CO2 equivalent, NF3 in CO2 equivalent)"),
+          ("CO2", "Carbon dioxide"), ("CH4", "Methane"), ("N2O", "Nitrous oxide"),
+          ("CH4_CO2E", "Methane (CO2 equivalent)"), ("N2O_CO2E", "Nitrous oxide (CO2 equivalent)"),
+          ("NOX", "Nitrogen oxides"), ("SOX_SO2E", "Sulphur oxides (SO2 equivalent)")]),
+        ("nace_r2", "Statistical classification of economic activities in the European Community (NACE Rev. 2)",
+         [("TOTAL_HH", "Total - all NACE activities and households"), ("TOTAL", "Total - all NACE activities"),
+          ("A", "Agriculture, forestry and fishing"),
+          ("B", "Mining and quarrying"), ("C", "Manufacturing"),
+          ("D", "Electricity, gas, steam and air conditioning supply"), ("E", "Water supply; sewerage"),
+          ("F", "Construction"), ("G", "Wholesale and retail trade"), ("H", "Transportation and storage"),
+          ("HH", "Total activities by households")]),
+        ("unit", "Unit of measure", [("T", "Tonne"), ("THS_T", "Thousand tonnes")]),
+    ],
+    "nama_10_gdp": [
+        ("unit", "Unit of measure",
+         [("CP_MEUR", "Current prices, million euro"), ("CLV10_MEUR", "Chain linked volumes (2010), million euro"),
+          ("CP_MNAC", "Current prices, million units of national currency"),
+          ("PC_GDP", "Percentage of gross domestic product (GDP)")]),
+        ("na_item", "National accounts indicator (ESA 2010)",
+         [("B1GQ", "Gross domestic product at market prices"), ("P3", "Final consumption expenditure"),
+          ("P6", "Exports of goods and services"), ("P7", "Imports of goods and services")]),
+    ],
+    "sdg_13_10": [
+        ("src_crf", "Source sectors for greenhouse gas emissions (Common reporting format, UNFCCC)",
+         [("TOTX4_MEMONIA", "Total (excluding LULUCF and memo items, including international aviation)"),
+          ("TOTXMEMONIA", "Total (excluding memo items)")]),
+        ("unit", "Unit of measure",
+         [("T_HAB", "Tonnes per capita"), ("I90", "Index, 1990=100"), ("MIO_T", "Million tonnes")]),
+    ],
+}
+
+SECTORES_UNFCCC = [
+    ("Sectors/Totals_excl_excl", "Total emissions (UNFCCC)", ""), ("1", "1 - Energy", "Sectors/Totals_excl_excl"),
+    ("1.A", "1.A - Fuel combustion", "1"), ("1.A.1", "1.A.1 - Energy industries", "1.A"),
+    ("1.A.3", "1.A.3 - Transport", "1.A"), ("2", "2 - Industrial processes and product use", "Sectors/Totals_excl_excl"),
+    ("3", "3 - Agriculture", "Sectors/Totals_excl_excl"), ("5", "5 - Waste management", "Sectors/Totals_excl_excl"),
+]
+CONTAMINANTES_UNFCCC = ["All greenhouse gases - (CO2 equivalent)", "CO2", "CH4", "N2O", "HFCs - (CO2 equivalent)"]
+PAISES_UNFCCC = [(codigo, pais) for codigo, pais in PAISES if codigo != "EU27_2020"] + [("EUA", "EU-27")]
+
+SECTORES_ETS = ["20-99 All stationary installations", "20 Combustion of fuels", "21 Refining of mineral oil",
+                "24 Production of pig iron or steel", "29 Production of cement clinker"]
+INFORMACION_ETS = ["1. Total allocated allowances (EUA or EUAA)", "2. Verified emissions",
+                   "3. Total surrendered units", "4. Net free allocation"]
+ANIOS_TOTALES_ETS = ["Total 2005-2007", "Total 2008-2012", "Total 2013-2020"]
+
+
+def _elegir(rng, valores, n, p=None):
+    return np.asarray(valores, dtype=object)[rng.choice(len(valores), size=n, p=p)]
+
+
+# Índices de las claves de las filas `inicio` a `inicio + n` de un fichero en un espacio de claves de `tamanos`
+# (número de valores de cada dimensión). Cada fila recibe una combinación distinta mientras el fichero no tenga más
+# filas que combinaciones: la fila i es la combinación (i * paso) mod total, con `paso` primo con el total
+def _claves(inicio, n, tamanos):
+    total = math.prod(tamanos)
+    paso = int(total * 0.6180339887) | 1
+    while math.gcd(paso, total) != 1:
+        paso += 1
+    combinaciones = (np.arange(inicio, inicio + n, dtype=np.int64) % total) * paso % total
+    indices = []
+    for tamano in reversed(tamanos):
+        indices.append(combinaciones % tamano)
+        combinaciones = combinaciones // tamano
+    return indices[::-1]
+
+
+# Países (código, nombre) ampliados con regiones inventadas de cada uno hasta tener al menos `n`
+def _ampliar_paises(paises, n):
+    extra = [(f"{codigo}{k // len(paises) + 1:03d}", f"{pais} (region {k // len(paises) + 1})")
+             for k, (codigo, pais) in ((k, paises[k % len(paises)]) for k in range(max(0, n - len(paises))))]
+    return paises + extra
+
+
+# Países necesarios para que `filas` filas tengan claves distintas con series de `combinaciones` combinaciones
+# de sus otras dimensiones y `periodos` periodos
+def _paises_necesarios(paises, filas, combinaciones, periodos):
+    return _ampliar_paises(paises, max(len(paises), math.ceil(filas / (combinaciones * periodos))))
+
+
+# Repite un pequeño porcentaje de filas del bloque (duplicados exactos, que el curado debe eliminar)
+def _con_duplicados(rng, df):
+    n = int(len(df) * PROPORCION_DUPLICADOS)
+    if n == 0:
+        return df
+    return pd.concat([df, df.iloc[rng.integers(0, len(df), n)]], ignore_index=True)
+
+
+def _valores(rng, n, escala):
+    valores = np.round(rng.lognormal(np.log(escala), 1.5, n), 3)
+    return np.where(rng.random(n) < PROPORCION_SIN_VALOR, np.nan, valores)
+
+
+# Bloque (filas `inicio` a `inicio + n` de un fichero de `total` filas) de un dataset de Eurostat en CSV SDMX 2.0
+# con etiquetas. La clave de cada fila es la serie (dimensiones + país) y el año; las filas trimestrales llevan
+# `freq` Q y un trimestre de ese año
+def bloque_eurostat(rng, nombre, n, inicio=0, total=None):
+    dimensiones = DIMENSIONES_EUROSTAT[nombre]
+    paises = _paises_necesarios(PAISES, total or n, math.prod(len(v) for _, _, v in dimensiones), len(ANIOS))
+    *indices_dimensiones, indices_paises, indices_anios = _claves(
+        inicio, n, [len(v) for _, _, v in dimensiones] + [len(paises), len(ANIOS)])
+
+    columnas = {
+        "STRUCTURE": "dataflow", "STRUCTURE_ID": f"ESTAT:{nombre}(1.0)", "STRUCTURE_NAME": nombre,
+    }
+    trimestral = rng.random(n) < PROPORCION_TRIMESTRAL
+    columnas["freq"] = np.where(trimestral, "Q", "A")
+    columnas["Time frequency"] = np.where(trimestral, "Quarterly", "Annual")
+    for (codigo, etiqueta, valores), indices in zip(dimensiones, indices_dimensiones):
+        columnas[codigo] = np.asarray([v for v, _ in valores], dtype=object)[indices]
+        columnas[etiqueta] = np.asarray([d for _, d in valores], dtype=object)[indices]
+    columnas["geo"] = np.asarray([c for c, _ in paises], dtype=object)[indices_paises]
+    columnas["Geopolitical entity (reporting)"] = np.asarray([p for _, p in paises], dtype=object)[indices_paises]
+    anios = ANIOS[indices_anios].astype(str).astype(object)
+    trimestres = rng.integers(1, 5, n).astype(str)
+    columnas["TIME_PERIOD"] = np.where(trimestral, anios + "-Q" + trimestres.astype(object), anios)
+    columnas["Time"] = ""
+    columnas["OBS_VALUE"] = _valores(rng, n, 500)
+    columnas["Observation value"] = ""
+    columnas["OBS_FLAG"] = _elegir(rng, BANDERAS, n, PROBABILIDAD_BANDERAS)
+    columnas["Observation status (Flag) V2 structure"] = ""
+    columnas["CONF_STATUS"] = ""
+    columnas["Confidentiality status (flag)"] = ""
+    return _con_duplicados(rng, pd.DataFrame(columnas))
+
+
+# Bloque (filas `inicio` a `inicio + n` de un fichero de `total` filas) con la estructura del inventario UNFCCC de
+# la EEA. Sólo el primer año de cada serie puede quedar nulo, así que los años nulos no repiten claves
+def bloque_unfccc(rng, n, inicio=0, total=None):
+    paises_unfccc = _paises_necesarios(PAISES_UNFCCC, total or n, len(CONTAMINANTES_UNFCCC) * len(SECTORES_UNFCCC),
+                                       len(ANIOS))
+    paises, contaminantes, sectores, indices_anios = _claves(
+        inicio, n, [len(paises_unfccc), len(CONTAMINANTES_UNFCCC), len(SECTORES_UNFCCC), len(ANIOS)])
+    nulos = (indices_anios == 0) & (rng.random(n) < PROPORCION_ANIO_NULO * len(ANIOS))
+    df = pd.DataFrame({
+        "Country_code": np.asarray([c for c, _ in paises_unfccc], dtype=object)[paises],
+        "Country": np.asarray([p for _, p in paises_unfccc], dtype=object)[paises],
+        "Format_name": "UNFCCC_GHG_CRF_v28",
+        "Pollutant_name": np.asarray(CONTAMINANTES_UNFCCC, dtype=object)[contaminantes],
+        "Sector_code": np.asarray([s[0] for s in SECTORES_UNFCCC], dtype=object)[sectores],
+        "Sector_name": np.asarray([s[1] for s in SECTORES_UNFCCC], dtype=object)[sectores],
+        "Parent_sector_code": np.asarray([s[2] for s in SECTORES_UNFCCC], dtype=object)[sectores],
+        "Unit": "Gg",
+        "Year": pd.array(np.where(nulos, np.nan, ANIOS[indices_anios]), dtype="Int64"),
+        "emissions": _valores(rng, n, 50),
+        "Notation": "",
+        "PublicationDate": "29/05/2023",
+        "DataSource": "EEA",
+    })
+    return _con_duplicados(rng, df)
+
+
+# Bloque (filas `inicio` a `inicio + n` de un fichero de `total` filas) con la estructura de la base de datos del
+# ETS (se guarda separada por tabuladores). Sólo el primer año de cada serie puede ser una fila de totales
+def bloque_ets(rng, n, inicio=0, total=None):
+    anios_ets = np.arange(2005, 2024)
+    paises_ets = _paises_necesarios(PAISES[:-1], total or n, len(SECTORES_ETS) * len(INFORMACION_ETS), len(anios_ets))
+    paises, sectores, informacion, indices_anios = _claves(
+        inicio, n, [len(paises_ets), len(SECTORES_ETS), len(INFORMACION_ETS), len(anios_ets)])
+    anios = anios_ets[indices_anios].astype(str).astype(object)
+    totales = (indices_anios == 0) & (rng.random(n) < PROPORCION_TOTALES_ETS * len(anios_ets))
+    df = pd.DataFrame({
+        "country_code": np.asarray([c for c, _ in paises_ets], dtype=object)[paises],
+        "country": np.asarray([p for _, p in paises_ets], dtype=object)[paises],
+        "main activity sector name": np.asarray(SECTORES_ETS, dtype=object)[sectores],
+        "ETS information": np.asarray(INFORMACION_ETS, dtype=object)[informacion],
+        "unit": "tonne of CO2-equ.",
+        "value": np.round(rng.lognormal(np.log(1e5), 2, n), 0),
+        "year": np.where(totales, _elegir(rng, ANIOS_TOTALES_ETS, n), anios),
+    })
+    return _con_duplicados(rng, df)
+
+
+# Ruta y separador de cada fichero generado
+def _destino(raiz, nombre):
+    if nombre in DIMENSIONES_EUROSTAT:
+        return ruta_raw(os.path.join(raiz, "ficheros_raw", "eurostat"), nombre), ","
+    return ruta_raw(os.path.join(raiz, "ficheros_raw", "eea"), nombre), "\t" if nombre.startswith("ETS") else ","
+
+
+# Genera un fichero con `filas` filas (más los duplicados), por bloques
+def generar_dataset(raiz, nombre, filas, semilla=0, filas_bloque=FILAS_BLOQUE):
+    ruta, sep = _destino(raiz, nombre)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    rng = np.random.default_rng([semilla, list(PROPORCIONES).index(nombre)])
+    ruta_tmp = f"{ruta}.tmp"
+    escritas = 0
+    with EscritorRaw(ruta_tmp, COMPRESION_RAW) as f:
+        for inicio in range(0, max(filas, 1), filas_bloque):
+            n = min(filas_bloque, filas - inicio)
+            if nombre in DIMENSIONES_EUROSTAT:
+                bloque = bloque_eurostat(rng, nombre, n, inicio, filas)
+            elif nombre == "UNFCCC_v28_3":
+                bloque = bloque_unfccc(rng, n, inicio, filas)
+            else:
+                bloque = bloque_ets(rng, n, inicio, filas)
+            f.write(bloque.to_csv(sep=sep, index=False, header=inicio == 0).encode("utf-8"))
+            escritas += len(bloque)
+    os.replace(ruta_tmp, ruta)
+    return ruta, escritas
+
+
+# Genera el árbol raw completo con unas `filas` totales. Devuelve {ruta: filas escritas}
+def generar(raiz=None, filas=None, semilla=None, proporciones=None):
+    raiz = raiz or CARPETA
+    filas = FILAS if filas is None else int(filas)
+    semilla = SEMILLA if semilla is None else semilla
+    proporciones = proporciones or PROPORCIONES
+
+    # Si el árbol ya existe con las mismas opciones no se vuelve a generar
+    ruta_opciones = os.path.join(raiz, "ficheros_raw", ".generador.json")
+    opciones = {"version": VERSION_GENERADOR, "filas": filas, "semilla": semilla, "proporciones": proporciones,
+                "compresion": COMPRESION_RAW}
+    if os.path.exists(ruta_opciones):
+        with open(ruta_opciones, encoding="utf-8") as f:
+            generado = json.load(f)
+        if generado.get("opciones") == opciones and all(os.path.exists(r) for r in generado.get("ficheros", {})):
+            print(f"⏭️  Datos sintéticos ya generados en {raiz}.")
+            return generado["ficheros"]
+
+    ficheros = {}
+    for nombre, proporcion in proporciones.items():
+        ruta, escritas = generar_dataset(raiz, nombre, int(filas * proporcion), semilla)
+        ficheros[ruta] = escritas
+        print(f"✅ {ruta}: {escritas} filas.")
+
+    with open(ruta_opciones, "w", encoding="utf-8") as f:
+        json.dump({"opciones": opciones, "ficheros": ficheros}, f, indent=2)
+    return ficheros
+
+
+if __name__ == "__main__":
+    generar()
@@ -0,0 +1,168 @@
+'''
+Gráficos del data profiling
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y genera los gráficos por variable de
+`proceso_data_profiling.py` (histograma para las numéricas y barras con las 5 categorías más frecuentes para
+las de texto):
+
+- Los datos de cada gráfico (conteos del histograma o de las categorías) se calculan en el proceso principal y
+  sólo esos pocos números se envían a los procesos que dibujan (`ETL_WORKERS`).
+- Se dibuja con la API orientada a objetos de matplotlib sobre el backend Agg (`Figure` + `FigureCanvasAgg`),
+  sin el estado global de pyplot, así que es seguro en paralelo.
+- Caché por gráfico: en `graficos_<dataset>/.graficos.json` se guarda el hash de los datos de cada gráfico y
+  sólo se vuelven a dibujar los que han cambiado (o cuyo PNG falta).
+- Panel (`ETL_GRAFICOS_PANEL`): `png` junta todos los gráficos del dataset en una imagen de varios paneles y
+  `html` en una página autocontenida (imágenes embebidas). Por defecto no se genera.
+
+'''
+
+import base64
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from ejecucion_paralela import WORKERS
+from huellas import cargar_estado, guardar_estado
+
+
+# Panel con todos los gráficos del dataset: "", "png" o "html"
+PANEL = os.environ.get("ETL_GRAFICOS_PANEL", "").lower()
+
+# Cambiar al modificar el aspecto de los gráficos, para que la caché no reutilice los anteriores
+VERSION_GRAFICOS = 1
+BINS_HISTOGRAMA = 29
+TOP_CATEGORIAS = 5
+COLUMNAS_PANEL = 3
+
+
+# Datos de un gráfico: histograma para numéricas y top de categorías para texto (None si no se dibuja)
+def datos_grafico(serie):
+    if pd.api.types.is_numeric_dtype(serie):
+        valores = serie.dropna().to_numpy(dtype=np.float64)
+        conteos, bordes = np.histogram(valores, bins=BINS_HISTOGRAMA)
+        return {"tipo": "histograma", "conteos": conteos.tolist(), "bordes": bordes.tolist()}
+    if (pd.api.types.is_object_dtype(serie) or pd.api.types.is_string_dtype(serie)
+            or isinstance(serie.dtype, pd.CategoricalDtype)):
+        conteos = serie.value_counts().head(TOP_CATEGORIAS)  # Top 5 categorías
+        return {"tipo": "frecuencia", "etiquetas": [str(v) for v in conteos.index], "conteos": conteos.tolist()}
+    return None
+
+
+# Hash de los datos de un gráfico (junto con la versión del estilo)
+def hash_grafico(columna, datos):
+    contenido = json.dumps({"version": VERSION_GRAFICOS, "columna": columna, "datos": datos}, sort_keys=True)
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+
+# Dibuja un gráfico en unos ejes
+def _dibujar(ax, columna, datos):
+    if datos["tipo"] == "histograma":
+        # Histograma para variables numéricas
+        bordes = np.asarray(datos["bordes"])
+        ax.hist(bordes[:-1], bins=bordes, weights=datos["conteos"], color='skyblue', edgecolor='black')
+        ax.grid(True)
+        ax.set_title(f"Histograma: {columna}")
+    else:
+        # Diagrama de barras para categóricas
+        posiciones = range(len(datos["conteos"]))
+        ax.bar(posiciones, datos["conteos"], color='salmon', edgecolor='black')
+        ax.set_xticks(list(posiciones))
+        ax.set_xticklabels(datos["etiquetas"], rotation=30, ha='right')
+        ax.set_title(f"Frecuencia: {columna} (Top {TOP_CATEGORIAS})")
+    ax.set_xlabel(columna)
+    ax.set_ylabel("Frecuencia")
+
+
+# Figura de un gráfico con el backend Agg (sin pyplot)
+def _figura(figsize):
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figura = Figure(figsize=figsize)
+    FigureCanvasAgg(figura)
+    return figura
+
+
+# Dibuja y guarda un gráfico. Recibe (ruta, columna, datos) para poder enviarse a otro proceso
+def renderizar(tarea):
+    ruta, columna, datos = tarea
+    figura = _figura((8, 5))
+    _dibujar(figura.add_subplot(), columna, datos)
+    figura.tight_layout()
+    figura.savefig(ruta)
+    return ruta
+
+
+# Imagen de varios paneles con todos los gráficos de un dataset
+def guardar_panel_png(graficos, ruta):
+    filas = math.ceil(len(graficos) / COLUMNAS_PANEL)
+    figura = _figura((8 * COLUMNAS_PANEL, 5 * filas))
+    for i, (columna, datos) in enumerate(graficos):
+        _dibujar(figura.add_subplot(filas, COLUMNAS_PANEL, i + 1), columna, datos)
+    figura.tight_layout()
+    figura.savefig(ruta)
+    return ruta
+
+
+# Página HTML autocontenida con todos los gráficos de un dataset (imágenes embebidas en base64)
+def guardar_panel_html(base_name, rutas, ruta):
+    imagenes = []
+    for columna, ruta_png in rutas:
+        with open(ruta_png, "rb") as f:
+            contenido = base64.b64encode(f.read()).decode("ascii")
+        imagenes.append(f'<figure><img src="data:image/png;base64,{contenido}" alt="{columna}">'
+                        f'<figcaption>{columna}</figcaption></figure>')
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Gráficos {base_name}</title>'
+                '<style>body{display:flex;flex-wrap:wrap}figure{margin:8px}img{width:480px}</style></head>'
+                f'<body><h1>Gráficos {base_name}</h1>{"".join(imagenes)}</body></html>')
+    return ruta
+
+
+# Gráficos de cada variable de un dataset: sólo se dibujan los que han cambiado, repartidos entre `workers`
+# procesos. Devuelve las rutas de los gráficos del dataset
+def generar_graficos(df, base_name, workers=None, panel=None):
+    workers = workers or WORKERS
+    panel = PANEL if panel is None else panel
+    carpeta = f"graficos_{base_name}"
+    os.makedirs(carpeta, exist_ok=True)
+    ruta_cache = os.path.join(carpeta, ".graficos.json")
+    cache = cargar_estado(ruta_cache)
+
+    graficos, pendientes, nuevo_cache = [], [], {}
+    for col in df.columns:
+        datos = datos_grafico(df[col])
+        if datos is None:
+            continue
+        ruta = os.path.join(carpeta, f"{datos['tipo']}_{col}.png")
+        huella = hash_grafico(col, datos)
+        nuevo_cache[ruta] = huella
+        graficos.append((col, ruta, datos))
+        if cache.get(ruta) != huella or not os.path.exists(ruta):
+            pendientes.append((ruta, col, datos))
+
+    if workers <= 1 or len(pendientes) <= 1:
+        for tarea in pendientes:
+            renderizar(tarea)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pendientes))) as executor:
+            list(executor.map(renderizar, pendientes))
+    guardar_estado(nuevo_cache, ruta_cache)
+    print(f"✅ Gráficos generados correctamente ({len(pendientes)} dibujados, "
+          f"{len(graficos) - len(pendientes)} sin cambios).")
+
+    # El panel sólo se rehace si ha cambiado algún gráfico
+    ruta_panel = os.path.join(carpeta, f"panel_{base_name}.{panel}") if panel in ("png", "html") else None
+    if ruta_panel is None or not graficos or (not pendientes and os.path.exists(ruta_panel)):
+        return [ruta for _, ruta, _ in graficos]
+    if panel == "png":
+        guardar_panel_png([(col, datos) for col, _, datos in graficos], ruta_panel)
+    else:
+        guardar_panel_html(base_name, [(col, ruta) for col, ruta, _ in graficos], ruta_panel)
+    return [ruta for _, ruta, _ in graficos]
@@ -0,0 +1,70 @@
+'''
+Huellas (fingerprints) de ficheros
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y sirve para saber si un fichero ha cambiado desde la
+última vez que se procesó. La huella de un fichero es su tamaño, su fecha de modificación y el sha256 de
+su contenido; el sha256 sólo se recalcula cuando cambian el tamaño o la fecha, así que comprobar un
+fichero que no ha cambiado no obliga a leerlo.
+
+Las huellas se guardan en ficheros JSON de estado (`{ruta: huella}`) junto a la salida de cada etapa. La
+huella de un módulo (sha256 de su código) sirve para invalidar lo calculado con una versión anterior del código.
+
+'''
+
+import hashlib
+import importlib.util
+import json
+import os
+
+
+TAMANO_BLOQUE = 4 * 1024 * 1024
+
+
+# sha256 del contenido de un fichero, leído por bloques
+def sha256_fichero(ruta):
+    huella = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(TAMANO_BLOQUE), b""):
+            huella.update(bloque)
+    return huella.hexdigest()
+
+
+# Huella de un fichero. Si tamaño y fecha coinciden con la huella anterior se reutiliza su sha256
+def huella_fichero(ruta, anterior=None):
+    stat = os.stat(ruta)
+    if anterior and anterior.get("tamano") == stat.st_size and anterior.get("mtime_ns") == stat.st_mtime_ns:
+        return dict(anterior)
+    return {"tamano": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256_fichero(ruta)}
+
+
+# sha256 del código fuente de un módulo, sin importarlo
+def huella_modulo(nombre):
+    return sha256_fichero(importlib.util.find_spec(nombre).origin)
+
+
+# Indica si el contenido de un fichero es distinto al de la huella anterior
+def ha_cambiado(ruta, anterior):
+    if not anterior or not os.path.exists(ruta):
+        return True
+    return huella_fichero(ruta, anterior)["sha256"] != anterior.get("sha256")
+
+
+# Lectura de un fichero de estado (diccionario vacío si no existe o está dañado)
+def cargar_estado(ruta):
+    if not os.path.exists(ruta):
+        return {}
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Escritura atómica de un fichero de estado
+def guardar_estado(estado, ruta):
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    ruta_tmp = f"{ruta}.tmp"
+    with open(ruta_tmp, "w", encoding="utf-8") as f:
+        json.dump(estado, f, indent=2, ensure_ascii=False, sort_keys=True)
+    os.replace(ruta_tmp, ruta)
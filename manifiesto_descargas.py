@@ -0,0 +1,48 @@
+'''
+Manifiesto de descargas de Eurostat
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y mantiene un registro persistente
+(`ficheros_raw/eurostat_manifiesto.json`) con el estado de la última descarga de cada dataset:
+
+- `etag` y `last_modified`: cabeceras HTTP devueltas por el servidor, usadas para las peticiones condicionales.
+- `sha256` y `bytes`: huella y tamaño del CSV descomprimido (el contenido, con independencia de la compresión).
+- `fichero`, `compresion` y `bytes_fichero`: fichero guardado en `ficheros_raw/eurostat` (`.csv.gz` por defecto,
+  ver `ETL_COMPRESION_RAW`), su compresión y su tamaño en disco.
+- `estado`: resultado de la última ejecución (`nuevo`, `actualizado`, `sin_cambios` o `error`).
+
+'''
+
+import json
+import os
+
+
+# Paths
+RUTA_MANIFIESTO = os.path.join("ficheros_raw", "eurostat_manifiesto.json")
+
+# Estados posibles de un dataset en el manifiesto
+ESTADO_NUEVO = "nuevo"
+ESTADO_ACTUALIZADO = "actualizado"
+ESTADO_SIN_CAMBIOS = "sin_cambios"
+ESTADO_ERROR = "error"
+
+
+# Función para leer el manifiesto (diccionario vacío si todavía no existe)
+def cargar_manifiesto(ruta=RUTA_MANIFIESTO):
+    if not os.path.exists(ruta):
+        return {}
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ No se pudo leer el manifiesto {ruta}, se descargará todo de nuevo: {e}")
+        return {}
+
+
+# Función para guardar el manifiesto de forma atómica
+def guardar_manifiesto(manifiesto, ruta=RUTA_MANIFIESTO):
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    ruta_tmp = f"{ruta}.tmp"
+    with open(ruta_tmp, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=2, ensure_ascii=False, sort_keys=True)
+    os.replace(ruta_tmp, ruta)
@@ -0,0 +1,200 @@
+'''
+Métricas de ejecución del pipeline ETL
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y registra, para cada etapa y fichero procesado, dónde se va
+el tiempo y la memoria. Cada medición es una línea JSON en `.etl_cache/metricas.jsonl` (`ETL_METRICAS`, vacío o
+`0` para desactivarlo) con:
+
+- `ejecucion`: identificador de la ejecución (`ETL_ID_EJECUCION`, se hereda en los procesos hijos), para
+  comparar ejecuciones entre sí.
+- `etapa`, `archivo`, `inicio`, `tiempo_s` y `estado` (`ok` o `error`, con el mensaje del error).
+- `bytes_leidos` (tamaño del fichero de entrada) y `bytes_escritos` (tamaño de las salidas anotadas).
+- `pico_rss_mb`: pico de memoria residente durante la medición. En Linux el pico se reinicia al empezar cada
+  medición (`/proc/self/clear_refs`); en otros sistemas es el pico del proceso hasta ese momento. El pico es del
+  proceso, así que no se reinicia si hay mediciones abiertas en otros hilos (p. ej. descargas en paralelo): en ese
+  caso es el pico del proceso desde que empezó la primera.
+- Los contadores que anote el código medido con `anotar` (filas leídas, filtradas, descartadas, duplicadas y
+  escritas...).
+
+Uso: `with medir("curado_eurostat", archivo): ...` y, dentro, `anotar(filas_leidas=...)` desde cualquier función
+(las anotaciones van a la medición activa del hilo; sin medición activa no hacen nada).
+`resumen_metricas` agrega el fichero por ejecución y etapa para compararlas.
+
+'''
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+
+
+# Fichero de métricas (vacío o "0" para no registrarlas)
+RUTA_METRICAS = os.environ.get("ETL_METRICAS", os.path.join(".etl_cache", "metricas.jsonl"))
+
+# Identificador de la ejecución: se guarda en el entorno para que lo hereden los procesos del pool
+ID_EJECUCION = os.environ.setdefault(
+    "ETL_ID_EJECUCION", f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}")
+
+# Mediciones abiertas en cada hilo (la última es la activa)
+_local = threading.local()
+
+# Mediciones abiertas en todo el proceso, para no reiniciar el pico mientras las mide otro hilo
+_abiertas = 0
+_cerrojo_abiertas = threading.Lock()
+
+
+def _activas():
+    if not hasattr(_local, "pila"):
+        _local.pila = []
+    return _local.pila
+
+
+def activo():
+    return RUTA_METRICAS not in ("", "0")
+
+
+# Memoria residente máxima del proceso en MB (en Linux desde /proc; si no, con `resource`; None si no se puede)
+def pico_rss_mb():
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for linea in f:
+                if linea.startswith("VmHWM:"):
+                    return round(int(linea.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+        import sys
+        divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor, 1)
+    except ImportError:
+        return None
+
+
+# Reinicia el pico de memoria del proceso (sólo Linux) para medir el de un único fichero
+def _reiniciar_pico():
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+# Anota valores en la medición activa del hilo
+def anotar(**valores):
+    if _activas():
+        _activas()[-1].update(valores)
+
+
+# Anota un fichero escrito por la medición activa (sus bytes se suman al cerrarla)
+def anotar_salida(ruta):
+    if _activas():
+        _activas()[-1].setdefault("salidas", []).append(ruta)
+
+
+# Añade una medición al fichero de métricas (una sola escritura en modo append, segura entre procesos)
+def registrar(medicion, ruta=None):
+    ruta = ruta or RUTA_METRICAS
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    linea = (json.dumps(medicion, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    descriptor = os.open(ruta, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, linea)
+    finally:
+        os.close(descriptor)
+
+
+# Registra el error de un fichero que no se pudo medir (p. ej. porque murió el proceso que lo trataba)
+def registrar_error(etapa, archivo, error):
+    if activo():
+        registrar({"ejecucion": ID_EJECUCION, "etapa": etapa, "archivo": archivo,
+                   "inicio": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+                   "estado": "error", "error": error})
+
+
+# Mide un bloque de código (una etapa completa o un fichero de una etapa) y lo registra al terminar,
+# también si falla (el error se registra y se vuelve a lanzar)
+@contextmanager
+def medir(etapa, archivo=None, **valores):
+    global _abiertas
+    medicion = {"ejecucion": ID_EJECUCION, "etapa": etapa, "archivo": archivo,
+                "inicio": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), **valores}
+    if not activo():
+        yield medicion
+        return
+
+    pila = _activas()
+    # Antes de reiniciar el pico se guarda el alcanzado hasta ahora por la medición que contiene a esta
+    if pila:
+        pila[-1]["_pico"] = max(pila[-1].get("_pico") or 0, pico_rss_mb() or 0)
+    with _cerrojo_abiertas:
+        # Sólo se reinicia si todas las mediciones abiertas son de este hilo
+        if _abiertas == len(pila):
+            _reiniciar_pico()
+        _abiertas += 1
+    pila.append(medicion)
+    inicio = time.perf_counter()
+    try:
+        yield medicion
+        medicion["estado"] = "ok"
+    except BaseException as e:
+        medicion["estado"] = "error"
+        medicion["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        medicion["tiempo_s"] = round(time.perf_counter() - inicio, 4)
+        pico = pico_rss_mb()
+        medicion["pico_rss_mb"] = max(pico, medicion.pop("_pico", 0) or 0) if pico is not None else None
+        if archivo and os.path.isfile(archivo):
+            medicion.setdefault("bytes_leidos", os.path.getsize(archivo))
+        salidas = medicion.pop("salidas", [])
+        if salidas:
+            medicion["bytes_escritos"] = sum(os.path.getsize(r) for r in salidas if os.path.isfile(r))
+            medicion["salidas"] = salidas
+        pila.pop()
+        with _cerrojo_abiertas:
+            _abiertas -= 1
+        if pila:
+            pila[-1]["_pico"] = max(pila[-1].get("_pico") or 0, medicion["pico_rss_mb"] or 0)
+        registrar(medicion)
+
+
+# Lectura del fichero de métricas como DataFrame (vacío si no existe)
+def leer_metricas(ruta=None):
+    ruta = ruta or RUTA_METRICAS
+    if not os.path.exists(ruta):
+        return pd.DataFrame()
+    return pd.read_json(ruta, lines=True)
+
+
+# Resumen por ejecución y etapa de las mediciones por fichero: ficheros, errores, tiempo, filas y bytes
+# totales y pico de memoria máximo
+def resumen_metricas(ruta=None, ejecuciones=None):
+    df = leer_metricas(ruta)
+    if df.empty:
+        return df
+    df = df[df["archivo"].notna()]
+    if ejecuciones is not None:
+        df = df[df["ejecucion"].isin(ejecuciones)]
+    agregaciones = {"ficheros": ("archivo", "count"), "errores": ("estado", lambda e: int((e == "error").sum())),
+                    "tiempo_s": ("tiempo_s", "sum"), "pico_rss_mb": ("pico_rss_mb", "max")}
+    for columna in ["filas_leidas", "filas_escritas", "bytes_leidos", "bytes_escritos"]:
+        if columna in df.columns:
+            agregaciones[columna] = (columna, "sum")
+    return df.groupby(["ejecucion", "etapa"], sort=False).agg(**agregaciones).reset_index()
+
+
+if __name__ == "__main__":
+    # Resumen de las últimas ejecuciones registradas
+    resumen = resumen_metricas()
+    if resumen.empty:
+        print(f"No hay métricas en {RUTA_METRICAS}.")
+    else:
+        ultimas = list(dict.fromkeys(resumen["ejecucion"]))[-5:]
+        print(resumen[resumen["ejecucion"].isin(ultimas)].to_string(index=False))
@@ -0,0 +1,131 @@
+'''
+Motor de curado por bloques con memoria acotada
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y permite aplicar las mismas reglas de limpieza de
+`proceso_curado_eurostat.py` y `proceso_curado_eea.py` leyendo el fichero por bloques (chunks), de modo
+que la memoria usada no depende del tamaño del fichero:
+
+- El tamaño de cada bloque se calcula a partir de un presupuesto de memoria (`ETL_MEMORIA_MB`) y del
+  tamaño medio de fila medido sobre una muestra.
+- Los duplicados se eliminan entre bloques con un conjunto compacto de huellas de fila (hash de 64 bits,
+  8 bytes por fila distinta) en lugar de acumular las filas.
+- Cada bloque curado se añade al fichero de salida según se procesa.
+- Los bloques se leen con los tipos del registro de esquemas (con el lector de Arrow, `ETL_LECTOR_CSV`, en varios
+  hilos; con el de pandas, con las mismas conversiones) y las filas que no se pueden leer se apartan a
+  `ficheros_cuarentena`, así que el fichero curado tiene los mismos tipos con cualquier lector.
+
+Modo de curado (`ETL_MODO_CURADO`):
+- `auto` (por defecto): streaming sólo si el fichero, una vez cargado, no cabe en el presupuesto de memoria.
+- `memoria`: siempre se carga el fichero completo (comportamiento original).
+- `streaming`: siempre por bloques.
+
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from almacenamiento import (LECTOR_CSV, EscritorTabla, abrir_csv, leer_csv_por_bloques, leer_csv_por_bloques_pandas,
+                            tamano_csv)
+from metricas import anotar
+
+
+# Presupuesto de memoria y modo de curado
+MEMORIA_MAXIMA_MB = int(os.environ.get("ETL_MEMORIA_MB", 512))
+MODO_CURADO = os.environ.get("ETL_MODO_CURADO", "auto").lower()
+
+# Un CSV cargado en pandas ocupa varias veces su tamaño sin comprimir
+FACTOR_EXPANSION = 5
+
+# Parte del presupuesto que ocupa un bloque: el resto queda para las copias que hacen los filtros y conversiones
+FRACCION_BLOQUE = 0.25
+FILAS_MUESTRA = 1000
+
+
+# Función para decidir si un fichero se cura por bloques
+def usar_streaming(archivo, memoria_mb=None, modo=None):
+    modo = modo or MODO_CURADO
+    memoria_mb = memoria_mb or MEMORIA_MAXIMA_MB
+    if modo == "streaming":
+        return True
+    if modo == "memoria":
+        return False
+    return tamano_csv(archivo) * FACTOR_EXPANSION > memoria_mb * 1024 * 1024
+
+
+# Función para calcular cuántas filas caben en cada bloque según el presupuesto de memoria
+def filas_por_bloque(archivo, memoria_mb=None, read_kwargs=None):
+    memoria_mb = memoria_mb or MEMORIA_MAXIMA_MB
+    with abrir_csv(archivo) as f:
+        muestra = pd.read_csv(f, nrows=FILAS_MUESTRA, dtype=str, **(read_kwargs or {}))
+    if muestra.empty:
+        return FILAS_MUESTRA
+    bytes_por_fila = muestra.memory_usage(deep=True, index=False).sum() / len(muestra)
+    return max(FILAS_MUESTRA, int(memoria_mb * 1024 * 1024 * FRACCION_BLOQUE / bytes_por_fila))
+
+
+# Conjunto compacto de huellas de fila: varios arrays ordenados de uint64 que se fusionan de vez en cuando
+class ConjuntoHuellas:
+
+    MAX_SEGMENTOS = 8
+
+    def __init__(self):
+        self.segmentos = []
+
+    def __len__(self):
+        return sum(len(s) for s in self.segmentos)
+
+    # Devuelve la máscara de las huellas no vistas antes (ni repetidas dentro del bloque) y las registra
+    def filtrar_nuevas(self, huellas):
+        nuevas = ~pd.Series(huellas).duplicated().to_numpy()
+        for segmento in self.segmentos:
+            candidatas = huellas[nuevas]
+            posiciones = np.searchsorted(segmento, candidatas).clip(max=len(segmento) - 1)
+            nuevas[np.flatnonzero(nuevas)[segmento[posiciones] == candidatas]] = False
+
+        if nuevas.any():
+            self.segmentos.append(np.sort(huellas[nuevas]))
+            if len(self.segmentos) > self.MAX_SEGMENTOS:
+                self.segmentos = [np.sort(np.concatenate(self.segmentos))]
+        return nuevas
+
+
+# Bloques de un CSV tipados según el registro de esquemas (y con cuarentena), con el lector de Arrow o el de pandas
+def leer_bloques(archivo, filas, read_kwargs, estadisticas):
+    if LECTOR_CSV == "arrow" and set(read_kwargs) <= {"sep"}:
+        return leer_csv_por_bloques(archivo, filas, cuarentena=True, estadisticas=estadisticas, **read_kwargs)
+    return leer_csv_por_bloques_pandas(archivo, filas, cuarentena=True, estadisticas=estadisticas, **read_kwargs)
+
+
+# Función para curar un fichero por bloques aplicando `limpiar` a cada bloque y eliminando duplicados entre bloques
+def curar_en_bloques(archivo, carpeta_salida, nombre, limpiar, memoria_mb=None, read_kwargs=None):
+    read_kwargs = read_kwargs or {}
+    filas = filas_por_bloque(archivo, memoria_mb, read_kwargs)
+    huellas = ConjuntoHuellas()
+    estadisticas = {"filas_leidas": 0, "descartadas_limpieza": 0, "duplicados": 0, "filas_escritas": 0,
+                    "bloques": 0, "filas_por_bloque": filas}
+
+    # Todos los bloques tienen el mismo esquema (los tipos del registro, sin categorías)
+    with EscritorTabla(carpeta_salida, nombre) as escritor:
+        for bloque in leer_bloques(archivo, filas, read_kwargs, estadisticas):
+            estadisticas["filas_leidas"] += len(bloque)
+            estadisticas["bloques"] += 1
+
+            df = limpiar(bloque)
+            estadisticas["descartadas_limpieza"] += len(bloque) - len(df)
+            nuevas = huellas.filtrar_nuevas(pd.util.hash_pandas_object(df, index=False).to_numpy())
+            estadisticas["duplicados"] += int(len(df) - nuevas.sum())
+            df = df[nuevas]
+
+            escritor.escribir(df)
+            estadisticas["filas_escritas"] += len(df)
+
+        # Fichero sin filas: se escribe al menos la cabecera
+        if estadisticas["bloques"] == 0:
+            with abrir_csv(archivo) as f:
+                escritor.escribir(limpiar(pd.read_csv(f, nrows=0, dtype=str, **read_kwargs)))
+
+    anotar(modo="streaming", **estadisticas)
+    return estadisticas
@@ -0,0 +1,385 @@
+'''
+Motor de perfilado de columnas
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y calcula las métricas del resumen por columnas de
+`proceso_data_profiling.py` recorriendo los datos una sola vez:
+
+- Las columnas numéricas se convierten juntas a una matriz float64 que se ordena por columnas una única vez.
+  Del orden salen mínimo, máximo, mediana, valores únicos, moda y su frecuencia; media, desviación y ceros se
+  calculan sobre la misma matriz, vectorizados para todas las columnas.
+- El resto de columnas se factorizan (un único recorrido por columna) y de los conteos de cada código salen
+  valores únicos, moda y su frecuencia, sin `value_counts` ni `mode`.
+- Los nulos se cuentan una vez y se reutilizan en el resumen general.
+
+Los resultados son los mismos que los del cálculo columna a columna original (la moda, en caso de empate, es
+el menor de los valores más frecuentes).
+
+Perfilado por bloques (`perfilar_en_bloques`): para ficheros que no caben en memoria se lee el CSV por bloques
+como texto y cada columna se resume con estructuras de memoria fija (`bocetos.py`): HyperLogLog para los valores
+distintos, compactadores KLL para la mediana, Misra-Gries para el valor más frecuente y Welford para media y
+desviación. Nulos, ceros, mínimo y máximo son exactos. Junto al resumen se devuelven las cotas de error de cada
+métrica aproximada (cero cuando el resultado es exacto). Una columna es numérica si todos sus valores no nulos
+se pueden convertir a número, como al leer el fichero completo con pandas.
+
+Como los resúmenes se pueden fusionar, el estado del perfilado de un fichero se puede guardar y actualizar: si
+en la siguiente ejecución las filas de los años ya perfilados no han cambiado (se comprueba con una huella por
+año que no depende del orden de las filas), sólo se perfilan las filas de los años nuevos.
+
+'''
+
+import numpy as np
+import pandas as pd
+
+from bocetos import CuantilesKLL, FrecuentesMG, HyperLogLog, Momentos
+from almacenamiento import LECTOR_CSV, abrir_csv, leer_csv_por_bloques
+from motor_curado import filas_por_bloque
+
+
+# Columnas del resumen por columnas, en el orden del informe
+COLUMNAS_RESUMEN = ["Columna", "Tipo de dato", "Valores únicos", "Nulos", "Ceros", "Completitud (%)",
+                    "Valor más frecuente", "Frecuencia del más frecuente (%)", "Valor máximo", "Valor mínimo",
+                    "Media", "Mediana", "Desviacion"]
+
+
+# Devuelve un valor calculado en float64 con el tipo de la columna original (enteros y booleanos)
+def _tipo_original(valor, dtype):
+    if pd.isna(valor):
+        return None
+    if pd.api.types.is_bool_dtype(dtype):
+        return bool(valor)
+    if pd.api.types.is_integer_dtype(dtype):
+        return int(valor)
+    return valor
+
+
+# Métricas de todas las columnas numéricas a partir de una única matriz ordenada
+def _metricas_numericas(df):
+    matriz = df.to_numpy(dtype="float64", na_value=np.nan)
+    validos = ~np.isnan(matriz)
+    n = validos.sum(axis=0)
+
+    # Media, desviación (cuasivarianza, como pandas) y ceros, vectorizados para todas las columnas
+    suma = np.where(validos, matriz, 0).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        media = np.where(n > 0, suma / n, np.nan)
+        desvios = np.where(validos, matriz - media, 0)
+        desviacion = np.where(n > 1, np.sqrt((desvios ** 2).sum(axis=0) / (n - 1)), np.nan)
+    ceros = (matriz == 0).sum(axis=0)
+
+    # Un solo ordenado por columnas (los nulos quedan al final)
+    ordenada = np.sort(matriz, axis=0)
+
+    metricas = {}
+    for i, col in enumerate(df.columns):
+        validos_col = int(n[i])
+        dtype = df[col].dtype
+        if validos_col == 0:
+            metricas[col] = dict(unicos=0, moda=None, frecuencia=0, maximo=np.nan, minimo=np.nan,
+                                 media=np.nan, mediana=np.nan, desviacion=np.nan, ceros=int(ceros[i]))
+            continue
+
+        valores = ordenada[:validos_col, i]
+        # Inicio de cada tramo de valores iguales y su longitud
+        inicios = np.flatnonzero(np.concatenate(([True], valores[1:] != valores[:-1])))
+        longitudes = np.diff(np.append(inicios, validos_col))
+        mas_frecuente = int(np.argmax(longitudes))  # el primer máximo es el menor valor (está ordenado)
+
+        mitad = validos_col // 2
+        mediana = valores[mitad] if validos_col % 2 else (valores[mitad - 1] + valores[mitad]) / 2
+
+        metricas[col] = dict(
+            unicos=len(inicios),
+            moda=_tipo_original(valores[inicios[mas_frecuente]], dtype),
+            frecuencia=int(longitudes[mas_frecuente]),
+            maximo=_tipo_original(valores[-1], dtype),
+            minimo=_tipo_original(valores[0], dtype),
+            media=media[i],
+            mediana=mediana,
+            desviacion=desviacion[i],
+            ceros=int(ceros[i]),
+        )
+    return metricas
+
+
+# Valores únicos, moda y frecuencia de una columna no numérica con una sola factorización
+def _metricas_categoricas(serie):
+    codigos, unicos = pd.factorize(serie, use_na_sentinel=True)
+    if len(unicos) == 0:
+        return dict(unicos=0, moda=None, frecuencia=0)
+
+    conteos = np.bincount(codigos[codigos >= 0], minlength=len(unicos))
+    frecuencia = int(conteos.max())
+    empatados = list(np.asarray(unicos)[conteos == frecuencia])
+    try:
+        moda = min(empatados)
+    except TypeError:
+        # Tipos mezclados que no se pueden comparar: el primero encontrado
+        moda = empatados[0]
+    return dict(unicos=len(unicos), moda=moda, frecuencia=frecuencia)
+
+
+# Resumen por columnas (tipos, únicos, nulos, completitud, moda y métricas de las numéricas) en un solo recorrido
+def perfilar_columnas(df, nulos=None):
+    registros = len(df)
+    nulos = df.isna().sum() if nulos is None else nulos
+
+    numericas = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+    metricas = _metricas_numericas(df[numericas]) if numericas else {}
+
+    resumen_columnas = []
+    for col in df.columns:
+        nulos_col = int(nulos[col])
+        if col in metricas:
+            m = metricas[col]
+        else:
+            m = dict(_metricas_categoricas(df[col]), maximo=None, minimo=None, media=None, mediana=None,
+                     desviacion=None, ceros=None)
+
+        resumen_columnas.append({
+            "Columna": col,
+            "Tipo de dato": str(df[col].dtype),
+            "Valores únicos": m["unicos"],
+            "Nulos": nulos_col,
+            "Ceros": m["ceros"],
+            "Completitud (%)": round(100 * (1 - nulos_col / registros), 2) if registros else np.nan,
+            "Valor más frecuente": m["moda"],
+            "Frecuencia del más frecuente (%)": m["frecuencia"] / registros if registros else np.nan,
+            "Valor máximo": m["maximo"],
+            "Valor mínimo": m["minimo"],
+            "Media": m["media"],
+            "Mediana": m["mediana"],
+            "Desviacion": m["desviacion"],
+        })
+    return pd.DataFrame(resumen_columnas, columns=COLUMNAS_RESUMEN)
+
+
+# Resumen general del fichero reutilizando los tipos, nulos y únicos del resumen por columnas
+def resumen_general(perfil, registros):
+    perfil = perfil.set_index("Columna")
+    return pd.DataFrame({
+        "Tipo de dato": perfil["Tipo de dato"],
+        "Valores únicos": perfil["Valores únicos"],
+        "Nulos": perfil["Nulos"],
+        "Completitud (%)": (1 - perfil["Nulos"] / registros) * 100 if registros else np.nan,
+        "Número de registros": registros,
+        "Número de variables": len(perfil)
+    })
+
+
+# Tipo que asigna pandas a una columna de texto (object o str según la versión)
+TIPO_TEXTO = str(pd.Series(["texto"]).dtype)
+
+# Columnas de la hoja de cotas de error del perfilado por bloques
+COLUMNAS_COTAS = ["Columna", "Valores únicos exactos", "Error típico valores únicos (%)",
+                  "Frecuencia del más frecuente exacta", "Error máximo frecuencia del más frecuente (%)",
+                  "Mediana exacta", "Error máximo de rango de la mediana (%)"]
+
+
+# Resumen en memoria fija de una columna leída por bloques
+class PerfilColumna:
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.nulos = 0
+        self.no_nulos = 0
+        # Resúmenes del texto (siempre) y de los valores numéricos (mientras la columna sea numérica)
+        self.distintos_texto = HyperLogLog()
+        self.frecuentes_texto = FrecuentesMG()
+        self.numerica = True
+        self.entera = True
+        self.distintos = HyperLogLog()
+        self.frecuentes = FrecuentesMG()
+        self.cuantiles = CuantilesKLL()
+        self.momentos = Momentos()
+
+    # Actualiza los resúmenes con un bloque. La columna se factoriza una vez: los valores distintos alimentan
+    # HyperLogLog, la conversión a número y la comprobación de enteros, y sus conteos el Misra-Gries
+    def actualizar(self, serie):
+        codigos, unicos = pd.factorize(serie, use_na_sentinel=True)
+        codigos = codigos[codigos >= 0]
+        self.nulos += len(serie) - len(codigos)
+        self.no_nulos += len(codigos)
+        if len(codigos) == 0:
+            return
+
+        unicos = pd.Series(np.asarray(unicos, dtype=object))
+        conteos = np.bincount(codigos, minlength=len(unicos))
+        self.distintos_texto.actualizar(unicos.to_numpy())
+        self.frecuentes_texto.actualizar_conteos(pd.Series(conteos, index=unicos.to_numpy()))
+        if not self.numerica:
+            return
+
+        numeros = pd.to_numeric(unicos, errors="coerce")
+        if numeros.isna().any():
+            # Hay valores no numéricos: pandas leería la columna como texto
+            self.numerica = self.entera = False
+            self.distintos = self.frecuentes = self.cuantiles = self.momentos = None
+            return
+        if self.entera:
+            self.entera = bool(unicos.str.fullmatch(r"\s*[+-]?\d+\s*").all())
+
+        numeros = numeros.to_numpy(dtype=np.float64)
+        self.distintos.actualizar(numeros)
+        self.frecuentes.actualizar_conteos(pd.Series(conteos, index=numeros).groupby(level=0).sum())
+        valores = numeros[codigos]
+        self.cuantiles.actualizar(valores)
+        self.momentos.actualizar(valores)
+
+    # Como en pandas, una columna entera con nulos se lee como float64 y una sin valores también
+    @property
+    def tipo(self):
+        if not self.numerica:
+            return TIPO_TEXTO
+        return "int64" if self.entera and self.nulos == 0 and self.no_nulos > 0 else "float64"
+
+    # Fusiona los resúmenes de otra parte de la misma columna
+    def fusionar(self, otro):
+        self.nulos += otro.nulos
+        self.no_nulos += otro.no_nulos
+        self.distintos_texto.fusionar(otro.distintos_texto)
+        self.frecuentes_texto.fusionar(otro.frecuentes_texto)
+        if self.numerica and otro.numerica:
+            self.entera = self.entera and otro.entera
+            self.distintos.fusionar(otro.distintos)
+            self.frecuentes.fusionar(otro.frecuentes)
+            self.cuantiles.fusionar(otro.cuantiles)
+            self.momentos.fusionar(otro.momentos)
+        else:
+            self.numerica = self.entera = False
+            self.distintos = self.frecuentes = self.cuantiles = self.momentos = None
+        return self
+
+    def _valor(self, valor):
+        if valor is None or pd.isna(valor):
+            return None
+        return int(valor) if self.tipo == "int64" else valor
+
+    # Fila del resumen por columnas y fila de cotas de error
+    def resumen(self, registros):
+        numerica = self.numerica
+        tipo = self.tipo
+
+        distintos = self.distintos if numerica else self.distintos_texto
+        frecuentes = self.frecuentes if numerica else self.frecuentes_texto
+        moda, frecuencia = frecuentes.moda()
+        fila = {
+            "Columna": self.nombre,
+            "Tipo de dato": tipo,
+            "Valores únicos": distintos.estimar(),
+            "Nulos": self.nulos,
+            "Ceros": self.momentos.ceros if numerica else None,
+            "Completitud (%)": round(100 * (1 - self.nulos / registros), 2) if registros else np.nan,
+            "Valor más frecuente": self._valor(moda) if numerica else moda,
+            "Frecuencia del más frecuente (%)": frecuencia / registros if registros else np.nan,
+            "Valor máximo": self._valor(self.momentos.maximo) if numerica else None,
+            "Valor mínimo": self._valor(self.momentos.minimo) if numerica else None,
+            "Media": (self.momentos.media if self.momentos.n else np.nan) if numerica else None,
+            "Mediana": self.cuantiles.mediana() if numerica else None,
+            "Desviacion": self.momentos.desviacion() if numerica else None,
+        }
+        cotas = {
+            "Columna": self.nombre,
+            "Valores únicos exactos": distintos.exacto,
+            "Error típico valores únicos (%)": 100 * distintos.error_relativo,
+            "Frecuencia del más frecuente exacta": frecuentes.exacto,
+            "Error máximo frecuencia del más frecuente (%)": 100 * frecuentes.decremento / registros if registros else 0.0,
+            "Mediana exacta": self.cuantiles.exacto if numerica else None,
+            "Error máximo de rango de la mediana (%)": 100 * self.cuantiles.error_rango_relativo if numerica else None,
+        }
+        return fila, cotas
+
+
+# Columnas con el año de cada fila (la primera que exista), para el perfilado incremental
+COLUMNAS_ANIO = ["TIME_PERIOD", "Year", "year"]
+
+
+# Filas y suma de las huellas de fila de cada año de un bloque (la suma no depende del orden de las filas)
+def huellas_por_anio(bloque, columna_anio):
+    huellas = pd.util.hash_pandas_object(bloque, index=False).to_numpy()
+    codigos, anios = pd.factorize(bloque[columna_anio].fillna(""))
+    filas = np.bincount(codigos, minlength=len(anios))
+    sumas = np.zeros(len(anios), dtype=np.uint64)
+    np.add.at(sumas, codigos, huellas)
+    return dict(zip(anios, zip(filas.tolist(), sumas.tolist())))
+
+
+# Estado del perfilado por bloques de un fichero: resúmenes de cada columna y, si el fichero tiene columna de
+# año, las filas y la huella de cada año. Se puede guardar (pickle) para actualizarlo en la siguiente ejecución
+class EstadoPerfilado:
+
+    def __init__(self, columnas, columna_anio=None):
+        self.perfiles = {col: PerfilColumna(col) for col in columnas}
+        self.registros = 0
+        self.columna_anio = columna_anio
+        self.huellas_anio = {}
+        # Filas procesadas en la última ejecución y si fue una actualización incremental
+        self.filas_procesadas = 0
+        self.incremental = False
+
+    def actualizar(self, bloque):
+        self.registros += len(bloque)
+        self.filas_procesadas += len(bloque)
+        for col in bloque.columns:
+            self.perfiles[col].actualizar(bloque[col])
+
+    def fusionar(self, otro):
+        self.registros += otro.registros
+        for col, perfil in otro.perfiles.items():
+            self.perfiles[col].fusionar(perfil)
+        return self
+
+    # Resumen por columnas (mismas columnas que `perfilar_columnas`) y cotas de error de cada columna
+    def resumen(self):
+        filas = [perfil.resumen(self.registros) for perfil in self.perfiles.values()]
+        return (pd.DataFrame([fila for fila, _ in filas], columns=COLUMNAS_RESUMEN),
+                pd.DataFrame([cotas for _, cotas in filas], columns=COLUMNAS_COTAS))
+
+
+def _leer_bloques(archivo, memoria_mb, read_kwargs):
+    # Todo se lee como texto para que el tipo de cada columna no dependa del bloque
+    filas = filas_por_bloque(archivo, memoria_mb, read_kwargs)
+    if LECTOR_CSV == "arrow" and set(read_kwargs) <= {"sep"}:
+        return leer_csv_por_bloques(archivo, filas, como_texto=True, **read_kwargs)
+    return pd.read_csv(archivo, chunksize=filas, dtype=str, **read_kwargs)
+
+
+# Perfilado de un CSV leído por bloques con memoria acotada. Devuelve el estado del perfilado (`.resumen()` da el
+# resumen por columnas y las cotas de error).
+# Con el estado de una ejecución anterior (`anterior`), si las filas de los años ya perfilados no han cambiado
+# sólo se procesan las de los años nuevos y se fusionan con el estado anterior; si ha cambiado algún año ya
+# perfilado se vuelve a perfilar todo el fichero
+def perfilar_en_bloques(archivo, memoria_mb=None, read_kwargs=None, anterior=None):
+    read_kwargs = read_kwargs or {}
+    with abrir_csv(archivo) as f:
+        columnas = list(pd.read_csv(f, nrows=0, **read_kwargs).columns)
+    columna_anio = next((c for c in COLUMNAS_ANIO if c in columnas), None)
+    incremental = (anterior is not None and columna_anio is not None and anterior.columna_anio == columna_anio
+                   and list(anterior.perfiles) == columnas)
+
+    estado = EstadoPerfilado(columnas, columna_anio)
+    huellas_anio = {}
+    for bloque in _leer_bloques(archivo, memoria_mb, read_kwargs):
+        if columna_anio is not None:
+            for anio, (filas, suma) in huellas_por_anio(bloque, columna_anio).items():
+                filas_previas, suma_previa = huellas_anio.get(anio, (0, 0))
+                huellas_anio[anio] = (filas_previas + filas, (suma_previa + suma) % 2 ** 64)
+        if incremental:
+            bloque = bloque[~bloque[columna_anio].fillna("").isin(anterior.huellas_anio.keys())]
+        estado.actualizar(bloque)
+
+    if incremental:
+        cambiados = [anio for anio, huella in anterior.huellas_anio.items() if huellas_anio.get(anio) != huella]
+        if cambiados:
+            # Han cambiado años ya perfilados: segunda lectura completa
+            estado = EstadoPerfilado(columnas, columna_anio)
+            for bloque in _leer_bloques(archivo, memoria_mb, read_kwargs):
+                estado.actualizar(bloque)
+        else:
+            filas_procesadas = estado.filas_procesadas
+            estado = anterior.fusionar(estado)
+            estado.filas_procesadas = filas_procesadas
+            estado.incremental = True
+
+    estado.huellas_anio = huellas_anio
+    return estado
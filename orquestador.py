@@ -0,0 +1,347 @@
+'''
+Orquestador del pipeline ETL
+-----------------------------------------------------------------------
+
+Este script forma parte del proceso ETL del Trabajo de Fin de Máster (TFM) y ejecuta en orden las etapas del
+pipeline (descarga → curado → estandarización → normalización) como funciones, en lugar de lanzar cada script
+por separado:
+
+1. **Etapas con entradas y salidas declaradas:**
+   - Cada etapa indica qué ficheros lee y qué fichero genera a partir de cada uno. Los módulos de las etapas
+     sólo se importan cuando la etapa tiene algo que hacer.
+
+2. **Caché por huella de contenido:**
+   - Para cada etapa y fichero de entrada se guarda en `.etl_cache/estado_orquestador.json` la huella del
+     fichero (`huellas.py`) y la firma de la etapa (código de sus módulos y configuración que afecta a la salida).
+   - Si ni la entrada ni la firma han cambiado y la salida existe, el fichero se omite. Si una etapa vuelve a
+     generar un fichero con el mismo contenido, las etapas siguientes tampoco se repiten.
+   - La descarga (opcional, `ETL_DESCARGAR=1`) usa su propio manifiesto y peticiones condicionales.
+   - Antes de las etapas los ficheros raw que no tienen la compresión configurada (`ETL_COMPRESION_RAW`, gzip por
+     defecto), como los de la EEA que se copian a mano, se recomprimen en streaming; las etapas leen directamente
+     los ficheros comprimidos.
+   - Con `ETL_CDC=1` antes de las etapas se capturan los cambios de los ficheros raw respecto a su publicación
+     anterior (`captura_cambios.py`) y el curado y la normalización sólo aplican el delta.
+
+3. **Paso de datos en memoria (`ETL_EN_MEMORIA=1`):**
+   - Cada fichero raw se cura, se estandariza y se normaliza en el mismo proceso pasando los DataFrames de una
+     etapa a la siguiente, sin escribir los ficheros curados ni estandarizados. Sólo se guardan las tablas de
+     hechos y dimensiones.
+   - Los ficheros que no caben en el presupuesto de memoria (`ETL_MEMORIA_MB`) siguen el camino en disco, con el
+     curado por bloques.
+
+4. **Tabla de intensidad de emisiones (`ETL_INDICADORES`, activa por defecto):**
+   - Después de la normalización se actualiza la tabla ancha por (geo, año) con emisiones, PIB, energía y sus
+     indicadores (`tabla_intensidad.py`), recalculando sólo los pares de las tablas de hechos que han cambiado.
+
+5. **Base analítica (`ETL_ANALITICA=1`):**
+   - Al terminar se actualizan la base embebida y sus agregados (`base_analitica.py`), sólo con lo que ha cambiado.
+
+6. **Métricas:**
+   - Cada etapa y cada fichero se miden (tiempo, filas, bytes y pico de memoria) en `.etl_cache/metricas.jsonl`
+     (`metricas.py`), con el mismo identificador de ejecución para todo el pipeline.
+
+'''
+
+import hashlib
+import importlib
+import json
+import os
+import traceback
+
+from huellas import cargar_estado, guardar_estado, ha_cambiado, huella_fichero, huella_modulo
+from metricas import medir
+
+
+# Paths en local
+
+CARPETA_RAW_EUROSTAT = os.path.join("ficheros_raw", "eurostat")
+CARPETA_RAW_EEA = os.path.join("ficheros_raw", "eea")
+CARPETA_CURADO_EUROSTAT = os.path.join("ficheros_curado", "eurostat")
+CARPETA_CURADO_EEA = os.path.join("ficheros_curado", "eea")
+CARPETA_ESTANDARIZADOS = "ficheros_estandarizados"
+CARPETA_FACT = "ficheros_fact"
+
+RUTA_ESTADO = os.path.join(".etl_cache", "estado_orquestador.json")
+
+# Descargar los datasets antes de procesarlos y pasar los datos entre etapas en memoria
+DESCARGAR = os.environ.get("ETL_DESCARGAR", "0") == "1"
+EN_MEMORIA = os.environ.get("ETL_EN_MEMORIA", "0") == "1"
+
+# Actualizar la tabla de intensidad de emisiones después de la normalización
+INDICADORES = os.environ.get("ETL_INDICADORES", "1") == "1"
+
+# Actualizar la base analítica (tablas y agregados para los cuadros de mando) al terminar
+ANALITICA = os.environ.get("ETL_ANALITICA", "0") == "1"
+
+# Módulos compartidos por todas las etapas y variables de entorno que cambian su salida (forman parte de la firma)
+MODULOS_COMUNES = ["almacenamiento", "captura_cambios", "catalogo_datasets", "esquemas_datasets", "motor_curado",
+                   "particionado", "registro_dimensiones", "vistas_estandarizacion"]
+VARIABLES_CONFIGURACION = ["ETL_FORMATO_INTERMEDIO", "ETL_CLAVES_SUBROGADAS", "ETL_FACT_PARTICIONADO"]
+
+
+# Ficheros raw (CSV, comprimidos o no) de una carpeta
+def _ficheros_raw(carpeta):
+    from almacenamiento import listar_raw
+    return listar_raw(carpeta)
+
+
+def _tablas(carpeta):
+    from almacenamiento import listar_tablas
+    return listar_tablas(carpeta)
+
+
+def _ruta_intermedia(carpeta, archivo):
+    from almacenamiento import nombre_tabla, ruta_tabla
+    return ruta_tabla(carpeta, nombre_tabla(archivo))
+
+
+# Ruta del CSV de la tabla de hechos que se genera a partir de un fichero (raw o estandarizado)
+def _ruta_hechos(archivo):
+    from almacenamiento import nombre_tabla, ruta_tabla
+    from proceso_normalizacion import nombre_tabla_hechos
+    return ruta_tabla(CARPETA_FACT, nombre_tabla_hechos(nombre_tabla(archivo)), "csv")
+
+
+# Firma de un conjunto de módulos más la configuración que afecta a la salida
+def firma_modulos(modulos):
+    contenido = {
+        "modulos": {m: huella_modulo(m) for m in sorted(set(modulos) | set(MODULOS_COMUNES))},
+        "configuracion": {v: os.environ.get(v) for v in VARIABLES_CONFIGURACION},
+    }
+    return hashlib.sha256(json.dumps(contenido, sort_keys=True).encode()).hexdigest()
+
+
+class Etapa:
+
+    def __init__(self, nombre, modulo, entradas, salida):
+        self.nombre = nombre
+        self.modulo = modulo
+        self.entradas = entradas
+        self.salida = salida
+
+    def cargar(self):
+        return importlib.import_module(self.modulo)
+
+    def firma(self):
+        return firma_modulos([self.modulo])
+
+
+# Etapas que trabajan fichero a fichero, en orden de ejecución
+ETAPAS = [
+    Etapa("curado_eurostat", "proceso_curado_eurostat",
+          lambda: _ficheros_raw(CARPETA_RAW_EUROSTAT),
+          lambda archivo: _ruta_intermedia(CARPETA_CURADO_EUROSTAT, archivo)),
+    Etapa("curado_eea", "proceso_curado_eea",
+          lambda: _ficheros_raw(CARPETA_RAW_EEA),
+          lambda archivo: _ruta_intermedia(CARPETA_CURADO_EEA, archivo)),
+    Etapa("estandarizacion", "proceso_estandarizacion",
+          lambda: _tablas(CARPETA_CURADO_EUROSTAT) + _tablas(CARPETA_CURADO_EEA),
+          lambda archivo: _ruta_intermedia(CARPETA_ESTANDARIZADOS, archivo)),
+    Etapa("normalizacion", "proceso_normalizacion",
+          lambda: _tablas(CARPETA_ESTANDARIZADOS),
+          _ruta_hechos),
+]
+
+
+# Indica si un fichero ya se procesó con la misma firma, su contenido no ha cambiado y su salida existe
+def _al_dia(registro, archivo, firma, salida):
+    return (registro is not None and registro.get("firma") == firma and os.path.exists(salida)
+            and not ha_cambiado(archivo, registro.get("entrada")))
+
+
+# Registra en el estado un fichero procesado correctamente
+def _registrar(estado_etapa, archivo, firma, salida):
+    anterior = (estado_etapa.get(archivo) or {}).get("entrada")
+    estado_etapa[archivo] = {"entrada": huella_fichero(archivo, anterior), "firma": firma, "salida": salida}
+
+
+# Separa las entradas de una etapa en pendientes y al día. Las entradas que ya no existen se olvidan
+def ficheros_pendientes(estado_etapa, entradas, firma, salida, forzar=False):
+    for archivo in set(estado_etapa) - set(entradas):
+        del estado_etapa[archivo]
+    if forzar:
+        return list(entradas)
+    return [a for a in entradas if not _al_dia(estado_etapa.get(a), a, firma, salida(a))]
+
+
+# Ejecuta una etapa sólo para los ficheros pendientes. Devuelve {archivo: error}
+def ejecutar_etapa(etapa, estado, workers=None, forzar=False):
+    firma = etapa.firma()
+    estado_etapa = estado.setdefault(etapa.nombre, {})
+    entradas = etapa.entradas()
+    pendientes = ficheros_pendientes(estado_etapa, entradas, firma, etapa.salida, forzar)
+
+    if not pendientes:
+        print(f"⏭️  {etapa.nombre}: sin cambios ({len(entradas)} fichero(s))")
+        return {}
+    print(f"▶️  {etapa.nombre}: {len(pendientes)} fichero(s) pendientes, {len(entradas) - len(pendientes)} sin cambios")
+
+    _, errores = etapa.cargar().main(workers=workers, archivos=pendientes)
+    for archivo in pendientes:
+        if archivo not in errores and os.path.exists(etapa.salida(archivo)):
+            _registrar(estado_etapa, archivo, firma, etapa.salida(archivo))
+    return errores
+
+
+# Curado y estandarización en memoria de un fichero raw. Devuelve el DataFrame estandarizado
+def preparar_en_memoria(archivo):
+    from almacenamiento import nombre_tabla
+
+    if os.path.dirname(os.path.normpath(archivo)) == CARPETA_RAW_EEA:
+        import proceso_curado_eea
+        import proceso_estandarizacion
+        return proceso_estandarizacion.estandarizar_dataframe(nombre_tabla(archivo),
+                                                              proceso_curado_eea.curar_dataframe(archivo))
+    # Los ficheros de Eurostat ya tienen la estructura estándar
+    import proceso_curado_eurostat
+    return proceso_curado_eurostat.curar_dataframe(archivo)
+
+
+# Pipeline completo pasando los DataFrames entre etapas sin escribir ficheros intermedios.
+# Los ficheros se preparan por lotes de `workers` y se normalizan en orden, para que las claves de las
+# dimensiones sean las mismas que en la ejecución en disco. Devuelve {archivo: error}
+def ejecutar_en_memoria(estado, workers=None, forzar=False):
+    from almacenamiento import nombre_tabla
+    from ejecucion_paralela import WORKERS, ejecutar_por_archivo
+    from motor_curado import usar_streaming
+    import proceso_normalizacion
+
+    workers = workers or WORKERS
+    firma = firma_modulos(["orquestador", "proceso_curado_eurostat", "proceso_curado_eea",
+                           "proceso_estandarizacion", "proceso_normalizacion"])
+    estado_etapa = estado.setdefault("en_memoria", {})
+    entradas = sorted(_ficheros_raw(CARPETA_RAW_EUROSTAT) + _ficheros_raw(CARPETA_RAW_EEA), key=nombre_tabla)
+    pendientes = ficheros_pendientes(estado_etapa, entradas, firma, _ruta_hechos, forzar)
+    if not pendientes:
+        print(f"⏭️  en memoria: sin cambios ({len(entradas)} fichero(s))")
+        return {}
+
+    # Los ficheros que no caben en memoria se curan por bloques y siguen el camino en disco
+    en_disco = [a for a in pendientes if usar_streaming(a)]
+    en_memoria = [a for a in pendientes if a not in en_disco]
+    print(f"▶️  en memoria: {len(en_memoria)} fichero(s) en memoria, {len(en_disco)} en disco, "
+          f"{len(entradas) - len(pendientes)} sin cambios")
+
+    for carpeta in [proceso_normalizacion.CARPETA_FACT, proceso_normalizacion.CARPETA_DIM]:
+        os.makedirs(carpeta, exist_ok=True)
+    registro = proceso_normalizacion.RegistroDimensiones(proceso_normalizacion.dim_cols,
+                                                         proceso_normalizacion.CARPETA_DIM).cargar()
+    errores = {}
+    for inicio in range(0, len(en_memoria), max(workers, 1)):
+        lote = en_memoria[inicio:inicio + max(workers, 1)]
+        preparados, errores_lote = ejecutar_por_archivo(preparar_en_memoria, lote, workers,
+                                                        desc="Curando y estandarizando en memoria",
+                                                        etapa="curado_estandarizacion_en_memoria")
+        errores.update(errores_lote)
+        for archivo in lote:
+            if archivo not in preparados:
+                continue
+            try:
+                with medir("normalizacion_en_memoria", archivo):
+                    proceso_normalizacion.normalizar_dataframe(nombre_tabla(archivo), preparados.pop(archivo),
+                                                               registro)
+                _registrar(estado_etapa, archivo, firma, _ruta_hechos(archivo))
+            except Exception as e:
+                errores[archivo] = f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+    registro.guardar()
+
+    if en_disco:
+        errores.update(_ejecutar_en_disco(en_disco, workers))
+        for archivo in en_disco:
+            if archivo not in errores and os.path.exists(_ruta_hechos(archivo)):
+                _registrar(estado_etapa, archivo, firma, _ruta_hechos(archivo))
+    return errores
+
+
+# Camino en disco para una lista de ficheros raw concretos (sin caché por etapa)
+def _ejecutar_en_disco(archivos, workers=None):
+    import proceso_curado_eea
+    import proceso_curado_eurostat
+    import proceso_estandarizacion
+    import proceso_normalizacion
+
+    errores = {}
+    curados = []
+    for modulo, carpeta_raw, carpeta_curado in [(proceso_curado_eurostat, CARPETA_RAW_EUROSTAT, CARPETA_CURADO_EUROSTAT),
+                                                (proceso_curado_eea, CARPETA_RAW_EEA, CARPETA_CURADO_EEA)]:
+        propios = [a for a in archivos if os.path.dirname(os.path.normpath(a)) == carpeta_raw]
+        if propios:
+            errores.update(modulo.main(workers=workers, archivos=propios)[1])
+            curados += [_ruta_intermedia(carpeta_curado, a) for a in propios if a not in errores]
+
+    if curados:
+        _, errores_estandarizacion = proceso_estandarizacion.main(workers=workers, archivos=curados)
+        estandarizados = [_ruta_intermedia(CARPETA_ESTANDARIZADOS, a) for a in curados if a not in errores_estandarizacion]
+        _, errores_normalizacion = proceso_normalizacion.main(workers=workers, archivos=estandarizados)
+        errores.update(errores_estandarizacion)
+        errores.update(errores_normalizacion)
+    return errores
+
+
+# Descarga de los datasets de Eurostat (la caché la lleva el manifiesto de descargas)
+def ejecutar_descarga():
+    import proceso_descarga_api
+    os.makedirs(CARPETA_RAW_EUROSTAT, exist_ok=True)
+    return proceso_descarga_api.descargar_datasets(proceso_descarga_api.dataset_urls, CARPETA_RAW_EUROSTAT)
+
+
+# Recompresión de los ficheros raw que no tienen la compresión configurada, para que toda la capa raw quede igual
+def comprimir_capa_raw():
+    from almacenamiento import COMPRESION_RAW, comprimir_raw, compresion_de
+
+    for carpeta in [CARPETA_RAW_EUROSTAT, CARPETA_RAW_EEA]:
+        for archivo in _ficheros_raw(carpeta):
+            if compresion_de(archivo) != COMPRESION_RAW:
+                with medir("compresion_raw", archivo):
+                    nuevo = comprimir_raw(archivo)
+                print(f"🗜️  {archivo} → {nuevo}")
+
+
+# Ejecución del pipeline completo
+def main(workers=None, descargar=None, en_memoria=None, forzar=False, analitica=None, indicadores=None):
+    descargar = DESCARGAR if descargar is None else descargar
+    en_memoria = EN_MEMORIA if en_memoria is None else en_memoria
+    analitica = ANALITICA if analitica is None else analitica
+    indicadores = INDICADORES if indicadores is None else indicadores
+
+    if descargar:
+        ejecutar_descarga()
+    comprimir_capa_raw()
+
+    # Captura de cambios de los ficheros raw (también de los que no se descargan desde la API)
+    import captura_cambios
+    if captura_cambios.CDC_ACTIVO and not en_memoria:
+        with medir("captura_cambios"):
+            captura_cambios.main()
+
+    estado = cargar_estado(RUTA_ESTADO)
+    errores = {}
+    try:
+        if en_memoria:
+            with medir("pipeline_en_memoria"):
+                errores.update(ejecutar_en_memoria(estado, workers, forzar))
+        else:
+            for etapa in ETAPAS:
+                with medir(f"pipeline_{etapa.nombre}"):
+                    errores.update(ejecutar_etapa(etapa, estado, workers, forzar))
+    finally:
+        # El estado se guarda aunque una etapa falle, para no repetir lo que ya terminó
+        guardar_estado(estado, RUTA_ESTADO)
+
+    if indicadores:
+        import tabla_intensidad
+        tabla_intensidad.actualizar_tabla()
+
+    if analitica:
+        import base_analitica
+        base_analitica.actualizar_base()
+
+    if errores:
+        print(f"❌ Pipeline finalizado con {len(errores)} fichero(s) con errores")
+    else:
+        print("✅ Pipeline finalizado")
+    return errores
+
+
+if __name__ == "__main__":
+    main()
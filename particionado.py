@@ -0,0 +1,199 @@
+'''
+Tablas de hechos particionadas (estilo Hive)
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y escribe cada tabla de hechos como un conjunto de particiones
+por `TIME_PERIOD` y/o `geo`, con la estructura de carpetas que entienden DuckDB, Spark o pyarrow para descartar
+particiones sin leerlas (partition pruning):
+
+    ficheros_fact/particionado/fact_aea/TIME_PERIOD=2020/geo=ES/part-0.parquet
+
+- Las columnas de partición de cada tabla se configuran en el catálogo (`particiones` en `catalogo_datasets.py`).
+  Las que no existan en una tabla se ignoran. Los valores de partición son los códigos originales (no las claves
+  subrogadas) y, como en Hive, no se repiten dentro de los ficheros; los vacíos van a `__HIVE_DEFAULT_PARTITION__`.
+- Cada tabla tiene un manifiesto (`_manifiesto.json`) con las filas, la huella del contenido y el mínimo y el
+  máximo de cada columna numérica de cada partición.
+- Al volver a escribir una tabla sólo se reescriben las particiones cuyo contenido ha cambiado (según su huella) y
+  se borran las que ya no tienen filas. Si cambian las columnas de partición o el formato se reescribe entera.
+- Las particiones se escriben en el formato intermedio configurado (`ETL_FORMATO_INTERMEDIO`).
+
+Consulta con DuckDB:
+`SELECT ... FROM read_parquet('ficheros_fact/particionado/fact_aea/**/*.parquet', hive_partitioning = true)
+WHERE geo = 'ES'`. Desde Python, `leer_particionada` usa el manifiesto para leer sólo las particiones necesarias.
+
+'''
+
+import hashlib
+import os
+import shutil
+from urllib.parse import quote, unquote
+
+import pandas as pd
+
+from almacenamiento import (EXTENSIONES, FORMATO_INTERMEDIO, escribir_tabla, filtros_aplicables, leer_tabla,
+                            mascara_filtros)
+from huellas import cargar_estado, guardar_estado
+
+
+NOMBRE_MANIFIESTO = "_manifiesto.json"
+NOMBRE_FICHERO = "part-0"
+
+# Valor de partición de las filas sin valor (mismo nombre que usan Hive y Spark)
+VALOR_NULO = "__HIVE_DEFAULT_PARTITION__"
+
+
+# Ruta relativa de una partición a partir de sus valores: `col1=valor1/col2=valor2`
+def ruta_particion(columnas, valores):
+    return "/".join(f"{columna}={quote(str(valor), safe='')}" for columna, valor in zip(columnas, valores))
+
+
+# Valores de una partición a partir de su ruta relativa
+def valores_particion(ruta):
+    return {parte.split("=", 1)[0]: unquote(parte.split("=", 1)[1]) for parte in ruta.split("/") if "=" in parte}
+
+
+# Valores de una columna de partición como texto (los años leídos como decimales por tener vacíos quedan enteros)
+def _texto_particion(serie):
+    if pd.api.types.is_float_dtype(serie) and (serie.dropna() % 1 == 0).all():
+        serie = serie.astype("Int64")
+    return serie.astype("string").fillna(VALOR_NULO)
+
+
+# Huella del contenido de una partición (independiente del orden de las columnas en el fichero)
+def huella_particion(df):
+    huella = hashlib.sha256()
+    df = df[sorted(df.columns)]
+    huella.update("\x1f".join(f"{c}:{df[c].dtype}" for c in df.columns).encode())
+    huella.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return huella.hexdigest()
+
+
+# Valor de pandas/numpy como tipo de Python serializable en JSON (None si falta)
+def _valor_json(valor):
+    if pd.isna(valor):
+        return None
+    return valor.item() if hasattr(valor, "item") else valor
+
+
+# Mínimo y máximo de las columnas numéricas de una partición
+def estadisticas_particion(df):
+    minimos, maximos = {}, {}
+    for columna in df.columns:
+        if pd.api.types.is_numeric_dtype(df[columna]) and not pd.api.types.is_bool_dtype(df[columna]):
+            minimos[columna] = _valor_json(df[columna].min())
+            maximos[columna] = _valor_json(df[columna].max())
+    return minimos, maximos
+
+
+# Borra una carpeta de partición y las carpetas padre que queden vacías, sin salir de la tabla
+def _borrar_particion(carpeta_tabla, ruta):
+    shutil.rmtree(os.path.join(carpeta_tabla, ruta), ignore_errors=True)
+    padre = os.path.dirname(ruta)
+    while padre:
+        directorio = os.path.join(carpeta_tabla, padre)
+        if os.path.isdir(directorio) and not os.listdir(directorio):
+            os.rmdir(directorio)
+        padre = os.path.dirname(padre)
+
+
+# Escritura de una tabla de hechos particionada en `carpeta/nombre/`. Las columnas de partición se toman de `df` o,
+# si no están (p. ej. porque se han sustituido por claves subrogadas), de `valores`, alineado por índice con `df`.
+# Devuelve el manifiesto y cuántas particiones se han escrito, se han mantenido y se han borrado
+def escribir_particionada(df, carpeta, nombre, columnas, valores=None, formato=None):
+    formato = formato or FORMATO_INTERMEDIO
+    carpeta_tabla = os.path.join(carpeta, nombre)
+    ruta_manifiesto = os.path.join(carpeta_tabla, NOMBRE_MANIFIESTO)
+
+    fuentes = [df] + ([valores] if valores is not None else [])
+    columnas = [c for c in columnas if any(c in fuente.columns for fuente in fuentes)]
+    claves = pd.DataFrame({c: _texto_particion(next(f[c] for f in fuentes if c in f.columns)) for c in columnas},
+                          index=df.index)
+    datos = df.drop(columns=[c for c in columnas if c in df.columns])
+
+    anterior = cargar_estado(ruta_manifiesto)
+    if anterior.get("columnas_particion") != columnas or anterior.get("formato") != formato:
+        # Otra distribución de particiones: se empieza de cero
+        shutil.rmtree(carpeta_tabla, ignore_errors=True)
+        anterior = {}
+    particiones_anteriores = anterior.get("particiones", {})
+    os.makedirs(carpeta_tabla, exist_ok=True)
+
+    particiones = {}
+    escritas = mantenidas = 0
+    if len(datos.columns) and len(datos):
+        grupos = claves.groupby(columnas, sort=True).indices if columnas else {(): range(len(datos))}
+        for valores_grupo, posiciones in grupos.items():
+            valores_grupo = valores_grupo if isinstance(valores_grupo, tuple) else (valores_grupo,)
+            ruta = ruta_particion(columnas, valores_grupo)
+            parte = datos.iloc[posiciones].reset_index(drop=True)
+            for columna in parte.columns:
+                if isinstance(parte[columna].dtype, pd.CategoricalDtype):
+                    parte[columna] = parte[columna].cat.remove_unused_categories()
+
+            huella = huella_particion(parte)
+            fichero = "/".join(p for p in [ruta, f"{NOMBRE_FICHERO}{EXTENSIONES[formato]}"] if p)
+            previa = particiones_anteriores.get(ruta)
+            if previa and previa.get("huella") == huella and os.path.exists(os.path.join(carpeta_tabla, fichero)):
+                particiones[ruta] = previa
+                mantenidas += 1
+                continue
+
+            carpeta_particion = os.path.join(carpeta_tabla, ruta) if ruta else carpeta_tabla
+            os.makedirs(carpeta_particion, exist_ok=True)
+            escribir_tabla(parte, carpeta_particion, NOMBRE_FICHERO, formato)
+            minimos, maximos = estadisticas_particion(parte)
+            particiones[ruta] = {"fichero": fichero, "filas": len(parte), "huella": huella,
+                                 "min": minimos, "max": maximos}
+            escritas += 1
+
+    # Particiones que ya no tienen filas
+    borradas = [ruta for ruta in particiones_anteriores if ruta not in particiones]
+    for ruta in borradas:
+        if ruta:
+            _borrar_particion(carpeta_tabla, ruta)
+        else:
+            os.remove(os.path.join(carpeta_tabla, particiones_anteriores[ruta]["fichero"]))
+
+    manifiesto = {"tabla": nombre, "formato": formato, "columnas_particion": columnas,
+                  "columnas": list(datos.columns), "filas": sum(p["filas"] for p in particiones.values()),
+                  "particiones": particiones}
+    guardar_estado(manifiesto, ruta_manifiesto)
+    return manifiesto, {"escritas": escritas, "mantenidas": mantenidas, "borradas": len(borradas)}
+
+
+# Manifiesto de una tabla particionada (diccionario vacío si no existe)
+def leer_manifiesto(carpeta_tabla):
+    return cargar_estado(os.path.join(carpeta_tabla, NOMBRE_MANIFIESTO))
+
+
+# Lectura de una tabla particionada. Los filtros (como en `leer_tabla`) sobre columnas de partición se resuelven con
+# el manifiesto, de modo que sólo se abren las particiones que los cumplen; el resto se aplican al leer cada una.
+# Las columnas de partición se añaden como texto. Los filtros sobre columnas que no tiene la tabla dan error salvo
+# con `ignorar_ausentes`
+def leer_particionada(carpeta_tabla, columnas=None, filtros=None, ignorar_ausentes=False):
+    manifiesto = leer_manifiesto(carpeta_tabla)
+    columnas_particion = manifiesto.get("columnas_particion", [])
+    filtros = filtros or []
+    if manifiesto:
+        filtros = filtros_aplicables(filtros, set(manifiesto["columnas"] + columnas_particion), ignorar_ausentes)
+    filtros_particion = [(c, op, [str(v) for v in valor] if op in ("in", "not in") else str(valor))
+                         for c, op, valor in filtros if c in columnas_particion]
+    filtros_resto = [filtro for filtro in filtros if filtro[0] not in columnas_particion]
+
+    rutas = list(manifiesto.get("particiones", {}))
+    if filtros_particion and rutas:
+        df_valores = pd.DataFrame([valores_particion(ruta) for ruta in rutas], columns=columnas_particion)
+        rutas = [ruta for ruta, ok in zip(rutas, mascara_filtros(df_valores, filtros_particion)) if ok]
+
+    partes = []
+    for ruta in rutas:
+        entrada = manifiesto["particiones"][ruta]
+        parte = leer_tabla(os.path.join(carpeta_tabla, entrada["fichero"]), columnas=columnas, filtros=filtros_resto)
+        for columna, valor in valores_particion(ruta).items():
+            if columnas is None or columna in columnas:
+                parte[columna] = None if valor == VALOR_NULO else valor
+        partes.append(parte)
+    if not partes:
+        return pd.DataFrame(columns=[c for c in manifiesto.get("columnas", []) + columnas_particion
+                                     if columnas is None or c in columnas])
+    return pd.concat(partes, ignore_index=True)
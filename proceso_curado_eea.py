@@ -7,23 +7,39 @@ los archivos .csv provenientes de la EEA, previamente descargados y almacenados
 `ficheros_raw/eea`.
 
 Acciones que realiza el script:
-1. Lee todos los archivos .csv en la carpeta de entrada (`ficheros_raw/eea`).
+1. Lee todos los archivos .csv en la carpeta de entrada (`ficheros_raw/eea`), comprimidos o no (`.csv.gz`,
+   `.csv.zst`), directamente del fichero comprimido.
 2. Aplica reglas específicas de limpieza:
    - Elimina filas completamente vacías.
    - Filtra filas con valores nulos en columnas clave como `year` o `Year`.
-   - En el archivo especial `ETS_Database_v51_May23.csv`, elimina filas con el valor "Total" en la columna `year`.
+   - En el archivo especial `ETS_Database_v51_May23`, elimina filas con el valor "Total" en la columna `year`.
 3. Realiza la conversión de tipos:
-   - Convierte columnas como `emissions`, `value`, `year` y `Year` a formatos numéricos (`float64`, `int64`).
+   - Convierte columnas como `emissions`, `value`, `year` y `Year` a formatos numéricos (`float64` y enteros con
+     vacíos, `Int64`). Las filas que se quedan sin año se eliminan.
+   - Los ficheros se leen con los tipos del registro de esquemas (`esquemas_datasets.py`); las filas que no se
+     pueden leer se apartan a `ficheros_cuarentena` en lugar de abortar el fichero.
 4. Eliminar registros duplicados.
-5. Guarda los archivos curados en la carpeta `ficheros_curado/eea`, manteniendo el nombre original.
+5. Guarda los archivos curados en la carpeta `ficheros_curado/eea`, manteniendo el nombre original,
+   en el formato intermedio configurado (`ETL_FORMATO_INTERMEDIO`: csv, parquet o arrow).
+
+Los ficheros grandes se curan por bloques con memoria acotada (ver `motor_curado.py`, `ETL_MODO_CURADO`
+y `ETL_MEMORIA_MB`): se aplican las mismas reglas y los duplicados se eliminan entre bloques.
+
+Con la captura de cambios activa (`ETL_CDC=1`, ver `captura_cambios.py`), si hay un delta respecto a la publicación
+con la que se generó el fichero curado sólo se curan las filas del delta y se aplican sobre él.
 
 '''
 
 
 import pandas as pd
-import glob
 import os
-from tqdm import tqdm
+
+import captura_cambios
+from almacenamiento import escribir_tabla, leer_tabla, listar_raw, nombre_tabla, ruta_tabla
+from esquemas_datasets import opciones_lectura as opciones_esquema
+from motor_curado import curar_en_bloques, usar_streaming
+from ejecucion_paralela import ejecutar_por_archivo, informar_errores
+from metricas import anotar
 
 
 # Paths
@@ -35,42 +51,89 @@ CARPETA_CURADO = os.path.join("ficheros_curado", "eea")
 root_folder = "ficheros_curado"
 secundary_folder = "eea"
 folder_path = os.path.join(root_folder, secundary_folder)
-os.makedirs(folder_path, exist_ok=True)
-
-
-archivos_raw = glob.glob(os.path.join(CARPETA_RAW, "*.csv"))
-
-for archivo in tqdm(archivos_raw, desc="Limpiando y guardando archivos raw"):
-    try:
-        if os.path.basename(archivo) == "ETS_Database_v51_May23.csv":
-            df = pd.read_csv(archivo, sep='\t', low_memory=False)
-            df = df[~df['year'].str.contains('Total', na=False)]
-        else:
-            df = pd.read_csv(archivo, low_memory=False)
-        
-        
-        # 1) Eliminar filas completamente vacías o aquellas PK con valores null
-        df = df.dropna(how='all')
-        if 'Year' in df.columns:
-            df = df[df['Year'].notna()]  # eliminar filas con null en 'Year'
-        if 'year' in df.columns:
-            df = df[df['year'].notna()]  # eliminar filas con null en 'year'
-        # 2) Convertir 'emissions' a float64 y Year a int64. Coercion convierte errores a NaN
-        if 'emissions' in df.columns:
-            df['emissions'] = pd.to_numeric(df['emissions'], errors='coerce').astype('float64')
-        if 'Year' in df.columns:
-            df['Year'] = pd.to_numeric(df['Year'], errors='coerce').astype('int64')
-        
-        if 'value' in df.columns:
-            df['value'] = pd.to_numeric(df['value'], errors='coerce').astype('float64')
-        if 'year' in df.columns:
-            df['year'] = pd.to_numeric(df['year'], errors='coerce').astype('int64')
-
-        # 3) Eliminar registros duplicados
-        df = df.drop_duplicates()   
-        # Guardar CSV curado
-        nombre = os.path.basename(archivo)
-        ruta_curado = os.path.join(CARPETA_CURADO, nombre)
-        df.to_csv(ruta_curado, index=False)
-    except Exception as e:
-        print(f"Error limpiando {archivo}: {e}")
+
+
+# Dataset especial separado por tabuladores
+DATASET_ETS = "ETS_Database_v51_May23"
+
+
+# Reglas de limpieza de un DataFrame (o de un bloque del fichero en modo streaming), sin la eliminación de duplicados
+def limpiar(df, nombre):
+    if nombre == DATASET_ETS:
+        df = df[~df['year'].str.contains('Total', na=False)]
+
+    # 1) Eliminar filas completamente vacías o aquellas PK con valores null
+    df = df.dropna(how='all')
+    if 'Year' in df.columns:
+        df = df[df['Year'].notna()]  # eliminar filas con null en 'Year'
+    if 'year' in df.columns:
+        df = df[df['year'].notna()]  # eliminar filas con null en 'year'
+    # 2) Convertir 'emissions' a float64 y Year a entero. Coercion convierte errores a NaN, así que los años se
+    # convierten a Int64 (admite vacíos) y se eliminan las filas que se quedan sin año
+    df = df.copy()
+    if 'emissions' in df.columns:
+        df['emissions'] = pd.to_numeric(df['emissions'], errors='coerce').astype('float64')
+    if 'Year' in df.columns:
+        df['Year'] = pd.to_numeric(df['Year'], errors='coerce').astype('Int64')
+        df = df[df['Year'].notna()]
+
+    if 'value' in df.columns:
+        df['value'] = pd.to_numeric(df['value'], errors='coerce').astype('float64')
+    if 'year' in df.columns:
+        df['year'] = pd.to_numeric(df['year'], errors='coerce').astype('Int64')
+        df = df[df['year'].notna()]
+    return df
+
+
+# Curado en memoria de un fichero completo: devuelve el DataFrame curado sin guardarlo
+def curar_dataframe(archivo):
+    nombre = nombre_tabla(archivo)
+    lectura = {}
+    df = leer_tabla(archivo, estadisticas=lectura, cuarentena=True, **opciones_esquema(nombre))
+    filas_leidas = len(df)
+    df = limpiar(df, nombre)
+    filas_limpias = len(df)
+    # 3) Eliminar registros duplicados
+    df = df.drop_duplicates()
+    anotar(modo="memoria", filas_leidas=lectura["filas_leidas"], filas_cuarentena=lectura.get("filas_cuarentena", 0),
+           descartadas_limpieza=filas_leidas - filas_limpias, duplicados=filas_limpias - len(df))
+    return df
+
+
+# Curado de un fichero completo, en memoria o por bloques según su tamaño y el presupuesto de memoria
+def curar_archivo(archivo):
+    nombre = nombre_tabla(archivo)
+    read_kwargs = opciones_esquema(nombre)
+
+    # Con un delta pendiente (captura de cambios) sólo se curan y aplican sus filas
+    if not usar_streaming(archivo) and captura_cambios.aplicar_delta_curado(
+            archivo, CARPETA_CURADO, nombre, lambda df: limpiar(df, nombre).drop_duplicates()):
+        return None
+
+    resultado = None
+    if usar_streaming(archivo):
+        resultado = curar_en_bloques(archivo, CARPETA_CURADO, nombre, lambda df: limpiar(df, nombre),
+                                     read_kwargs=read_kwargs)
+    else:
+        df = curar_dataframe(archivo)
+        # Guardar fichero curado en el formato intermedio configurado (CSV por defecto)
+        escribir_tabla(df, CARPETA_CURADO, nombre)
+        anotar(filas_escritas=len(df))
+    captura_cambios.registrar_version(CARPETA_CURADO, nombre, ruta_tabla(CARPETA_CURADO, nombre),
+                                      captura_cambios.version_raw(archivo))
+    return resultado
+
+
+# Curado de todos los ficheros raw (o sólo de `archivos`), repartidos entre `workers` procesos
+def main(workers=None, archivos=None):
+    os.makedirs(folder_path, exist_ok=True)
+    archivos_raw = listar_raw(CARPETA_RAW) if archivos is None else list(archivos)
+
+    resultados, errores = ejecutar_por_archivo(curar_archivo, archivos_raw, workers,
+                                               desc="Limpiando y guardando archivos raw", etapa="curado_eea")
+    informar_errores(errores, "el curado de EEA")
+    return resultados, errores
+
+
+if __name__ == "__main__":
+    main()
@@ -8,64 +8,144 @@ los archivos .csv provenientes de la EUROSTAT, previamente descargados y almacen
 
 Acciones que realiza el script:
 Acciones principales del script:
-1. Lee todos los archivos CSV ubicados en la carpeta de entrada `ficheros_raw/eurostat`.
+1. Lee todos los archivos CSV ubicados en la carpeta de entrada `ficheros_raw/eurostat`, comprimidos o no
+   (`.csv.gz`, `.csv.zst`), directamente del fichero comprimido.
 2. Elimina filas completamente vacías (`dropna(how='all')`).
 3. Elimina filas con valores nulos en columnas clave.
 4. Filtra los registros para quedarse solo con aquellos cuya frecuencia sea anual (`freq == 'A'`).
 4. Realiza la conversión de tipos:
    - `obs_value` se convierte a `float64`.
-   - `TIME_PERIOD` se convierte a `int64`.
-   - La conversión utiliza coerción para evitar errores y convertir valores inválidos en NaN.
+   - `TIME_PERIOD` se convierte a entero con vacíos (`Int64`).
+   - La conversión utiliza coerción para evitar errores; las filas que se quedan sin `TIME_PERIOD` se eliminan.
+   - Los ficheros se leen con los tipos del registro de esquemas (`esquemas_datasets.py`); las filas que no se
+     pueden leer se apartan a `ficheros_cuarentena` en lugar de abortar el fichero.
 5. Eliminamos duplicados.
-6. Guarda los archivos curados en la carpeta `ficheros_curado/eurostat` con el mismo nombre original.
+6. Guarda los archivos curados en la carpeta `ficheros_curado/eurostat` con el mismo nombre original,
+   en el formato intermedio configurado (`ETL_FORMATO_INTERMEDIO`: csv, parquet o arrow).
+
+Los ficheros grandes se curan por bloques con memoria acotada (ver `motor_curado.py`, `ETL_MODO_CURADO`
+y `ETL_MEMORIA_MB`): se aplican las mismas reglas y los duplicados se eliminan entre bloques.
+
+Al ejecutar el script sin lista de ficheros ni `forzar`, se omiten los ficheros cuyo curado ya se generó con el
+código actual del curado a partir del contenido actual del raw (versión registrada junto al fichero curado, ver
+`captura_cambios.py`). Si se le pasan los ficheros (orquestador, `etl.py curate`) los cura siempre: la caché es cosa
+de quien los elige.
+Con la captura de cambios activa (`ETL_CDC=1`, ver `captura_cambios.py`), si hay un delta respecto a la publicación
+con la que se generó el fichero curado sólo se curan las filas del delta y se aplican sobre él.
 
 '''
 
 import pandas as pd
-import glob
 import os
-from tqdm import tqdm
+
+import captura_cambios
+from almacenamiento import escribir_tabla, leer_tabla, listar_raw, mascara_filtros, nombre_tabla, ruta_tabla
+from motor_curado import curar_en_bloques, usar_streaming
+from ejecucion_paralela import ejecutar_por_archivo, informar_errores
+from metricas import anotar
 
 # Paths
 CARPETA_RAW = os.path.join("ficheros_raw", "eurostat")
 CARPETA_CURADO = os.path.join("ficheros_curado", "eurostat")
 
+# Módulos cuyo código determina el fichero curado (su huella se registra junto a la versión del raw)
+MODULOS_CURADO = ["proceso_curado_eurostat", "motor_curado", "esquemas_datasets"]
+
 # Crear carpeta de salida si no existe
 
 root_folder = "ficheros_curado"
 secundary_folder = "eurostat"
 folder_path = os.path.join(root_folder, secundary_folder)
-os.makedirs(folder_path, exist_ok=True)
 #os.makedirs(CARPETA_CURADO, exist_ok=True)
 
-archivos_raw = glob.glob(os.path.join(CARPETA_RAW, "*.csv"))
-
-for archivo in tqdm(archivos_raw, desc="Limpiando y guardando archivos raw"):
-    try:
-        df = pd.read_csv(archivo, low_memory=False)
-        
-        # 1) Eliminar filas completamente vacías
-        df = df.dropna(how='all')
-
-        # 2) Eliminar filas con valores nulos en columnas clave
-        if 'TIME_PERIOD' in df.columns:
-            df = df[df['TIME_PERIOD'].notna()]
-
-        # 3) Quedarnos sólo con filas con frecuencia Anual
-        df = df[df['freq'] == 'A']
-        
-        # 4) Convertir 'obs_value' a float64 y TIME_PERIOD a int64. Coercion convierte errores a NaN
-        if 'obs_value' in df.columns:
-            df['obs_value'] = pd.to_numeric(df['obs_value'], errors='coerce').astype('float64')
-        if 'TIME_PERIOD' in df.columns:
-            df['TIME_PERIOD'] = pd.to_numeric(df['TIME_PERIOD'], errors='coerce').astype('int64')
-        
-        # 5) Eliminar registros duplicados
-        df = df.drop_duplicates()
-
-        # Guardar CSV curado
-        nombre = os.path.basename(archivo)
-        ruta_curado = os.path.join(CARPETA_CURADO, nombre)
-        df.to_csv(ruta_curado, index=False)
-    except Exception as e:
-        print(f"Error limpiando {archivo}: {e}")
+# Filtro de filas aplicado durante la lectura: las filas no anuales no llegan a cargarse. Los datasets sin columna
+# `freq` se leen completos
+FILTROS_LECTURA = [('freq', '==', 'A')]
+
+
+# Reglas de limpieza de un DataFrame (o de un bloque del fichero en modo streaming), sin la eliminación de duplicados
+def limpiar(df):
+    # 1) Eliminar filas completamente vacías
+    df = df.dropna(how='all')
+
+    # 2) Eliminar filas con valores nulos en columnas clave
+    if 'TIME_PERIOD' in df.columns:
+        df = df[df['TIME_PERIOD'].notna()]
+
+    # 3) Quedarnos sólo con filas con frecuencia Anual
+    df = df[df['freq'] == 'A'].copy()
+
+    # 4) Convertir 'obs_value' a float64 y TIME_PERIOD a entero. Coercion convierte errores a NaN, así que
+    # TIME_PERIOD se convierte a Int64 (admite vacíos) y se eliminan las filas que se quedan sin periodo
+    if 'obs_value' in df.columns:
+        df['obs_value'] = pd.to_numeric(df['obs_value'], errors='coerce').astype('float64')
+    if 'TIME_PERIOD' in df.columns:
+        df['TIME_PERIOD'] = pd.to_numeric(df['TIME_PERIOD'], errors='coerce').astype('Int64')
+        df = df[df['TIME_PERIOD'].notna()]
+    return df
+
+
+# Curado en memoria de un fichero completo: devuelve el DataFrame curado sin guardarlo
+def curar_dataframe(archivo):
+    lectura = {}
+    df = leer_tabla(archivo, filtros=FILTROS_LECTURA, estadisticas=lectura, cuarentena=True, ignorar_ausentes=True)
+    filas_anuales = len(df)
+    df = limpiar(df)
+    filas_limpias = len(df)
+    # 5) Eliminar registros duplicados
+    df = df.drop_duplicates()
+    anotar(modo="memoria", filas_leidas=lectura["filas_leidas"], filas_cuarentena=lectura.get("filas_cuarentena", 0),
+           descartadas_lectura=lectura["filas_leidas"] - filas_anuales, descartadas_limpieza=filas_anuales - filas_limpias, duplicados=filas_limpias - len(df))
+    return df
+
+
+# Curado de las filas de un delta (captura de cambios), ya con los tipos del esquema
+def curar_filas(df):
+    df = limpiar(df[mascara_filtros(df, FILTROS_LECTURA, ignorar_ausentes=True)])
+    return df.drop_duplicates()
+
+
+# Curado de un fichero completo, en memoria o por bloques según su tamaño y el presupuesto de memoria.
+# Con un delta pendiente (captura de cambios) sólo se curan y aplican sus filas
+def curar_archivo(archivo):
+    nombre = nombre_tabla(archivo)
+    if not usar_streaming(archivo) and captura_cambios.aplicar_delta_curado(archivo, CARPETA_CURADO, nombre,
+                                                                            curar_filas):
+        return None
+
+    resultado = None
+    if usar_streaming(archivo):
+        resultado = curar_en_bloques(archivo, CARPETA_CURADO, nombre, limpiar)
+    else:
+        df = curar_dataframe(archivo)
+        # Guardar fichero curado en el formato intermedio configurado (CSV por defecto)
+        escribir_tabla(df, CARPETA_CURADO, nombre)
+        anotar(filas_escritas=len(df))
+    captura_cambios.registrar_version(CARPETA_CURADO, nombre, ruta_tabla(CARPETA_CURADO, nombre),
+                                      captura_cambios.version_raw(archivo),
+                                      codigo=captura_cambios.version_codigo(MODULOS_CURADO))
+    return resultado
+
+
+# Curado de todos los ficheros raw (o sólo de `archivos`), repartidos entre `workers` procesos. Los ficheros pedidos
+# expresamente o con `forzar` se curan siempre
+def main(workers=None, archivos=None, forzar=False):
+    os.makedirs(folder_path, exist_ok=True)
+    pendientes = listar_raw(CARPETA_RAW) if archivos is None else list(archivos)
+
+    # Ficheros ya curados con este código a partir del contenido actual de su raw: no hay nada que hacer
+    if archivos is None and not forzar:
+        codigo = captura_cambios.version_codigo(MODULOS_CURADO)
+        pendientes = [archivo for archivo in pendientes
+                      if not captura_cambios.salida_al_dia(CARPETA_CURADO, nombre_tabla(archivo),
+                                                           ruta_tabla(CARPETA_CURADO, nombre_tabla(archivo)),
+                                                           archivo, codigo)]
+
+    resultados, errores = ejecutar_por_archivo(curar_archivo, pendientes, workers,
+                                               desc="Limpiando y guardando archivos raw", etapa="curado_eurostat")
+    informar_errores(errores, "el curado de Eurostat")
+    return resultados, errores
+
+
+if __name__ == "__main__":
+    main()
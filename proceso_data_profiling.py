@@ -6,13 +6,28 @@ generando informes detallados de profiling con la librería ydata_profiling, jun
 estadísticos y gráficos para cada variable.
 
 Funcionalidades principales:
-- Lectura automática de todos los archivos CSV en las carpetas configuradas.
+- Lectura automática de todos los archivos CSV en las carpetas configuradas, comprimidos o no (`.csv.gz`,
+  `.csv.zst`), directamente del fichero comprimido.
 - Generación de informes HTML de profiling (tipos de variables, valores nulos, distribución, etc).
 - Creación de resúmenes en Excel con estadísticas clave por columna:
   tipos, valores únicos, valores nulos, completitud, moda y frecuencia, métricas estadísticas para numéricas (media, mediana, desviación, máximo, mínimo).
 - Producción de gráficos individuales para cada variable:
-  histogramas para variables numéricas y gráficos de barras para variables categóricas.
+  histogramas para variables numéricas y gráficos de barras para variables categóricas
+  (`graficos_perfilado.py`: en paralelo, sólo los que han cambiado y opcionalmente en un panel único).
 - Organización automática de los informes, resúmenes y gráficos en carpetas específicas para facilitar su análisis.
+- Las métricas del resumen por columnas se calculan en un solo recorrido de los datos (`motor_perfilado.py`).
+- Modo rápido (`ETL_PERFILADO_RAPIDO=1`): omite el informe HTML de ydata_profiling, que es con diferencia la parte
+  más lenta; el resumen en Excel y los gráficos se generan igual.
+- Ficheros que no caben en memoria: se perfilan por bloques con memoria acotada (`ETL_MEMORIA_MB`) mediante
+  resúmenes probabilísticos (`bocetos.py`). El Excel incluye una hoja con las cotas de error de las métricas
+  aproximadas; el informe HTML y los gráficos, que necesitan el fichero completo, se omiten.
+  `ETL_MODO_PERFILADO` (auto, memoria o streaming) funciona como `ETL_MODO_CURADO`.
+- Caché de resultados (`data_resumen/.cache_perfilado.json`): para cada fichero se guarda su huella (`huellas.py`),
+  las opciones del perfilado (modo rápido, en memoria o por bloques, panel de gráficos y versión del código) y los
+  ficheros generados. Si nada ha cambiado y los ficheros siguen ahí, no se vuelve a perfilar.
+- Perfilado incremental: el estado del perfilado por bloques se guarda en `data_resumen/.estados_perfilado`. Si el
+  fichero sólo ha ganado años nuevos, se perfilan únicamente esas filas y se fusionan con el estado guardado.
+- El tiempo, las filas y el pico de memoria de cada fichero se registran en el fichero de métricas (`metricas.py`).
 - Ideal para la fase inicial de análisis y validación de datos en procesos ETL y proyectos de análisis de datos.
 
 Este script forma parte del pipeline ETL para el TFM del máster y facilita la identificación
@@ -21,176 +36,187 @@ de problemas de calidad, patrones y características relevantes en los datos ant
 """
 
 import pandas as pd
-from ydata_profiling import ProfileReport
-import matplotlib.pyplot as plt
 import os
+import pickle
+
+from almacenamiento import leer_tabla, listar_raw, nombre_tabla
+from graficos_perfilado import PANEL, generar_graficos
+from huellas import cargar_estado, guardar_estado, huella_fichero, huella_modulo
+from metricas import anotar, anotar_salida, medir
+from motor_curado import usar_streaming
+from motor_perfilado import perfilar_columnas, perfilar_en_bloques, resumen_general
 
 #Carpetas de entrada de csv 
 carpetas_fuente = ["ficheros_raw/eurostat", "ficheros_raw/eea"]
 
-for input_folder in carpetas_fuente:
-    csv_files = [f for f in os.listdir(input_folder) if f.endswith(".csv")]
-    print(f"Procesando carpeta: {input_folder} - Archivos encontrados: {csv_files}")
-
-    for file in csv_files:
-        input_file = os.path.join(input_folder, file)
-        base_name = os.path.splitext(os.path.basename(input_file))[0]
-
-        # ⬇️ Aquí empieza tu código actual para procesar cada archivo...
-
-    #Proceso de ejecución
-    for file in csv_files:
-
-        input_file = os.path.join(input_folder,file)
-        base_name=os.path.splitext(os.path.basename(input_file))[0]
-
-        print(base_name)
-
-        df = pd.read_csv(input_file)
-
-
-
-        profile = ProfileReport(
-            df,
-            title="Informe de Data Profiling",
-            explorative=False,
-            minimal=True
-        
-        )
-
-        # Carpeta de salida (creará una si no existe)
-        output_folder = "data_profilling"
-        os.makedirs(output_folder, exist_ok=True)
-        out_file=f"informe_data_profiling_{base_name}.html"
-        out_path=os.path.join(output_folder, out_file)
-
-        profile.to_file(out_path)
-
-        print("✅ Informe HTML generado.")
-
-        # Crear resumen en CSV
-        resumen = pd.DataFrame({
-            "Tipo de dato": df.dtypes.astype(str),
-            "Valores únicos": df.nunique(),
-            "Nulos": df.isnull().sum(),
-            "Completitud (%)": (1 - df.isnull().sum() / len(df)) * 100,
-            "Número de registros": len(df),
-            "Número de variables": len(df.columns)
-        })
-
-
-    ## Guardar como CSV
-
-    # Total de registros (filas)
-        total_registros = len(df)
-
-    # Crear resumen por columna
-        resumen_columnas = []
-
-        for col in df.columns:
-            tipo_dato = str(df[col].dtype)
-            nulos = df[col].isnull().sum()
-            completitud = round(100 * (1 - nulos / len(df[col])), 2)
-            valores_unicos = df[col].nunique()
-            registros = len(df[col])
-
-        # Obtener valor más frecuente y su frecuencia
-            if not df[col].dropna().empty:
-                valor_mas_frec = df[col].mode().iloc[0]
-                frec_mas_frec = df[col].value_counts().iloc[0]
-            else:
-                valor_mas_frec = None
-                frec_mas_frec = 0
-
-    # Inicializar las métricas estadísticas
-            valor_maximo = None
-            valor_minimo = None
-            media = None
-            mediana = None
-            desviacion = None
-            ceros = None
-
-        # Si la columna es numérica, calcular las métricas estadísticas
-            if pd.api.types.is_numeric_dtype(df[col]):
-                valor_maximo = df[col].max()
-                valor_minimo = df[col].min()
-                media = df[col].mean()
-                mediana = df[col].median()
-                desviacion = df[col].std()
-                ceros = (df[col] == 0).sum()
-
-        # Añadir los resultados al resumen
-            resumen_columnas.append({
-                "Columna": col,
-                "Tipo de dato": tipo_dato,
-                "Valores únicos": valores_unicos,
-                "Nulos": nulos,
-                "Ceros": ceros,
-                "Completitud (%)": completitud,
-                "Valor más frecuente": valor_mas_frec,
-                "Frecuencia del más frecuente (%)": frec_mas_frec/registros,
-                "Valor máximo": valor_maximo,
-                "Valor mínimo": valor_minimo,
-                "Media": media,
-                "Mediana": mediana,
-                "Desviacion": desviacion
-            })
-
-    # Convertir a DataFrame y guardar como xls
-        resumen_df = pd.DataFrame(resumen_columnas)
-    #resumen_df.to_csv("analisis_por_columna.csv", index=False)
-
-    # Carpeta de salida (creará una si no existe)
-        output_folder2 = "data_resumen"
-        os.makedirs(output_folder2, exist_ok=True)
-        out_xls=f"resumen_data_profiling_{base_name}.xlsx"
-
+# Omitir el informe HTML de ydata_profiling
+PERFILADO_RAPIDO = os.environ.get("ETL_PERFILADO_RAPIDO", "0") == "1"
 
-        with pd.ExcelWriter(os.path.join(output_folder2, out_xls), engine="openpyxl") as writer:
-                resumen.to_excel(writer, sheet_name="Resumen general",index=False)
-                resumen_df.to_excel(writer, sheet_name="Análisis por columnas", index=False)
+# Perfilado en memoria o por bloques (auto: por bloques sólo si el fichero no cabe en el presupuesto de memoria)
+MODO_PERFILADO = os.environ.get("ETL_MODO_PERFILADO", "auto").lower()
 
+# Caché de resultados y estados del perfilado por bloques
+RUTA_CACHE = os.path.join("data_resumen", ".cache_perfilado.json")
+CARPETA_ESTADOS = os.path.join("data_resumen", ".estados_perfilado")
 
+# Módulos cuyo código cambia el resultado del perfilado
+MODULOS_PERFILADO = ["proceso_data_profiling", "motor_perfilado", "bocetos", "graficos_perfilado"]
 
-    ## Carpeta de salida (creará una si no existe)
-    #output_folder = "eurostat_data_profilling"
-    #os.makedirs(output_folder, exist_ok=True)
 
-    ## Guardar como CSV
+# Informe HTML de ydata_profiling (se importa aquí porque la librería tarda en cargar)
+def generar_informe_html(df, base_name):
+    from ydata_profiling import ProfileReport
 
-    #resumen.to_csv("resumen_data_profiling.csv", index_label="Columna")
+    profile = ProfileReport(
+        df,
+        title="Informe de Data Profiling",
+        explorative=False,
+        minimal=True
+    
+    )
 
-        print("✅ Resumen CSV generados correctamente.")
-
-
-    # Crear carpeta para los gráficos
+    # Carpeta de salida (creará una si no existe)
+    output_folder = "data_profilling"
+    os.makedirs(output_folder, exist_ok=True)
+    out_file=f"informe_data_profiling_{base_name}.html"
+    out_path=os.path.join(output_folder, out_file)
 
-        os.makedirs(f"graficos_{base_name}", exist_ok=True)
+    profile.to_file(out_path)
 
-        for col in df.columns:
-            plt.figure(figsize=(8, 5))
+    print("✅ Informe HTML generado.")
 
-            if pd.api.types.is_numeric_dtype(df[col]):
-            # Histograma para variables numéricas
-                df[col].dropna().hist(bins=29, color='skyblue', edgecolor='black')
-                plt.title(f"Histograma: {col}")
-                plt.xlabel(col)
-                plt.ylabel("Frecuencia")
-                plt.tight_layout()
-                plt.savefig(f"graficos_{base_name}/histograma_{col}.png")
 
-        
-            elif pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_categorical_dtype(df[col]):
-            # Diagrama de barras para categóricas
-                conteos = df[col].value_counts().head(5)  # Top 5 categorías
-                conteos.plot(kind="bar", color='salmon', edgecolor='black')
-                plt.title(f"Frecuencia: {col} (Top 5)")
-                plt.xlabel(col)
-                plt.ylabel("Frecuencia")
-                plt.xticks(rotation=30, ha='right')
-                plt.tight_layout()
-                plt.savefig(f"graficos_{base_name}/frecuencia_{col}.png")
+# Resumen general y por columnas en Excel (más las cotas de error si el resumen es aproximado)
+def guardar_resumen(resumen_df, registros, base_name, cotas=None):
 
-            plt.close()
+    # El resumen general se obtiene del resumen por columnas
+    resumen = resumen_general(resumen_df, registros)
 
-        print("✅ Gráficos generados correctamente.")
\ No newline at end of file
+    # Carpeta de salida (creará una si no existe)
+    output_folder2 = "data_resumen"
+    os.makedirs(output_folder2, exist_ok=True)
+    out_xls=f"resumen_data_profiling_{base_name}.xlsx"
+
+
+    with pd.ExcelWriter(os.path.join(output_folder2, out_xls), engine="openpyxl") as writer:
+            resumen.to_excel(writer, sheet_name="Resumen general",index=False)
+            resumen_df.to_excel(writer, sheet_name="Análisis por columnas", index=False)
+            if cotas is not None:
+                cotas.to_excel(writer, sheet_name="Cotas de error", index=False)
+
+    print("✅ Resumen CSV generados correctamente.")
+
+
+def generar_resumen(df, base_name):
+    # Crear resumen por columna (todas las métricas en un solo recorrido)
+    resumen_df = perfilar_columnas(df)
+    guardar_resumen(resumen_df, len(df), base_name)
+    return resumen_df
+
+
+# Opciones que cambian el resultado del perfilado de un fichero (forman parte de la clave de la caché)
+def opciones_perfilado(rapido, streaming):
+    return {
+        "rapido": rapido,
+        "streaming": streaming,
+        "panel": "" if streaming else PANEL,
+        "codigo": {m: huella_modulo(m) for m in MODULOS_PERFILADO},
+    }
+
+
+def _ruta_estado(base_name):
+    return os.path.join(CARPETA_ESTADOS, f"{base_name}.pkl")
+
+
+# Estado guardado del perfilado por bloques de un fichero (None si no hay o no se puede leer)
+def cargar_estado_perfilado(base_name):
+    try:
+        with open(_ruta_estado(base_name), "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+
+
+def guardar_estado_perfilado(estado, base_name):
+    os.makedirs(CARPETA_ESTADOS, exist_ok=True)
+    ruta_tmp = f"{_ruta_estado(base_name)}.tmp"
+    with open(ruta_tmp, "wb") as f:
+        pickle.dump(estado, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(ruta_tmp, _ruta_estado(base_name))
+
+
+def _ruta_resumen(base_name):
+    return os.path.join("data_resumen", f"resumen_data_profiling_{base_name}.xlsx")
+
+
+# Profiling completo de un fichero CSV. Con `cache` (diccionario de `RUTA_CACHE`) se omiten los ficheros que no
+# han cambiado y se actualiza su entrada
+def perfilar_archivo(input_file, rapido=None, cache=None):
+    rapido = PERFILADO_RAPIDO if rapido is None else rapido
+    base_name=nombre_tabla(input_file)
+
+    print(base_name)
+
+    streaming = usar_streaming(input_file, modo=MODO_PERFILADO)
+    opciones = opciones_perfilado(rapido, streaming)
+    anterior = (cache or {}).get(input_file, {})
+    huella = huella_fichero(input_file, anterior.get("huella"))
+    if (anterior.get("huella", {}).get("sha256") == huella["sha256"] and anterior.get("opciones") == opciones
+            and all(os.path.exists(ruta) for ruta in anterior.get("artefactos", []))):
+        print("⏭️  Sin cambios desde el último perfilado.")
+        anotar(desde_cache=True)
+        return pd.read_excel(_ruta_resumen(base_name), sheet_name="Análisis por columnas")
+
+    # Fichero demasiado grande: sólo el resumen, por bloques y con cotas de error
+    if streaming:
+        # El estado anterior sólo sirve si se calculó con las mismas opciones
+        estado_anterior = cargar_estado_perfilado(base_name) if anterior.get("opciones") == opciones else None
+        estado = perfilar_en_bloques(input_file, anterior=estado_anterior)
+        resumen_df, cotas = estado.resumen()
+        guardar_resumen(resumen_df, estado.registros, base_name, cotas)
+        guardar_estado_perfilado(estado, base_name)
+        anotar(modo="streaming", filas_leidas=estado.registros, filas_procesadas=estado.filas_procesadas,
+               incremental=estado.incremental)
+        if estado.incremental:
+            print(f"🔁 Perfilado incremental: {estado.filas_procesadas} filas nuevas de {estado.registros}.")
+        print("⚠️  Perfilado por bloques: se omiten el informe HTML y los gráficos.")
+        artefactos = [_ruta_resumen(base_name)]
+    else:
+        # Sin el registro de esquemas: los tipos se infieren igual que en el perfilado por bloques
+        df = leer_tabla(input_file, usar_esquema=False)
+        anotar(modo="memoria", filas_leidas=len(df))
+
+        artefactos = [_ruta_resumen(base_name)]
+        if not rapido:
+            generar_informe_html(df, base_name)
+            artefactos.append(os.path.join("data_profilling", f"informe_data_profiling_{base_name}.html"))
+
+        resumen_df = generar_resumen(df, base_name)
+        artefactos += generar_graficos(df, base_name)
+
+    for ruta in artefactos:
+        anotar_salida(ruta)
+    if cache is not None:
+        cache[input_file] = {"huella": huella, "opciones": opciones, "artefactos": artefactos}
+    return resumen_df
+
+
+#Proceso de ejecución: perfilado de los ficheros raw de las carpetas (o sólo de `archivos`)
+def main(carpetas=None, rapido=None, archivos=None):
+    cache = cargar_estado(RUTA_CACHE)
+    if archivos is None:
+        grupos = [(carpeta, listar_raw(carpeta)) for carpeta in carpetas or carpetas_fuente]
+    else:
+        grupos = [("selección", list(archivos))]
+    for input_folder, csv_files in grupos:
+        print(f"Procesando carpeta: {input_folder} - Archivos encontrados: {[os.path.basename(f) for f in csv_files]}")
+
+        for file in csv_files:
+            with medir("perfilado", file):
+                perfilar_archivo(file, rapido, cache)
+            # Se guarda tras cada fichero para no perder lo hecho si se interrumpe
+            guardar_estado(cache, RUTA_CACHE)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,111 +6,542 @@ y tiene como objetivo automatizar la obtención de datos actualizados y estructu
 
 Características principales:
 - Descarga múltiples datasets desde URLs definidas, incluyendo compresión gzip.
-- Detecta y guarda los archivos comprimidos (.gz) y los descomprime automáticamente a formato CSV.
+- Descarga los datasets en paralelo (hilos) compartiendo un pool de conexiones HTTP.
+- Guarda los datasets comprimidos (`ETL_COMPRESION_RAW`, ver `almacenamiento.py`): con `gzip` (por defecto) se
+  conserva tal cual el fichero que sirve Eurostat, con `zstd` se recomprime en streaming en tramas independientes y
+  con `ninguna` se descomprime al CSV como antes. Las etapas siguientes leen directamente el fichero comprimido.
+  El gzip se descomprime igualmente en streaming (sin cargarlo entero en memoria) para calcular la huella del CSV.
 - Organiza los archivos descargados en una estructura de carpetas.
 - Implementa manejo básico de errores y validación del tipo de contenido descargado.
 - Facilita la reproducibilidad y actualización del conjunto de datos usado en el proyecto.
 
 Uso:
 - Ejecutar el script para descargar y preparar todos los datasets definidos en la lista `dataset_urls`.
-- Modificar la lista para añadir o quitar fuentes de datos según necesidades.
+- La lista se genera desde `CATALOGO` en `catalogo_datasets.py`: modificar el catálogo para añadir o quitar fuentes
+  de datos o para declarar filtros SDMX (freq, geo, airpol...) y periodos que se aplican en el servidor.
+- La variable de entorno `ETL_MAX_DESCARGAS` limita el número de descargas simultáneas (por defecto 4).
+- Cada descarga queda registrada en `ficheros_raw/eurostat_manifiesto.json` (ETag, Last-Modified, sha256 y tamaño).
+  Las ejecuciones siguientes hacen peticiones condicionales y marcan como `sin_cambios` los datasets que no han
+  cambiado, para que las etapas posteriores puedan saltárselos. `ETL_FORZAR_DESCARGA=1` ignora el manifiesto y
+  `ETL_UPDATED_AFTER=1` consulta antes a la API SDMX con `updatedAfter`.
+- Las descargas son reanudables: los bytes recibidos se guardan en `<dataset>.csv.gz.part` con el sha256 de cada
+  bloque, y tras un corte se continúa con peticiones HTTP Range (hasta `ETL_MAX_REINTENTOS` reintentos con espera
+  exponencial y jitter). Si el proceso se interrumpe, la siguiente ejecución verifica los bloques y sigue donde lo dejó.
+- Cada descarga se registra en el fichero de métricas (`metricas.py`): tiempo, resultado y bytes escritos.
+- Con `ETL_CDC=1`, tras descargar se capturan los cambios de los datasets nuevos o actualizados respecto a su
+  publicación anterior (`captura_cambios.py`), para que el curado y la normalización sólo apliquen el delta.
 
 """
 
 import requests
 import os
-import gzip
-import shutil
-from urllib.parse import urlparse
-
-# Lista de URLs para descargar múltiples datasets. Ver excel "dataset"
-dataset_urls = [
-    "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/env_ac_ainah_r2/1.0?compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name",
-    "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/sdg_13_10/1.0?compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name",
-    "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/env_ac_aeint_r2/1.0?compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name",
-    "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/nrg_ind_fecf/1.0?compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name",
-    "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/sdg_07_10/1.0?compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name",
-    "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/nrg_ind_ren/1.0?compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name",
-    "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/sdg_13_40/1.0?compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name",
-    "https://ec.europa.eu/eurostat/api/comext/dissemination/sdmx/3.0/data/dataflow/ESTAT/ds-059331$defaultview/1.0?compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name",
-    "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/nama_10_gdp/1.0?compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name",
-    "https://www.eea.europa.eu/en/datahub/datahubitem-view/6f1efaf1-ae32-48cb-b962-0891f84b1f5f",
-    "https://ec.europa.eu/eurostat/api/dissemination/sdmx/3.0/data/dataflow/ESTAT/nrg_ind_eff/1.0?compress=true&format=csvdata&formatVersion=2.0&lang=en&labels=name"
-    
-]
+import json
+import random
+import time
+import zlib
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from urllib.parse import urlparse, quote
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
+
+from almacenamiento import COMPRESION_RAW, EscritorRaw, buscar_raw, ruta_raw
+from catalogo_datasets import urls_descarga
+from metricas import anotar, medir
+from manifiesto_descargas import (RUTA_MANIFIESTO, ESTADO_NUEVO, ESTADO_ACTUALIZADO, ESTADO_SIN_CAMBIOS,
+                                  ESTADO_ERROR, cargar_manifiesto, guardar_manifiesto)
+
+# Lista de URLs para descargar múltiples datasets, con los filtros de clave y periodo del catálogo.
+# Para añadir o quitar fuentes de datos se modifica `CATALOGO` en `catalogo_datasets.py`
+dataset_urls = list(urls_descarga().values())
 
 
 # Carpeta de salida
 root_folder = "ficheros_raw"
 secundary_folder = "eurostat"
 folder_path = os.path.join(root_folder, secundary_folder)
-os.makedirs(folder_path, exist_ok=True)
 
-# Función para descargar y descomprimir el archivo GZ de un dataset
-def download_and_extract(dataset_url, output_folder):
-    # Usamos una sesión de requests para manejar cookies y redirecciones
+# Número máximo de descargas simultáneas (también es el tamaño del pool de conexiones)
+MAX_DESCARGAS_CONCURRENTES = int(os.environ.get("ETL_MAX_DESCARGAS", 4))
+
+# Ignorar el manifiesto y descargar todo de nuevo (ETL_FORZAR_DESCARGA=1)
+FORZAR_DESCARGA = os.environ.get("ETL_FORZAR_DESCARGA", "0") == "1"
+
+# Consultar antes a la API SDMX con `updatedAfter` si hay observaciones nuevas (ETL_UPDATED_AFTER=1)
+USAR_UPDATED_AFTER = os.environ.get("ETL_UPDATED_AFTER", "0") == "1"
+
+# Tamaño de los bloques con checksum del fichero parcial, tamaño de lectura de la respuesta HTTP
+# y tiempo máximo de espera (conexión, lectura)
+TAMANO_CHUNK = 8 * 1024 * 1024
+TAMANO_LECTURA = 256 * 1024
+TIMEOUT = (30, 300)
+
+# Reintentos ante cortes de conexión: espera exponencial con jitter entre 0 y ESPERA_BASE * 2^intento segundos
+MAX_REINTENTOS = int(os.environ.get("ETL_MAX_REINTENTOS", 5))
+ESPERA_BASE = 2
+ESPERA_MAXIMA = 120
+
+# Agregar un encabezado User-Agent para simular una solicitud desde un navegador
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    # Sin compresión de transporte: los offsets de las peticiones Range se refieren a los bytes del fichero
+    "Accept-Encoding": "identity",
+}
+
+
+# Función para crear una sesión compartida por todas las descargas
+def crear_sesion(max_conexiones=MAX_DESCARGAS_CONCURRENTES):
+    # Una única sesión reutiliza las conexiones TCP/TLS abiertas contra el mismo host
     session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_conexiones, pool_maxsize=max_conexiones)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+# Función para obtener el nombre del dataset a partir de su URL
+def obtener_nombre_dataset(dataset_url):
+    parsed_url = urlparse(dataset_url)
+    return parsed_url.path.split('/')[-2]  # Extraemos el nombre del dataset de la URL
+
+
+# Error de descarga que merece reintento (corte de conexión, respuesta truncada, 5xx...)
+class DescargaInterrumpida(Exception):
+    pass
+
+
+# Descarga de un dataset por bloques a un fichero parcial que se puede reanudar con peticiones Range.
+# Los bytes comprimidos se guardan en `<csv>.gz.part` junto a un índice `<csv>.gz.part.json` con el sha256
+# de cada bloque completo; al mismo tiempo se descomprimen en streaming para calcular la huella del CSV y, salvo
+# que se conserve el gzip recibido, se escriben con la compresión de la capa raw en `<csv>.part`.
+class DescargaReanudable:
+
+    def __init__(self, session, dataset_url, csv_file_path, compresion=None):
+        self.session = session
+        self.dataset_url = dataset_url
+        self.dataset_name = obtener_nombre_dataset(dataset_url)
+        self.compresion = compresion or COMPRESION_RAW
+        self.gz_part_path = f"{csv_file_path}.gz.part"
+        self.meta_path = f"{self.gz_part_path}.json"
+        self.csv_tmp_path = f"{csv_file_path}.part"
+        self.meta = {}
+        self.offset = 0
+        self.f_gz = None
+        self.f_csv = None
+        self.bytes_csv = 0
+
+    # --- Índice de bloques del fichero parcial ---
+
+    def _guardar_meta(self):
+        ruta_tmp = f"{self.meta_path}.tmp"
+        with open(ruta_tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(ruta_tmp, self.meta_path)
+
+    def _abrir_salidas(self, modo_gz):
+        self._cerrar_salidas()
+        self.f_gz = open(self.gz_part_path, modo_gz)
+        self.bytes_csv = 0
+        self.huella_csv = hashlib.sha256()
+        self.huella_bloque = hashlib.sha256()
+        self.bytes_bloque = 0
+        self.descompresor = None
+
+    def _cerrar_salidas(self):
+        for f in (self.f_gz, self.f_csv):
+            if f is not None:
+                f.close()
+        self.f_gz = self.f_csv = None
+
+    # Empezar la descarga desde cero
+    def _reiniciar(self):
+        self.meta = {"url": self.dataset_url, "tamano_chunk": TAMANO_CHUNK, "chunks": [],
+                     "etag": None, "last_modified": None, "total": None, "gzip": None}
+        self.offset = 0
+        self._abrir_salidas("wb")
+        self._guardar_meta()
+
+    # Recuperar una descarga anterior interrumpida verificando el checksum de cada bloque guardado
+    def _recuperar_parcial(self):
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+        if (not meta or not os.path.exists(self.gz_part_path) or meta.get("url") != self.dataset_url
+                or meta.get("tamano_chunk") != TAMANO_CHUNK):
+            self._reiniciar()
+            return
+
+        # Se conservan los bloques cuyo sha256 coincide con el índice; el resto se descarta
+        chunks_validos = []
+        with open(self.gz_part_path, "rb") as f:
+            for huella_esperada in meta["chunks"]:
+                bloque = f.read(TAMANO_CHUNK)
+                if len(bloque) != TAMANO_CHUNK or hashlib.sha256(bloque).hexdigest() != huella_esperada:
+                    break
+                chunks_validos.append(huella_esperada)
+        if not chunks_validos:
+            self._reiniciar()
+            return
+
+        self.meta = dict(meta, chunks=[])
+        self.offset = 0
+        self._abrir_salidas("r+b")
+        self.f_gz.truncate(len(chunks_validos) * TAMANO_CHUNK)
+
+        # Volver a descomprimir localmente los bloques verificados para reconstruir el CSV parcial
+        with open(self.gz_part_path, "rb") as f:
+            for _ in chunks_validos:
+                self._procesar(f.read(TAMANO_CHUNK), escribir_gz=False)
+        self.f_gz.seek(self.offset)
+        self._guardar_meta()
+        print(f"♻️ Reanudando {self.dataset_name} desde el byte {self.offset} ({len(chunks_validos)} bloques verificados)")
+
+    # --- Procesado de los bytes recibidos ---
+
+    def _procesar(self, datos, escribir_gz=True):
+        if escribir_gz:
+            self.f_gz.write(datos)
+        self.offset += len(datos)
+
+        # Cálculo del checksum por bloques de tamaño fijo
+        vista = memoryview(datos)
+        while len(vista):
+            n = min(TAMANO_CHUNK - self.bytes_bloque, len(vista))
+            self.huella_bloque.update(vista[:n])
+            self.bytes_bloque += n
+            vista = vista[n:]
+            if self.bytes_bloque == TAMANO_CHUNK:
+                self.meta["chunks"].append(self.huella_bloque.hexdigest())
+                self.huella_bloque = hashlib.sha256()
+                self.bytes_bloque = 0
+                if escribir_gz:
+                    self.f_gz.flush()
+                    self._guardar_meta()
+
+        # El primer bloque indica si el contenido viene comprimido (cabecera mágica 1f 8b)
+        if self.meta.get("gzip") is None:
+            self.meta["gzip"] = datos[:2] == b"\x1f\x8b"
+        if not self.meta["gzip"]:
+            self._escribir_csv(datos)
+            return
+        if self.descompresor is None:
+            self.descompresor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        self._escribir_csv(self.descompresor.decompress(datos))
+        # Un .gz puede contener varios miembros concatenados
+        while self.descompresor.eof and self.descompresor.unused_data:
+            restante = self.descompresor.unused_data
+            self.descompresor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self._escribir_csv(self.descompresor.decompress(restante))
+
+    # Con la capa raw en gzip y el contenido recibido en gzip se conserva el fichero descargado, sin recomprimir
+    def _conservar_gz(self):
+        return self.compresion == "gzip" and bool(self.meta.get("gzip"))
+
+    def _escribir_csv(self, datos):
+        self.huella_csv.update(datos)
+        self.bytes_csv += len(datos)
+        if self._conservar_gz():
+            return
+        if self.f_csv is None:
+            self.f_csv = EscritorRaw(self.csv_tmp_path, self.compresion)
+        self.f_csv.write(datos)
+
+    # --- Peticiones HTTP ---
+
+    # Lanza una petición (completa o Range) y procesa el cuerpo. Devuelve False si el servidor responde 304.
+    def _peticion(self, headers_condicionales):
+        headers = {}
+        if self.offset == 0:
+            headers.update(headers_condicionales)
+        else:
+            headers["Range"] = f"bytes={self.offset}-"
+            # If-Range: si el fichero ha cambiado en el servidor se recibe completo (200) en lugar del resto
+            validador = self.meta.get("etag") or self.meta.get("last_modified")
+            if validador:
+                headers["If-Range"] = validador
+
+        with self.session.get(self.dataset_url, headers=headers, allow_redirects=True, stream=True,
+                              timeout=TIMEOUT) as response:
 
-    # Agregar un encabezado User-Agent para simular una solicitud desde un navegador
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-    }
+            if response.status_code == 304 and self.offset == 0:
+                return False
 
-    # Realizamos la solicitud GET con la sesión y los encabezados
-    response = session.get(dataset_url, headers=headers, allow_redirects=True)
+            if response.status_code == 416:
+                # El parcial ya contiene todo el fichero o ya no corresponde con el del servidor
+                if self.meta.get("total") is not None and self.offset == self.meta["total"]:
+                    return True
+                self._reiniciar()
+                raise DescargaInterrumpida("Rango no válido, se reinicia la descarga")
 
-    # Verificar si la respuesta es correcta
-    if response.status_code == 200:
-        # Obtener el nombre del archivo a partir de la URL
-        parsed_url = urlparse(dataset_url)
-        dataset_name = parsed_url.path.split('/')[-2]  # Extraemos el nombre del dataset de la URL
+            if response.status_code == 206:
+                inicio = response.headers.get("Content-Range", "").replace("bytes ", "").split("-")[0]
+                if inicio != str(self.offset):
+                    self._reiniciar()
+                    raise DescargaInterrumpida(f"Content-Range inesperado: {response.headers.get('Content-Range')}")
+                total = response.headers.get("Content-Range", "").split("/")[-1]
+                if total.isdigit():
+                    self.meta["total"] = int(total)
 
-        # Crear la carpeta de salida si no existe
-        os.makedirs(output_folder, exist_ok=True)
+            elif response.status_code == 200:
+                if self.offset > 0:
+                    print(f"⚠️ {self.dataset_name}: el servidor no acepta Range o el fichero ha cambiado, se descarga de nuevo")
+                    self._reiniciar()
+                self._validar_respuesta(response)
+                total = response.headers.get("Content-Length")
+                self.meta.update(
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified"),
+                    total=int(total) if total and total.isdigit() else None,
+                )
 
-        # Nombre de archivo GZ y CSV utilizando el nombre del dataset
-        gz_file_path = os.path.join(output_folder, f"{dataset_name}.csv.gz")
-        csv_file_path = os.path.join(output_folder, f"{dataset_name}.csv")
+            elif response.status_code == 429 or response.status_code >= 500:
+                raise DescargaInterrumpida(f"Código de estado {response.status_code}")
 
+            else:
+                raise RuntimeError(f"Código de estado: {response.status_code}. "
+                                   f"Detalles completos del error: {response.text[:500]}")
+
+            self._guardar_meta()
+
+            # Se leen los bytes tal cual llegan (sin decodificar) para que los offsets coincidan con el parcial
+            for datos in response.raw.stream(TAMANO_LECTURA, decode_content=False):
+                if datos:
+                    self._procesar(datos)
+
+        if self.meta.get("total") is not None and self.offset < self.meta["total"]:
+            raise DescargaInterrumpida(f"Recibidos {self.offset} de {self.meta['total']} bytes")
+        return True
+
+    # Comprobación del tipo de contenido y diagnóstico de la primera respuesta completa
+    def _validar_respuesta(self, response):
         # Imprimir los encabezados completos de la respuesta para diagnóstico
-        print(f"📦 Encabezados de la respuesta para {dataset_name}:")
+        print(f"📦 Encabezados de la respuesta para {self.dataset_name}:")
         for key, value in response.headers.items():
             print(f"{key}: {value}")
 
         # Verificar si el contenido es un archivo GZ
         content_type = response.headers.get('Content-Type', '')
         print(f"🔍 Tipo de contenido recibido: {content_type}")
+        if 'gzip' not in content_type and 'csv' not in content_type:
+            print("⚠️ El archivo descargado no es GZ válido. El contenido recibido no tiene el tipo esperado.")
+            print("🔍 Contenido de la respuesta (primeros 500 caracteres):")
+            print(response.text[:500])  # Mostrar los primeros 500 caracteres de la respuesta
+            raise ValueError(f"Tipo de contenido inesperado: {content_type}")
 
-        if 'gzip' in content_type or 'csv' in content_type:
-            # Guardar el archivo GZ
-            with open(gz_file_path, "wb") as f:
-                f.write(response.content)
-            print(f"✅ Archivo GZ descargado y guardado en: {gz_file_path}")
+    # Cierre del CSV parcial: el gzip debe haber llegado completo (el trailer incluye el CRC32)
+    def _finalizar(self):
+        if self.meta.get("gzip") and self.descompresor is not None:
+            if not self.descompresor.eof:
+                # Puede que la conexión se cerrara sin informar del tamaño: se reintenta desde el offset actual
+                raise DescargaInterrumpida("El fichero GZ recibido está incompleto")
+            self._escribir_csv(self.descompresor.flush())
+        if self.f_csv is None and not self._conservar_gz():
+            self.f_csv = EscritorRaw(self.csv_tmp_path, self.compresion)
+        return self.bytes_csv
 
-            # Descomprimir el archivo GZ
-            try:
-                # Descomprimir el archivo GZ a un archivo CSV
-                with gzip.open(gz_file_path, 'rb') as f_in:
-                    with open(csv_file_path, 'wb') as f_out:
-                        shutil.copyfileobj(f_in, f_out)
-                print(f"✅ Archivo descomprimido y guardado como: {csv_file_path}")
+    # Bucle de descarga con reintentos acotados y espera exponencial con jitter
+    def ejecutar(self, headers_condicionales=None):
+        self._recuperar_parcial()
+        intentos = 0
+        try:
+            while True:
+                offset_inicial = self.offset
+                try:
+                    if not self._peticion(headers_condicionales or {}):
+                        self._descartar()
+                        return None
+                    bytes_escritos = self._finalizar()
+                    break
+                except (DescargaInterrumpida, requests.ConnectionError, requests.Timeout,
+                        requests.exceptions.ChunkedEncodingError, Urllib3Error) as e:
+                    # Si el intento avanzó, el contador de reintentos vuelve a empezar
+                    intentos = 0 if self.offset > offset_inicial else intentos
+                    intentos += 1
+                    if intentos > MAX_REINTENTOS:
+                        raise RuntimeError(f"Descarga abandonada tras {MAX_REINTENTOS} reintentos: {e}") from e
+                    espera = random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** intentos))
+                    print(f"🔁 {self.dataset_name}: {e}. Reintento {intentos}/{MAX_REINTENTOS} "
+                          f"desde el byte {self.offset} en {espera:.1f}s")
+                    time.sleep(espera)
+        except Exception:
+            # Sin ningún byte recibido no merece la pena conservar el parcial
+            if self.offset == 0:
+                self._descartar()
+            raise
+        finally:
+            self._cerrar_salidas()
+
+        resultado = {
+            "bytes_recibidos": self.offset,
+            "bytes_escritos": bytes_escritos,
+            "sha256": self.huella_csv.hexdigest(),
+            "etag": self.meta.get("etag"),
+            "last_modified": self.meta.get("last_modified"),
+            "csv_tmp_path": self.csv_tmp_path,
+        }
+        # La descarga está completa: el parcial comprimido pasa a ser el fichero descargado (si se conserva el gzip)
+        # o ya no hace falta, igual que su índice
+        if self._conservar_gz():
+            os.replace(self.gz_part_path, self.csv_tmp_path)
+        for ruta in (self.gz_part_path, self.meta_path):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        return resultado
+
+    def _descartar(self):
+        self._cerrar_salidas()
+        for ruta in (self.gz_part_path, self.meta_path, self.csv_tmp_path):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+
+
+# Función para preguntar a la API SDMX si el dataset tiene observaciones nuevas desde la última descarga
+def hay_cambios_desde(dataset_url, fecha_descarga, session):
+    # La respuesta se pide sin comprimir para poder contar las líneas recibidas
+    dataset_url = dataset_url.replace("compress=true", "compress=false")
+    separador = "&" if "?" in dataset_url else "?"
+    url_consulta = f"{dataset_url}{separador}updatedAfter={quote(fecha_descarga)}"
+    try:
+        with session.get(url_consulta, allow_redirects=True, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code in (204, 304):
+                return False
+            if response.status_code != 200:
+                return True  # Ante la duda se hace la petición condicional completa
+            # Basta con comprobar si tras la cabecera del CSV llega alguna observación
+            lineas = 0
+            for _ in response.iter_lines():
+                lineas += 1
+                if lineas > 1:
+                    return True
+            return False
+    except requests.RequestException:
+        return True
+
+
+# Función para descargar el archivo GZ de un dataset y guardarlo con la compresión de la capa raw
+def download_and_extract(dataset_url, output_folder, session=None, anterior=None):
+    # Usamos una sesión de requests para manejar cookies, redirecciones y reutilizar conexiones
+    if session is None:
+        session = crear_sesion(1)
+
+    # Obtener el nombre del archivo a partir de la URL
+    dataset_name = obtener_nombre_dataset(dataset_url)
+
+    # Nombre de archivo CSV utilizando el nombre del dataset (base de los ficheros parciales), fichero final con la
+    # compresión configurada y fichero de la descarga anterior (con la compresión que tuviera)
+    csv_file_path = os.path.join(output_folder, f"{dataset_name}.csv")
+    raw_file_path = ruta_raw(output_folder, dataset_name)
+    existente = buscar_raw(output_folder, dataset_name)
+
+    # La información de la descarga anterior sólo sirve si el CSV sigue en disco y se pidió con los mismos filtros
+    if existente is None or FORZAR_DESCARGA or (anterior or {}).get("url") != dataset_url:
+        anterior = None
+    anterior = anterior or {}
+    ahora = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+    entrada = dict(anterior, url=dataset_url, fichero=existente or raw_file_path, fecha_comprobacion=ahora)
+
+    # Consulta SDMX `updatedAfter`: si no hay observaciones nuevas no se descarga nada
+    if USAR_UPDATED_AFTER and anterior.get("fecha_descarga") and "/sdmx/" in dataset_url:
+        if not hay_cambios_desde(dataset_url, anterior["fecha_descarga"], session):
+            print(f"⏭️ {dataset_name} sin observaciones nuevas desde {anterior['fecha_descarga']}")
+            return dict(entrada, estado=ESTADO_SIN_CAMBIOS)
 
-                # Borrar el archivo .gz después de descomprimir
-                os.remove(gz_file_path)
-                print(f"🗑️ Archivo .gz eliminado: {gz_file_path}")
+    # Petición condicional con las cabeceras guardadas en el manifiesto
+    headers = {}
+    if anterior.get("etag"):
+        headers["If-None-Match"] = anterior["etag"]
+    if anterior.get("last_modified"):
+        headers["If-Modified-Since"] = anterior["last_modified"]
 
+    # Crear la carpeta de salida si no existe
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Descarga por bloques, reanudable, a un fichero temporal con la compresión de la capa raw
+    try:
+        descarga = DescargaReanudable(session, dataset_url, csv_file_path).ejecutar(headers)
+    except Exception as e:
+        print(f"❌ Error al descargar los datos de {dataset_name}: {e}")
+        return dict(entrada, estado=ESTADO_ERROR)
+
+    if descarga is None:
+        print(f"⏭️ {dataset_name} no ha cambiado en el servidor (304)")
+        return dict(entrada, estado=ESTADO_SIN_CAMBIOS)
+
+    entrada.update(etag=descarga["etag"], last_modified=descarga["last_modified"], fecha_descarga=ahora)
+
+    # Mismo contenido que la descarga anterior: se conserva el fichero existente
+    if descarga["sha256"] == anterior.get("sha256"):
+        os.remove(descarga["csv_tmp_path"])
+        print(f"⏭️ {dataset_name} descargado pero idéntico a la versión anterior")
+        return dict(entrada, estado=ESTADO_SIN_CAMBIOS)
+
+    os.replace(descarga["csv_tmp_path"], raw_file_path)
+    # La versión anterior con otra compresión ya no sirve
+    if existente is not None and existente != raw_file_path:
+        os.remove(existente)
+    bytes_fichero = os.path.getsize(raw_file_path)
+    print(f"✅ {dataset_name}: {descarga['bytes_recibidos']} bytes descargados y guardados en: {raw_file_path} "
+          f"({descarga['bytes_escritos']} bytes sin comprimir)")
+    estado = ESTADO_ACTUALIZADO if anterior.get("sha256") else ESTADO_NUEVO
+    return dict(entrada, fichero=raw_file_path, sha256=descarga["sha256"], bytes=descarga["bytes_escritos"],
+                bytes_fichero=bytes_fichero, compresion=COMPRESION_RAW, estado=estado)
+
+
+# Descarga de un dataset registrando sus métricas
+def descargar_medido(dataset_url, output_folder, session=None, anterior=None):
+    with medir("descarga", obtener_nombre_dataset(dataset_url)):
+        entrada = download_and_extract(dataset_url, output_folder, session, anterior)
+        anotar(resultado=entrada.get("estado"))
+        if entrada.get("estado") in (ESTADO_NUEVO, ESTADO_ACTUALIZADO):
+            anotar(bytes_escritos=entrada.get("bytes_fichero"), bytes_sin_comprimir=entrada.get("bytes"))
+        return entrada
+
+
+# Función para descargar todos los datasets en paralelo compartiendo el pool de conexiones
+def descargar_datasets(urls, output_folder, max_workers=MAX_DESCARGAS_CONCURRENTES, session=None,
+                       ruta_manifiesto=RUTA_MANIFIESTO):
+    os.makedirs(output_folder, exist_ok=True)
+    if session is None:
+        session = crear_sesion(max_workers)
+
+    manifiesto = cargar_manifiesto(ruta_manifiesto)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futuros = {
+            executor.submit(descargar_medido, url, output_folder, session,
+                            manifiesto.get(obtener_nombre_dataset(url))): url
+            for url in urls
+        }
+        for futuro in as_completed(futuros):
+            url = futuros[futuro]
+            dataset_name = obtener_nombre_dataset(url)
+            try:
+                manifiesto[dataset_name] = futuro.result()
             except Exception as e:
-                print(f"⚠️ Error al descomprimir el archivo GZ: {e}")
-        else:
-            print("⚠️ El archivo descargado no es GZ válido. El contenido recibido no tiene el tipo esperado.")
-            print("🔍 Contenido de la respuesta (primeros 500 caracteres):")
-            print(response.text[:500])  # Mostrar los primeros 500 caracteres de la respuesta
-    else:
-        print(f"❌ Error al descargar los datos de {dataset_name}. Código de estado: {response.status_code}")
-        print(f"🔍 Detalles completos del error: {response.text[:500]}")  # Mostrar los primeros 500 caracteres del mensaje de error
+                print(f"❌ Error al descargar {dataset_name}: {e}")
+                manifiesto[dataset_name] = dict(manifiesto.get(dataset_name, {}), url=url, estado=ESTADO_ERROR)
+
+    guardar_manifiesto(manifiesto, ruta_manifiesto)
+
+    resumen = {}
+    for url in urls:
+        estado = manifiesto[obtener_nombre_dataset(url)]["estado"]
+        resumen[estado] = resumen.get(estado, 0) + 1
+    print(f"📋 Manifiesto actualizado en {ruta_manifiesto}: {resumen}")
 
+    # Captura de cambios de los datasets que han cambiado respecto a la publicación anterior
+    import captura_cambios
+    if captura_cambios.CDC_ACTIVO:
+        captura_cambios.main([manifiesto[obtener_nombre_dataset(url)]["fichero"] for url in urls
+                              if manifiesto[obtener_nombre_dataset(url)]["estado"] in (ESTADO_NUEVO, ESTADO_ACTUALIZADO)])
+    return {url: manifiesto[obtener_nombre_dataset(url)]["estado"] for url in urls}
 
 
-# Descargar y descomprimir cada dataset
-for dataset_url in dataset_urls:
-    download_and_extract(dataset_url, folder_path)
+if __name__ == "__main__":
+    # Descargar cada dataset
+    descargar_datasets(dataset_urls, folder_path)
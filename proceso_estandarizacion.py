@@ -7,15 +7,19 @@ Realiza las siguientes tareas principales:
 
     **Estandarización de datos:**
    - Homogeneiza el dataset de EEA (`UNFCCC_v28_3.csv`) para adecuarlo al formato de Eurostat, asegurando consistencia en nombres de columnas, valores categóricos y codificación de entidades geográficas.
-   - Mueve todos los archivos curados de Eurostat a una carpeta común de ficheros estandarizados.
+   - La homogeneización se describe como una especificación declarativa (`vistas_estandarizacion.py`) que se aplica
+     al leer la tabla, así que los ficheros no se reescriben.
+   - Expone todos los archivos curados (EEA y Eurostat) en una carpeta común de ficheros estandarizados mediante
+     enlaces duros, sin leerlos ni copiarlos (copia sólo si el sistema de ficheros no admite enlaces).
+   - Los errores se recogen por fichero.
 
 '''
 
-import pandas as pd
-import glob
 import os
-import shutil
-from tqdm import tqdm
+
+from almacenamiento import listar_tablas
+from ejecucion_paralela import ejecutar_por_archivo, informar_errores
+from vistas_estandarizacion import aplicar_especificacion, enlazar_tabla
 
 
 # Paths en local
@@ -25,48 +29,53 @@ CARPETA_CURADO_EEA = os.path.join("ficheros_curado", "eea")
 CARPETA_ESTANDARIZADOS = "ficheros_estandarizados"
 
 
-# Crear carpetas si no existen
-for carpeta in [CARPETA_ESTANDARIZADOS]:
-    if not os.path.exists(carpeta):
-        os.makedirs(carpeta)
+# 1) TRANSFORMACIÓN DE LAS TABLAS DE EEA A LA ESTRUCTURA EUROSTAT (ESTANDARIZACIÓN)
+# Estandarización en memoria de una tabla ya cargada con su especificación: devuelve el DataFrame sin guardarlo
+def estandarizar_dataframe(nombre, df):
+    return aplicar_especificacion(nombre, df)
 
 
+# La especificación se aplica al leer, así que la tabla de EEA se expone tal cual
+def estandarizar_eea(archivo):
+    return enlazar_tabla(archivo, CARPETA_ESTANDARIZADOS)
 
-# 1) TRANSFORMACIÓN DE LAS TABLAS DE EEA A LA ESTRUCTURA EUROSTAT (ESTANDARIZACIÓN)
-archivos_curados_eea = glob.glob(os.path.join(CARPETA_CURADO_EEA, "*.csv"))
-for archivo in tqdm(archivos_curados_eea, desc="Transformando archivos curados"):
-
-    df = pd.read_csv(archivo, low_memory=False)
-    
-    # Homogeneizamos los ficheros
-    if os.path.basename(archivo) == "UNFCCC_v28_3.csv":
-        df.rename(columns={
-        'Country_code': 'geo',
-        'Country': 'Geopolitical entity (reporting)',
-        'emissions': 'OBS_VALUE',
-        'Year': 'TIME_PERIOD',
-        'Pollutant_name': 'airpol'
-        }, inplace=True)
-        df['geo'] = df['geo'].replace('EUA', 'EU27_2020')
-        df['Geopolitical entity (reporting)'] = df['Geopolitical entity (reporting)'].replace('EU-27', 'European Union - 27 countries (from 2020)')
-        df['airpol'] = df['airpol'].replace('All greenhouse gases - (CO2 equivalent)','GHG')
-        df = df[df['airpol'] == 'GHG']
-
-    # Guardar CSV en carpeta intermedia
-    nombre = os.path.basename(archivo)
-    ruta_curado_int = os.path.join(CARPETA_ESTANDARIZADOS, nombre)
-    df.to_csv(ruta_curado_int, index=False)
-
-#2) Mover los ficheros de CARPETA_CURADO_EUROSTAT a CARPETA_ESTANDARIZADOS
-
-archivos_curados_eurostat = glob.glob(os.path.join(CARPETA_CURADO_EUROSTAT, "*.csv"))
-for archivo in tqdm(archivos_curados_eurostat, desc="Trasladando archivos curados"):
-
-    df = pd.read_csv(archivo, low_memory=False)
-    nombre = os.path.basename(archivo)
-    ruta_destino = os.path.join(CARPETA_ESTANDARIZADOS, nombre)
-    shutil.copy2(archivo, ruta_destino)
-    print(f'Movido {nombre}')
-
-
-print("Proceso finalizado.")
\ No newline at end of file
+
+#2) Enlazar los ficheros de CARPETA_CURADO_EUROSTAT en CARPETA_ESTANDARIZADOS (el curado se conserva)
+def enlazar_eurostat(archivo):
+    ruta_destino = enlazar_tabla(archivo, CARPETA_ESTANDARIZADOS)
+    print(f'Enlazado {os.path.basename(archivo)} en {CARPETA_ESTANDARIZADOS}')
+    return ruta_destino
+
+
+# Estandarización de todos los ficheros curados (o sólo de `archivos`), repartidos entre `workers` procesos
+def main(workers=None, archivos=None):
+    # Crear carpetas si no existen
+    for carpeta in [CARPETA_ESTANDARIZADOS]:
+        if not os.path.exists(carpeta):
+            os.makedirs(carpeta)
+
+    if archivos is None:
+        archivos_curados_eea = listar_tablas(CARPETA_CURADO_EEA)
+        archivos_curados_eurostat = listar_tablas(CARPETA_CURADO_EUROSTAT)
+    else:
+        # Cada fichero se trata según la carpeta de curado de la que procede
+        archivos_curados_eea = [a for a in archivos if os.path.dirname(os.path.normpath(a)) == CARPETA_CURADO_EEA]
+        archivos_curados_eurostat = [a for a in archivos
+                                     if os.path.dirname(os.path.normpath(a)) == CARPETA_CURADO_EUROSTAT]
+
+    resultados_eea, errores_eea = ejecutar_por_archivo(estandarizar_eea, archivos_curados_eea, workers,
+                                                       desc="Transformando archivos curados",
+                                                       etapa="estandarizacion_eea")
+
+    resultados_eurostat, errores_eurostat = ejecutar_por_archivo(enlazar_eurostat, archivos_curados_eurostat, workers,
+                                                                 desc="Enlazando archivos curados",
+                                                                 etapa="estandarizacion_eurostat")
+
+    errores = {**errores_eea, **errores_eurostat}
+    informar_errores(errores, "la estandarización")
+    print("Proceso finalizado.")
+    return {**resultados_eea, **resultados_eurostat}, errores
+
+
+if __name__ == "__main__":
+    main()
@@ -9,19 +9,52 @@ Realiza las siguientes tareas principales:
 1. **Creación de tablas de hechos y dimensiones:**
    - Genera tablas de hechos (`fact_*.csv`) con las columnas relevantes según una estructura predefinida.
    - Extrae las distintas dimensiones clave (como tipo de emisiones, sectores económicos, localización geográfica, etc.) desde los datasets estandarizados.
-   - Elimina duplicados y guarda las dimensiones como archivos separados (`dim_*.csv`).
+   - Elimina duplicados y guarda las dimensiones como archivos separados (`dim_*.csv`), con una clave subrogada
+     entera (`id_<dimensión>`) por cada código.
+   - Las dimensiones funcionan como un registro persistente (`registro_dimensiones.py`): sólo se insertan los códigos
+     nuevos y las claves existentes se mantienen entre ejecuciones. Para regenerarlas desde cero basta con borrar
+     `ficheros_dim`.
+   - En modo incremental (`ETL_NORMALIZACION_INCREMENTAL=1`) sólo se procesan los ficheros estandarizados nuevos o
+     modificados desde la última ejecución, según sus huellas en `ficheros_dim/estado_normalizacion.json`.
+   - En las tablas de hechos los códigos de las dimensiones se sustituyen por esas claves y el resto de columnas de
+     texto se guardan como categorías (columnas diccionario en Parquet/Arrow).
 
 2. **Organización en capas del modelo de datos:**
    - Las tablas generadas se almacenan en las carpetas `ficheros_fact` y `ficheros_dim`, según su rol en el modelo estrella de explotación analítica.
+   - Los ficheros estandarizados se leen en el formato intermedio configurado (`ETL_FORMATO_INTERMEDIO`), aplicando su
+     especificación de estandarización (`vistas_estandarizacion.py`). Las tablas finales se exportan siempre a CSV y,
+     con un formato columnar, también en ese formato.
+   - Con `ETL_FACT_PARTICIONADO=1` la copia en el formato intermedio de cada tabla de hechos se escribe particionada
+     por `TIME_PERIOD` y/o `geo` en `ficheros_fact/particionado/<tabla>/` (columnas según el catálogo), con un
+     manifiesto de particiones, y sólo se reescriben las particiones que cambian (`particionado.py`).
+
+3. **Captura de cambios (`ETL_CDC=1`, ver `captura_cambios.py`):**
+   - Si el fichero curado se actualizó con un delta y la tabla de hechos se generó a partir de la publicación de la
+     que parte, sólo se extraen las dimensiones de las filas del delta y en la tabla de hechos se quitan las filas
+     de las claves actualizadas o borradas y se añaden las nuevas, sin volver a leer el fichero estandarizado.
+
+4. **Ejecución en paralelo:**
+   - Los ficheros se reparten entre `ETL_WORKERS` procesos; cada uno devuelve sus dimensiones parciales, que se
+     fusionan una sola vez antes de escribir los hechos. Los errores se recogen por fichero.
 
 
 '''
 
 import pandas as pd
-import glob
 import os
-import shutil
-from tqdm import tqdm
+from functools import partial
+
+import numpy as np
+
+import captura_cambios
+import catalogo_datasets
+from almacenamiento import escribir_tabla, escribir_tabla_final, leer_tabla, listar_tablas, nombre_tabla, ruta_tabla
+from ejecucion_paralela import ejecutar_por_archivo, informar_errores
+from huellas import cargar_estado, guardar_estado, ha_cambiado, huella_fichero
+from metricas import anotar, medir
+from particionado import escribir_particionada
+from registro_dimensiones import RegistroDimensiones, mapear_claves
+from vistas_estandarizacion import aplicar_especificacion, leer_estandarizada
 
 
 # Paths en local
@@ -29,12 +62,11 @@ from tqdm import tqdm
 CARPETA_ESTANDARIZADOS = "ficheros_estandarizados"
 CARPETA_FACT = "ficheros_fact"
 CARPETA_DIM = "ficheros_dim"
+CARPETA_FACT_PARTICIONADO = os.path.join(CARPETA_FACT, "particionado")
 
+# Huellas de los ficheros estandarizados ya normalizados (modo incremental)
+RUTA_ESTADO = os.path.join(CARPETA_DIM, "estado_normalizacion.json")
 
-# Crear carpetas si no existen
-for carpeta in [CARPETA_FACT, CARPETA_DIM]:
-    if not os.path.exists(carpeta):
-        os.makedirs(carpeta)
 
 # Definición de columnas de las tablas de hechos
 columnas_hechos = ['STRUCTURE_NAME', 'freq', 'airpol', 'nace_r2', 
@@ -43,6 +75,7 @@ columnas_hechos = ['STRUCTURE_NAME', 'freq', 'airpol', 'nace_r2',
                     'Statistical information',
                     'Environment indicator',
                     'National accounts indicator (ESA 2010)',
+                    'Energy balance',
                     'reporter',
                     'PARTNER',
                     'FLOW',
@@ -62,58 +95,264 @@ dim_cols = {
     'ipcc': ['Sector_code','Sector_name']
 }
 
-# Diccionario personalizado de nombres para tablas de hechos
-nombres_fact = {
-    "env_ac_ainah_r2": "aea",
-    "env_ac_aeint_r2": "aei",
-    "env_ac_aibrid_r2": "aea_brid",
-    "sdg_13_10": "ghe",
-    "nrg_ind_eff": "eff",
-    "sdg_07_10": "energy_cons",
-    "nrg_ind_fecf": "share_energy_cons",
-    "nrg_ind_ren": "share_ren",
-    "sdg_13_40": "losses",
-    "ds-059331$defaultview": "import_export",
-    "nama_10_gdp": "gdp",
-    "UNFCCC_V28_3": "ghg_unfccc"
-}
+# Columnas que hay que leer de cada fichero estandarizado para extraer las dimensiones
+columnas_dimensiones = list(dict.fromkeys(c for cols in dim_cols.values() for c in cols))
+
+# Columnas de valor de las tablas de hechos: el resto identifican cada fila al aplicar un delta
+columnas_valor_hechos = ['OBS_VALUE', 'OBS_FLAG', 'Notation', 'PublicationData', 'DataSource']
+
+# Sustituir en las tablas de hechos los códigos de cada dimensión por su clave subrogada entera
+# (ETL_CLAVES_SUBROGADAS=0 mantiene los códigos originales)
+USAR_CLAVES_SUBROGADAS = os.environ.get("ETL_CLAVES_SUBROGADAS", "1") == "1"
+
+# Procesar sólo los ficheros estandarizados nuevos o modificados (ETL_NORMALIZACION_INCREMENTAL=1)
+NORMALIZACION_INCREMENTAL = os.environ.get("ETL_NORMALIZACION_INCREMENTAL", "0") == "1"
+
+# Escribir las tablas de hechos particionadas por TIME_PERIOD y/o geo además del CSV (ETL_FACT_PARTICIONADO=1)
+FACT_PARTICIONADO = os.environ.get("ETL_FACT_PARTICIONADO", "0") == "1"
+
+# Diccionario personalizado de nombres para tablas de hechos (definido en el catálogo de datasets)
+nombres_fact = catalogo_datasets.nombres_fact
 
 # CREACIÓN TABLAS DE DIMENSIONES Y HECHOS
-# Diccionario para ir guardando todas las tablas de dimensiones que vayamos extrayendo
-dimensiones_acumuladas = {dim: [] for dim in dim_cols.keys()}
 
-# Procesar cada CSV curado para separar hechos y dimensiones
-archivos_curados = glob.glob(os.path.join(CARPETA_ESTANDARIZADOS, "*.csv"))
+# Guardar una tabla final: siempre en CSV y, si se usa un formato columnar, también en ese formato
+guardar_tabla_final = escribir_tabla_final
 
-for archivo in tqdm(archivos_curados, desc="Procesando archivos curados"):
-    df = pd.read_csv(archivo, low_memory=False)
-    nombre_base = os.path.splitext(os.path.basename(archivo))[0]
-    # 1)--- Hechos ---
-    columnas_hechos_existentes = [c for c in columnas_hechos if c in df.columns]
-    df_hechos = df[columnas_hechos_existentes].copy()
+
+# Nombre de la columna con la clave subrogada de una dimensión
+columna_clave = RegistroDimensiones.columna_clave
+
+
+# Nombre de la tabla de hechos de un fichero estandarizado
+def nombre_tabla_hechos(nombre_base):
     nombre_fact = nombres_fact.get(nombre_base, f"fact_{nombre_base}")
-    ruta_fact = os.path.join(CARPETA_FACT, f"fact_{nombre_fact}.csv")
-    df_hechos.to_csv(ruta_fact, index=False)
+    return f"fact_{nombre_fact}"
 
 
-    # 2)--- Dimensiones ---
+# Dimensiones parciales de un DataFrame estandarizado
+def dimensiones_de(df):
+    dimensiones = {}
     for dim, cols in dim_cols.items():
-        cols_existentes = [c for c in cols if c in df.columns]
-        if cols_existentes:
-            df_dim = df[cols_existentes].drop_duplicates().reset_index(drop=True)
-            dimensiones_acumuladas[dim].append(df_dim)
-
-
-# Concatenar dimensiones de todos los archivos, eliminar duplicados y guardar
-for dim, lista_df in dimensiones_acumuladas.items():
-    if lista_df:
-        df_dim_concat = pd.concat(lista_df, ignore_index=True).drop_duplicates().reset_index(drop=True)
-        ruta_dim = os.path.join(CARPETA_DIM, f"dim_{dim}.csv")
-        df_dim_concat.to_csv(ruta_dim, index=False)
-        print(f"Dimensión '{dim}' creada con {len(df_dim_concat)} registros en {ruta_dim}")
+        # La clave se asigna por código, así que hace falta la columna de código
+        if cols[0] in df.columns:
+            cols_existentes = [c for c in cols if c in df.columns]
+            dimensiones[dim] = df[cols_existentes].drop_duplicates().reset_index(drop=True)
+    return dimensiones
+
+
+# Ruta del CSV de la tabla de hechos de un dataset
+def ruta_hechos(nombre_base):
+    return ruta_tabla(CARPETA_FACT, nombre_tabla_hechos(nombre_base), "csv")
+
+
+# Delta curado (captura de cambios) que se puede aplicar a la tabla de hechos de un fichero estandarizado, ya con
+# la especificación de estandarización aplicada. Devuelve (registro del curado, delta) o None
+def delta_hechos(archivo):
+    nombre_base = nombre_tabla(archivo)
+    version = captura_cambios.leer_version(CARPETA_FACT, nombre_tabla_hechos(nombre_base), ruta_hechos(nombre_base))
+    encontrado = captura_cambios.delta_curado(nombre_base, version and version.get("version"))
+    if encontrado is None:
+        return None
+    curado, delta = encontrado
+    return curado, aplicar_especificacion(nombre_base, delta)
+
+
+# 1) Extraer de un fichero estandarizado sus dimensiones parciales (sólo se leen las columnas de dimensiones).
+# Con un delta aplicable sólo se leen las filas nuevas o actualizadas del delta
+def extraer_dimensiones(archivo):
+    encontrado = delta_hechos(archivo)
+    if encontrado is not None:
+        delta = encontrado[1]
+        df = delta[delta[captura_cambios.COLUMNA_CAMBIO] != captura_cambios.BORRADO]
     else:
-        print(f"No se encontró información para la dimensión '{dim}' en los archivos.")
+        df = leer_estandarizada(archivo, columnas=columnas_dimensiones)
+    anotar(filas_leidas=len(df))
+    return dimensiones_de(df)
+
+
+# Sustituir los códigos de las dimensiones por sus claves y codificar el resto de textos como categorías
+# (en Parquet/Arrow se guardan como columnas diccionario)
+def codificar_hechos(df_hechos, claves):
+    for dim, cols in dim_cols.items():
+        codigo = cols[0]
+        if codigo not in df_hechos.columns or dim not in claves:
+            continue
+        posicion = df_hechos.columns.get_loc(codigo)
+        ids = mapear_claves(df_hechos[codigo], claves[dim])
+        df_hechos = df_hechos.drop(columns=[c for c in cols if c in df_hechos.columns])
+        df_hechos.insert(min(posicion, len(df_hechos.columns)), columna_clave(dim), ids)
+
+    for col in df_hechos.columns:
+        if pd.api.types.is_object_dtype(df_hechos[col]) or pd.api.types.is_string_dtype(df_hechos[col]):
+            df_hechos[col] = df_hechos[col].astype("category")
+    return df_hechos
+
+
+# Tabla de hechos de un DataFrame estandarizado
+def hechos_de(df, claves=None):
+    columnas_hechos_existentes = [c for c in columnas_hechos if c in df.columns]
+    # Sin columnas de hechos la tabla queda vacía (sin filas), igual que al leerla de disco
+    df_hechos = df[columnas_hechos_existentes].copy() if columnas_hechos_existentes else pd.DataFrame()
+    if claves is not None:
+        df_hechos = codificar_hechos(df_hechos, claves)
+    return df_hechos
+
+
+# Códigos originales de las columnas de partición que en `hechos` se han sustituido por claves subrogadas
+def valores_particion(hechos, columnas, claves):
+    valores = {}
+    for dim, cols in dim_cols.items():
+        if cols[0] in columnas and cols[0] not in hechos.columns and columna_clave(dim) in hechos.columns:
+            inverso = {clave: codigo for codigo, clave in (claves or {}).get(dim, {}).items()}
+            valores[cols[0]] = hechos[columna_clave(dim)].map(inverso)
+    return pd.DataFrame(valores, index=hechos.index)
+
+
+# Guardar la tabla de hechos de un dataset. En modo particionado la copia en el formato intermedio se escribe por
+# particiones, cuyos valores (los códigos originales) se toman del DataFrame estandarizado `df` o, sin él, de las
+# claves subrogadas (`claves`)
+def guardar_hechos(hechos, nombre_base, df=None, claves=None):
+    nombre = nombre_tabla_hechos(nombre_base)
+    if not FACT_PARTICIONADO:
+        return guardar_tabla_final(hechos, CARPETA_FACT, nombre)
+
+    ruta = escribir_tabla(hechos, CARPETA_FACT, nombre, formato="csv")
+    columnas = catalogo_datasets.particiones_de(nombre_base)
+    if df is None:
+        df = valores_particion(hechos, columnas, claves)
+    _, particiones = escribir_particionada(hechos, CARPETA_FACT_PARTICIONADO, nombre, columnas, valores=df)
+    anotar(**{f"particiones_{clave}": n for clave, n in particiones.items()})
+    return ruta
+
+
+# Aplica un delta curado a la tabla de hechos guardada: se quitan las filas de las claves del delta y se añaden
+# las nuevas o actualizadas. Devuelve None si no se puede aplicar (columnas distintas o claves repetidas)
+def aplicar_delta_hechos(nombre_base, delta, claves):
+    cambios = delta[captura_cambios.COLUMNA_CAMBIO].astype(str).to_numpy()
+    hechos_delta = hechos_de(delta.drop(columns=captura_cambios.COLUMNA_CAMBIO), claves)
+    actual = leer_tabla(ruta_hechos(nombre_base))
+    if list(actual.columns) != list(hechos_delta.columns):
+        return None
+
+    # Claves subrogadas como enteros con vacíos (como al codificar los hechos), columnas vacías con el tipo del delta
+    # (al leerlas de un CSV quedan como decimales) y el resto con los mismos tipos que la tabla guardada para que las
+    # huellas y la concatenación coincidan
+    for col in [columna_clave(dim) for dim in dim_cols if columna_clave(dim) in actual.columns]:
+        actual[col] = actual[col].astype("Int64")
+    for col in actual.columns[actual.isna().all().to_numpy()]:
+        actual[col] = actual[col].astype(hechos_delta[col].dtype)
+    for col in hechos_delta.columns:
+        if hechos_delta[col].dtype != actual[col].dtype and not isinstance(actual[col].dtype, pd.CategoricalDtype):
+            try:
+                hechos_delta[col] = hechos_delta[col].astype(actual[col].dtype)
+            except (TypeError, ValueError):
+                pass
+
+    columnas_clave = [c for c in hechos_delta.columns if c not in columnas_valor_hechos]
+    huellas_actual = captura_cambios.huellas_filas(actual, columnas_clave)
+    if pd.Series(huellas_actual).duplicated().any():
+        return None
+    quitar = captura_cambios.huellas_filas(hechos_delta, columnas_clave)
+    conservadas = actual[~np.isin(huellas_actual, quitar)]
+    altas = hechos_delta[cambios != captura_cambios.BORRADO]
+    hechos = codificar_hechos(captura_cambios.concatenar(conservadas, altas), {})
+    anotar(modo="cdc", filas_leidas=len(delta), filas_quitadas=len(actual) - len(conservadas),
+           filas_escritas=len(hechos))
+    return guardar_hechos(hechos, nombre_base, claves=claves)
+
+
+# 2) Generar y guardar la tabla de hechos de un fichero estandarizado. Con un delta aplicable (captura de cambios)
+# sólo se aplica el delta sobre la tabla de hechos guardada
+def procesar_archivo(archivo, claves=None):
+    nombre_base = nombre_tabla(archivo)
+    encontrado = delta_hechos(archivo)
+    if encontrado is not None:
+        curado, delta = encontrado
+        ruta = aplicar_delta_hechos(nombre_base, delta, claves)
+        if ruta is not None:
+            captura_cambios.registrar_version(CARPETA_FACT, nombre_tabla_hechos(nombre_base), ruta,
+                                              curado["version"])
+            return ruta
+
+    # Sólo se cargan las columnas de la tabla de hechos
+    df = leer_estandarizada(archivo, columnas=columnas_hechos)
+    hechos = hechos_de(df, claves)
+    anotar(filas_leidas=len(df), filas_escritas=len(hechos))
+    ruta = guardar_hechos(hechos, nombre_base, df)
+    curado = captura_cambios.version_curado(nombre_base) if captura_cambios.CDC_ACTIVO else None
+    captura_cambios.registrar_version(CARPETA_FACT, nombre_tabla_hechos(nombre_base), ruta,
+                                      curado and curado.get("version"))
+    return ruta
+
+
+# Normalización en memoria de un DataFrame estandarizado (sin pasar por disco): registra sus dimensiones en
+# `registro` y guarda su tabla de hechos con las claves vigentes. Las dimensiones las guarda quien llama
+def normalizar_dataframe(nombre_base, df, registro):
+    for dim, df_dim in dimensiones_de(df).items():
+        registro.registrar(dim, df_dim)
+    claves = registro.claves() if USAR_CLAVES_SUBROGADAS else None
+    hechos = hechos_de(df, claves)
+    anotar(filas_leidas=len(df), filas_escritas=len(hechos))
+    return guardar_hechos(hechos, nombre_base, df)
+
+
+# Normalización de los ficheros estandarizados, repartidos entre `workers` procesos.
+# Primero se extraen las dimensiones (cada proceso devuelve las suyas) y se registran en el registro
+# persistente, que asigna las claves subrogadas; después se escriben las tablas de hechos con esas claves.
+# En modo incremental sólo se procesan los ficheros nuevos o modificados desde la última ejecución
+# (o los indicados en `archivos`)
+def main(workers=None, incremental=None, archivos=None):
+    incremental = NORMALIZACION_INCREMENTAL if incremental is None else incremental
+
+    # Crear carpetas si no existen
+    for carpeta in [CARPETA_FACT, CARPETA_DIM]:
+        if not os.path.exists(carpeta):
+            os.makedirs(carpeta)
+
+    estado = cargar_estado(RUTA_ESTADO)
+    archivos_curados = listar_tablas(CARPETA_ESTANDARIZADOS) if archivos is None else list(archivos)
+    if incremental and archivos is None:
+        archivos_curados = [archivo for archivo in archivos_curados if ha_cambiado(archivo, estado.get(archivo))]
+        print(f"🔄 Modo incremental: {len(archivos_curados)} fichero(s) nuevos o modificados")
+
+    # 1)--- Dimensiones ---
+    parciales, errores = ejecutar_por_archivo(extraer_dimensiones, archivos_curados, workers,
+                                              desc="Extrayendo dimensiones", etapa="normalizacion_dimensiones")
+
+    with medir("normalizacion_registro_dimensiones"):
+        registro = RegistroDimensiones(dim_cols, CARPETA_DIM).cargar()
+        nuevos = {dim: 0 for dim in dim_cols}
+        for archivo in archivos_curados:
+            for dim, df_dim in parciales.get(archivo, {}).items():
+                nuevos[dim] += registro.registrar(dim, df_dim)
+        rutas_dim = registro.guardar(todas=not incremental)
+        anotar(**{f"nuevos_{dim}": n for dim, n in nuevos.items()})
+
+    for dim in dim_cols:
+        if dim in registro.tablas:
+            print(f"Dimensión '{dim}' con {len(registro.tablas[dim])} registros ({nuevos[dim]} nuevos)"
+                  f"{' en ' + rutas_dim[dim] if dim in rutas_dim else ''}")
+        else:
+            print(f"No se encontró información para la dimensión '{dim}' en los archivos.")
+
+    # 2)--- Hechos ---
+    claves = registro.claves() if USAR_CLAVES_SUBROGADAS else None
+    pendientes = [archivo for archivo in archivos_curados if archivo not in errores]
+    resultados, errores_hechos = ejecutar_por_archivo(partial(procesar_archivo, claves=claves), pendientes, workers,
+                                                      desc="Procesando archivos curados",
+                                                      etapa="normalizacion_hechos")
+    errores.update(errores_hechos)
+
+    # Guardar la huella de los ficheros procesados correctamente
+    for archivo in resultados:
+        estado[archivo] = huella_fichero(archivo, estado.get(archivo))
+    guardar_estado(estado, RUTA_ESTADO)
 
+    informar_errores(errores, "la normalización")
+    print("Proceso finalizado.")
+    return resultados, errores
 
 
-print("Proceso finalizado.")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+'''
+Registro persistente de dimensiones
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y mantiene las tablas de dimensiones (`dim_*.csv`) como
+un registro incremental en lugar de reconstruirlas en cada ejecución:
+
+- Al arrancar se cargan las dimensiones ya guardadas en `ficheros_dim` y se indexan por código
+  (diccionario código → clave), de modo que las claves subrogadas existentes no cambian entre ejecuciones.
+- Al registrar nuevas dimensiones sólo se insertan los códigos que no existían, con claves nuevas a
+  continuación de la mayor existente. Si un código existente no tenía descripción se completa.
+- Los códigos se indexan por su representación en texto (2015 y 2015.0 son el mismo año), para que el
+  tipo inferido al leer cada fichero no genere claves duplicadas.
+
+'''
+
+import pandas as pd
+
+from almacenamiento import escribir_tabla_final, leer_tabla, listar_tablas, nombre_tabla
+
+
+# Representación en texto de un código de dimensión
+def codigo_texto(valor):
+    if valor is None or (isinstance(valor, float) and pd.isna(valor)) or valor is pd.NA:
+        return None
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor)
+
+
+class RegistroDimensiones:
+
+    def __init__(self, dim_cols, carpeta):
+        self.dim_cols = dim_cols
+        self.carpeta = carpeta
+        self.tablas = {}
+        self.indices = {}
+        self.modificadas = set()
+
+    @staticmethod
+    def columna_clave(dim):
+        return f"id_{dim}"
+
+    # Carga de las dimensiones guardadas en ejecuciones anteriores
+    def cargar(self):
+        guardadas = {nombre_tabla(ruta): ruta for ruta in listar_tablas(self.carpeta)}
+        for dim, cols in self.dim_cols.items():
+            ruta = guardadas.get(f"dim_{dim}")
+            if ruta is None:
+                continue
+            df_dim = leer_tabla(ruta)
+            clave = self.columna_clave(dim)
+            if cols[0] not in df_dim.columns:
+                continue
+            # Dimensiones generadas antes de existir las claves: se numeran en el orden guardado
+            if clave not in df_dim.columns:
+                df_dim.insert(0, clave, range(1, len(df_dim) + 1))
+                self.modificadas.add(dim)
+            df_dim = self._normalizar(dim, df_dim)
+            self.tablas[dim] = df_dim
+            self.indices[dim] = dict(zip(df_dim[cols[0]], df_dim[clave]))
+        return self
+
+    # Códigos como texto y descripciones como texto nullable, para que las tablas se puedan guardar en cualquier formato
+    def _normalizar(self, dim, df_dim):
+        df_dim = df_dim.copy()
+        codigo = self.dim_cols[dim][0]
+        df_dim[codigo] = df_dim[codigo].map(codigo_texto)
+        df_dim = df_dim[df_dim[codigo].notna()]
+        for col in self.dim_cols[dim][1:]:
+            if col in df_dim.columns:
+                df_dim[col] = df_dim[col].astype("string")
+        if self.columna_clave(dim) in df_dim.columns:
+            df_dim[self.columna_clave(dim)] = df_dim[self.columna_clave(dim)].astype("int64")
+        return df_dim
+
+    # Registra los valores de una dimensión. Devuelve el número de códigos nuevos insertados
+    def registrar(self, dim, df_parcial):
+        codigo = self.dim_cols[dim][0]
+        clave = self.columna_clave(dim)
+        if codigo not in df_parcial.columns:
+            return 0
+
+        # Un registro por código, con la primera descripción no nula encontrada
+        df_parcial = self._normalizar(dim, df_parcial)
+        df_parcial = df_parcial.groupby(codigo, sort=False).first().reset_index()
+
+        indice = self.indices.setdefault(dim, {})
+        existente = self.tablas.get(dim, pd.DataFrame(columns=[clave, codigo]))
+
+        # Completar descripciones vacías de códigos ya registrados
+        conocidos = df_parcial[df_parcial[codigo].isin(indice.keys())]
+        for col in self.dim_cols[dim][1:]:
+            if col not in conocidos.columns or conocidos.empty:
+                continue
+            if col not in existente.columns:
+                existente[col] = pd.Series(pd.NA, index=existente.index, dtype="string")
+            nuevas = existente[codigo].map(dict(zip(conocidos[codigo], conocidos[col])))
+            vacias = existente[col].isna() & nuevas.notna()
+            if vacias.any():
+                existente.loc[vacias, col] = nuevas[vacias]
+                self.modificadas.add(dim)
+
+        # Insertar los códigos nuevos con claves consecutivas
+        df_nuevos = df_parcial[~df_parcial[codigo].isin(indice.keys())].copy()
+        if not df_nuevos.empty:
+            siguiente = max(indice.values(), default=0) + 1
+            df_nuevos.insert(0, clave, range(siguiente, siguiente + len(df_nuevos)))
+            indice.update(zip(df_nuevos[codigo], df_nuevos[clave]))
+            existente = pd.concat([existente, df_nuevos], ignore_index=True) if len(existente) else df_nuevos
+            self.modificadas.add(dim)
+
+        columnas = [clave] + [c for c in self.dim_cols[dim] if c in existente.columns]
+        self.tablas[dim] = self._normalizar(dim, existente[columnas])
+        return len(df_nuevos)
+
+    # Diccionarios código → clave de todas las dimensiones
+    def claves(self):
+        return {dim: dict(indice) for dim, indice in self.indices.items()}
+
+    # Guarda las dimensiones que han cambiado (o todas con `todas=True`)
+    def guardar(self, todas=False):
+        rutas = {}
+        for dim, df_dim in self.tablas.items():
+            if todas or dim in self.modificadas:
+                rutas[dim] = escribir_tabla_final(df_dim, self.carpeta, f"dim_{dim}")
+        self.modificadas.clear()
+        return rutas
+
+
+# Sustituye en una columna los códigos por sus claves (se traduce cada valor distinto una sola vez)
+def mapear_claves(serie, indice):
+    unicos = pd.unique(serie.dropna())
+    traduccion = {valor: indice.get(codigo_texto(valor)) for valor in unicos}
+    return serie.map(traduccion).astype("Int64")
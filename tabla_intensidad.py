@@ -0,0 +1,299 @@
+'''
+Tabla ancha de intensidad de emisiones por país y año
+-----------------------------------------------------------------------
+
+Este script forma parte del pipeline ETL del TFM y se ejecuta después de `proceso_normalizacion.py`. Reúne en una
+sola tabla, con una fila por par (geo, TIME_PERIOD), las emisiones, el PIB, el consumo de energía final y la cuota de
+renovables de las tablas de hechos, junto con indicadores derivados como las emisiones por unidad de PIB o de
+energía. Se guarda ordenada por (geo, TIME_PERIOD) en `ficheros_indicadores/intensidad_emisiones.csv` (y en el
+formato intermedio si es columnar); `leer_tabla_intensidad()` la devuelve indexada por esas dos columnas.
+
+1. **Medidas (`MEDIDAS`):**
+   - Cada columna de la tabla sale de una tabla de hechos con unos filtros por código (`airpol`, `nace_r2`, que se
+     traducen a su clave subrogada) o por etiqueta (`National accounts indicator (ESA 2010)`, `Energy balance`...).
+     Los filtros se aplican al leer, así que sólo se cargan las filas y columnas necesarias.
+   - Las claves subrogadas de geo y periodo se decodifican con las dimensiones de `ficheros_dim`.
+
+2. **Unidades (`UNIDADES`):**
+   - Cada etiqueta de `Unit of measure` tiene una magnitud y el factor que la pasa a la unidad base de esa magnitud
+     (toneladas, euros, tep o porcentaje). De cada medida sólo se usan las filas con unidades de su magnitud (los
+     índices o los valores per cápita se descartan) y los valores se convierten a la unidad base.
+   - Si un par (geo, año) tiene el valor en varias unidades se usa la primera según el orden de `UNIDADES`.
+
+3. **Alineación:**
+   - Cada medida es una serie indexada por (geo, TIME_PERIOD) y todas se alinean en un único `concat` (unión
+     externa de índices), sin encadenar un `merge` por tabla. Los indicadores (`INDICADORES`) son divisiones
+     vectorizadas entre columnas (vacías si el denominador es 0 o falta).
+
+4. **Actualización incremental:**
+   - En `ficheros_indicadores/estado_intensidad.json` se guardan las huellas de las tablas de hechos usadas y la firma
+     de las definiciones. Sólo se vuelven a leer las tablas de hechos que han cambiado y los indicadores sólo se
+     recalculan en los pares (geo, año) cuyos valores han cambiado.
+   - Si cambian las definiciones (medidas, unidades o indicadores) o falta la tabla guardada, se recalcula entera.
+
+'''
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from almacenamiento import escribir_tabla_final, leer_tabla, listar_tablas, nombre_tabla
+from huellas import cargar_estado, guardar_estado, ha_cambiado, huella_fichero
+from metricas import anotar, medir
+from proceso_normalizacion import CARPETA_DIM, CARPETA_FACT, columna_clave, dim_cols
+from registro_dimensiones import RegistroDimensiones
+
+
+# Paths en local
+CARPETA_INDICADORES = "ficheros_indicadores"
+NOMBRE_TABLA = "intensidad_emisiones"
+RUTA_ESTADO = os.path.join(CARPETA_INDICADORES, "estado_intensidad.json")
+
+# Columnas que identifican cada fila de la tabla
+COLUMNAS_CLAVE = ["geo", "TIME_PERIOD"]
+COLUMNA_UNIDAD = "Unit of measure"
+
+# Equivalencias de energía en toneladas equivalentes de petróleo (1 tep = 41,868 GJ)
+TEP_POR_GWH = 3600 / 41.868
+TEP_POR_TJ = 1000 / 41.868
+
+# Unidades conocidas: etiqueta → (magnitud, factor a la unidad base de la magnitud). El orden es la preferencia
+# cuando un mismo par (geo, año) aparece en varias unidades
+UNIDADES = {
+    "Thousand tonnes": ("masa", 1e3),
+    "Million tonnes": ("masa", 1e6),
+    "Tonne": ("masa", 1.0),
+    "Current prices, million euro": ("euros_corrientes", 1e6),
+    "Current prices, euro": ("euros_corrientes", 1.0),
+    "Million tonnes of oil equivalent": ("energia", 1e6),
+    "Thousand tonnes of oil equivalent": ("energia", 1e3),
+    "Gigawatt-hour": ("energia", TEP_POR_GWH),
+    "Terajoule": ("energia", TEP_POR_TJ),
+    "Percentage": ("porcentaje", 1.0),
+}
+
+# Columnas de la tabla que salen de las tablas de hechos (valores en la unidad base de su magnitud)
+MEDIDAS = {
+    # Emisiones de GEI de las cuentas de emisiones (total de actividades y hogares), en toneladas de CO2 eq.
+    "gei_aea_t": {
+        "tabla": "fact_aea",
+        "filtros": {"airpol": "GHG", "nace_r2": "TOTAL_HH"},
+        "magnitud": "masa",
+    },
+    # Emisiones de GEI del inventario (sin LULUCF, con aviación internacional), en toneladas de CO2 eq.
+    "gei_t": {
+        "tabla": "fact_ghe",
+        "filtros": {"Source sectors for greenhouse gas emissions (Common reporting format, UNFCCC)":
+                    "Total (excluding LULUCF and memo items, including international aviation)"},
+        "magnitud": "masa",
+    },
+    # PIB a precios corrientes, en euros
+    "pib_eur": {
+        "tabla": "fact_gdp",
+        "filtros": {"National accounts indicator (ESA 2010)": "Gross domestic product at market prices"},
+        "magnitud": "euros_corrientes",
+    },
+    # Consumo de energía final, en tep
+    "energia_final_tep": {
+        "tabla": "fact_energy_cons",
+        "filtros": {"Energy balance": "Final energy consumption (Europe 2020-2030)"},
+        "magnitud": "energia",
+    },
+    # Cuota de renovables en el consumo final bruto de energía, en porcentaje
+    "renovables_pct": {
+        "tabla": "fact_share_ren",
+        "filtros": {"Energy balance": "Renewable energy sources"},
+        "magnitud": "porcentaje",
+    },
+}
+
+# Indicadores derivados: nombre → (numerador, denominador, factor)
+INDICADORES = {
+    # kg de CO2 eq. por euro de PIB
+    "gei_por_pib_kg_eur": ("gei_t", "pib_eur", 1e3),
+    "gei_aea_por_pib_kg_eur": ("gei_aea_t", "pib_eur", 1e3),
+    # Toneladas de CO2 eq. por tep de energía final
+    "gei_por_energia_t_tep": ("gei_t", "energia_final_tep", 1.0),
+    "gei_aea_por_energia_t_tep": ("gei_aea_t", "energia_final_tep", 1.0),
+    # Intensidad energética: tep por millón de euros de PIB
+    "energia_por_pib_tep_meur": ("energia_final_tep", "pib_eur", 1e6),
+}
+
+
+def _firma():
+    definicion = {"medidas": MEDIDAS, "unidades": UNIDADES, "indicadores": INDICADORES}
+    return hashlib.sha256(json.dumps(definicion, sort_keys=True).encode()).hexdigest()
+
+
+# Dimensión a la que pertenece una columna de código (None si no es el código de ninguna)
+def _dimension(columna):
+    return next((dim for dim, cols in dim_cols.items() if cols[0] == columna), None)
+
+
+# Filtros de lectura de una medida: cada filtro por código se pide también sobre su clave subrogada (se leen con
+# `ignorar_ausentes`, así que sólo se aplica el de la columna que tenga la tabla)
+def _filtros_lectura(filtros, registro):
+    lectura = []
+    for columna, valor in filtros.items():
+        lectura.append((columna, "==", valor))
+        dim = _dimension(columna)
+        if dim is not None:
+            clave = registro.indices.get(dim, {}).get(valor)
+            lectura.append((columna_clave(dim), "in", [] if clave is None else [clave]))
+    return lectura
+
+
+# Sustituye en `df` la clave subrogada de una dimensión por su código
+def _decodificar(df, dim, registro):
+    clave, codigo = columna_clave(dim), dim_cols[dim][0]
+    if codigo in df.columns or clave not in df.columns:
+        return df
+    tabla = registro.tablas.get(dim)
+    codigos = pd.Series(dtype=object) if tabla is None else tabla.set_index(clave)[codigo]
+    return df.assign(**{codigo: df[clave].map(codigos)})
+
+
+# Serie de una medida indexada por (geo, TIME_PERIOD) y en la unidad base de su magnitud. None si falta su tabla
+# de hechos o alguna de las columnas que necesita
+def leer_medida(nombre, definicion, rutas, registro):
+    tabla = definicion["tabla"]
+    if tabla not in rutas:
+        print(f"⚠️  {nombre}: no existe la tabla {tabla}")
+        return None
+
+    columnas = list(definicion["filtros"]) + [COLUMNA_UNIDAD, "OBS_VALUE"]
+    for dim in ["geo", "time_period"] + [d for d in map(_dimension, definicion["filtros"]) if d]:
+        columnas += [dim_cols[dim][0], columna_clave(dim)]
+    estadisticas = {}
+    df = leer_tabla(rutas[tabla], columnas=columnas, filtros=_filtros_lectura(definicion["filtros"], registro),
+                    estadisticas=estadisticas, ignorar_ausentes=True)
+    anotar(**{f"filas_leidas_{nombre}": estadisticas.get("filas_leidas", len(df))})
+
+    for dim in ["geo", "time_period"]:
+        df = _decodificar(df, dim, registro)
+    # Los filtros sobre columnas que no existen no se aplican al leer: sin ellas la medida no se puede calcular
+    faltan = [c for c in definicion["filtros"]
+              if c not in df.columns and (_dimension(c) is None or columna_clave(_dimension(c)) not in df.columns)]
+    faltan += [c for c in COLUMNAS_CLAVE + [COLUMNA_UNIDAD, "OBS_VALUE"] if c not in df.columns]
+    if faltan:
+        print(f"⚠️  {nombre}: faltan columnas en {tabla} ({', '.join(faltan)})")
+        return None
+
+    # Unidades de la magnitud de la medida: factor de conversión y preferencia (posición en UNIDADES)
+    compatibles = [u for u, (magnitud, _) in UNIDADES.items() if magnitud == definicion["magnitud"]]
+    unidades = df[COLUMNA_UNIDAD].astype(object)
+    factor = unidades.map({u: UNIDADES[u][1] for u in compatibles}).astype(float)
+    preferencia = unidades.map({u: i for i, u in enumerate(compatibles)})
+
+    datos = pd.DataFrame({
+        "geo": df["geo"].astype(object),
+        "TIME_PERIOD": pd.to_numeric(df["TIME_PERIOD"], errors="coerce").astype("Int64"),
+        nombre: pd.to_numeric(df["OBS_VALUE"], errors="coerce") * factor,
+        "_preferencia": preferencia,
+    }).dropna()
+    descartadas = len(df) - len(datos)
+    datos = datos.sort_values("_preferencia", kind="stable").drop_duplicates(COLUMNAS_CLAVE)
+    serie = datos.set_index(COLUMNAS_CLAVE)[nombre].sort_index()
+    anotar(**{f"filas_descartadas_{nombre}": descartadas})
+    print(f"📏 {nombre}: {len(serie)} pares (geo, año) de {tabla} ({descartadas} filas sin valor o con otra unidad)")
+    return serie
+
+
+# Recalcula los indicadores de las filas indicadas por `filas` (todas si es None)
+def calcular_indicadores(tabla, filas=None):
+    filas = slice(None) if filas is None else filas
+    for nombre, (numerador, denominador, factor) in INDICADORES.items():
+        if nombre not in tabla.columns:
+            tabla[nombre] = np.nan
+        den = tabla.loc[filas, denominador]
+        tabla.loc[filas, nombre] = tabla.loc[filas, numerador] / den.where(den != 0) * factor
+    return tabla
+
+
+# Pares (geo, año) en los que una columna ha cambiado entre dos versiones alineadas
+def _cambiados(anterior, nueva):
+    return ~((anterior == nueva) | (anterior.isna() & nueva.isna()))
+
+
+# Tabla guardada indexada por (geo, TIME_PERIOD) (None si no existe)
+def leer_tabla_intensidad(carpeta=None):
+    guardadas = {nombre_tabla(r): r for r in listar_tablas(carpeta or CARPETA_INDICADORES)}
+    if NOMBRE_TABLA not in guardadas:
+        return None
+    df = leer_tabla(guardadas[NOMBRE_TABLA])
+    df["geo"] = df["geo"].astype(object)
+    df["TIME_PERIOD"] = df["TIME_PERIOD"].astype("Int64")
+    return df.set_index(COLUMNAS_CLAVE).sort_index()
+
+
+# Actualización de la tabla de intensidad: se leen las tablas de hechos que han cambiado y se recalculan los
+# indicadores de los pares (geo, año) afectados
+def actualizar_tabla(forzar=False):
+    with medir("tabla_intensidad"):
+        os.makedirs(CARPETA_INDICADORES, exist_ok=True)
+        estado = cargar_estado(RUTA_ESTADO)
+        huellas = estado.get("tablas", {})
+        rutas = {nombre_tabla(r): r for r in listar_tablas(CARPETA_FACT)}
+        registro = RegistroDimensiones(dim_cols, CARPETA_DIM).cargar()
+
+        anterior = None if forzar or estado.get("firma") != _firma() else leer_tabla_intensidad()
+        completo = anterior is None
+        # Medidas cuya tabla de hechos ha cambiado (o ha desaparecido) desde la última ejecución
+        pendientes = [nombre for nombre, definicion in MEDIDAS.items()
+                      if completo or (definicion["tabla"] in rutas) != (definicion["tabla"] in huellas)
+                      or (definicion["tabla"] in rutas and ha_cambiado(rutas[definicion["tabla"]],
+                                                                       huellas.get(definicion["tabla"])))]
+        if not pendientes:
+            print("✅ Tabla de intensidad al día")
+            anotar(medidas_leidas=0, pares_recalculados=0)
+            return leer_tabla_intensidad()
+
+        series = [s for s in (leer_medida(n, MEDIDAS[n], rutas, registro) for n in pendientes) if s is not None]
+        # Alineación de todas las medidas leídas en una sola pasada por (geo, TIME_PERIOD)
+        vacia = pd.DataFrame(index=pd.MultiIndex.from_arrays([[], []], names=COLUMNAS_CLAVE))
+        nuevas = pd.concat(series, axis=1, join="outer") if series else vacia
+        nuevas = nuevas.reindex(columns=pendientes)
+
+        if completo:
+            tabla = nuevas.reindex(columns=list(MEDIDAS)).sort_index()
+            tabla.index.names = COLUMNAS_CLAVE
+            tabla = calcular_indicadores(tabla)
+            pares = len(tabla)
+        else:
+            indice = anterior.index.union(nuevas.index).sort_values()
+            tabla = anterior.reindex(indice)
+            nuevas = nuevas.reindex(indice)
+            cambiados = pd.Series(False, index=indice)
+            for nombre in pendientes:
+                cambiados |= _cambiados(tabla[nombre], nuevas[nombre])
+                tabla[nombre] = nuevas[nombre]
+            tabla = calcular_indicadores(tabla, cambiados.to_numpy())
+            pares = int(cambiados.sum())
+
+        # Pares sin ninguna medida (p. ej. borrados de todas las tablas de hechos)
+        tabla = tabla[tabla[list(MEDIDAS)].notna().any(axis=1)]
+        ruta = escribir_tabla_final(tabla.reset_index(), CARPETA_INDICADORES, NOMBRE_TABLA)
+
+        estado = {"firma": _firma(),
+                  "tablas": {t: huella_fichero(r, huellas.get(t)) for t, r in rutas.items()
+                             if t in {d["tabla"] for d in MEDIDAS.values()}}}
+        guardar_estado(estado, RUTA_ESTADO)
+        anotar(medidas_leidas=len(pendientes), pares_recalculados=pares, filas=len(tabla))
+
+    if completo:
+        print(f"🧮 {NOMBRE_TABLA}: recalculada ({len(tabla)} pares (geo, año)) en {ruta}")
+    else:
+        print(f"🔁 {NOMBRE_TABLA}: {pares} pares (geo, año) actualizados ({', '.join(pendientes)}) en {ruta}")
+    return tabla
+
+
+#Proceso de ejecución
+def main(forzar=False):
+    return actualizar_tabla(forzar=forzar)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+'''
+Vistas estandarizadas de las tablas curadas
+-----------------------------------------------------------------------
+
+Este módulo forma parte del pipeline ETL del TFM y describe de forma declarativa cómo se adapta cada tabla
+curada a la estructura de Eurostat (filtros de filas, renombrado de columnas y sustitución de valores).
+
+La especificación no se aplica al guardar sino al leer: la carpeta de ficheros estandarizados contiene los
+mismos ficheros que la de curado (enlaces duros, sin leerlos ni copiarlos) y `leer_estandarizada` aplica la
+especificación de la tabla al cargarla. Las columnas y filtros se piden con los nombres estandarizados y se
+traducen a los de origen para leer sólo lo necesario.
+
+Las tablas sin especificación (todas las de Eurostat y el resto de EEA) se leen tal cual.
+
+'''
+
+import os
+import shutil
+
+import pandas as pd
+
+from almacenamiento import leer_tabla, mascara_filtros, nombre_tabla
+
+
+# Especificación de estandarización de cada tabla:
+# - `filtros`: filas que se conservan, con los nombres de columna de origen (se aplican en el lector)
+# - `renombrar`: columna de origen → columna estandarizada
+# - `valores`: columna estandarizada → {valor de origen: valor estandarizado}
+ESPECIFICACIONES = {
+    "UNFCCC_v28_3": {
+        # Del UNFCCC sólo se usan las emisiones totales de GEI, el resto de contaminantes no llega a cargarse
+        "filtros": [('Pollutant_name', 'in', ['All greenhouse gases - (CO2 equivalent)', 'GHG'])],
+        "renombrar": {
+            'Country_code': 'geo',
+            'Country': 'Geopolitical entity (reporting)',
+            'emissions': 'OBS_VALUE',
+            'Year': 'TIME_PERIOD',
+            'Pollutant_name': 'airpol',
+        },
+        "valores": {
+            'geo': {'EUA': 'EU27_2020'},
+            'Geopolitical entity (reporting)': {'EU-27': 'European Union - 27 countries (from 2020)'},
+            'airpol': {'All greenhouse gases - (CO2 equivalent)': 'GHG'},
+        },
+    },
+}
+
+
+# Aplica a un DataFrame con las columnas de origen la especificación de su tabla (si la tiene)
+def aplicar_especificacion(nombre, df, filtrar=True):
+    especificacion = ESPECIFICACIONES.get(nombre)
+    if especificacion is None:
+        return df
+
+    if filtrar and especificacion.get("filtros"):
+        df = df[mascara_filtros(df, especificacion["filtros"])]
+    df = df.rename(columns=especificacion.get("renombrar", {}))
+    for columna, mapa in especificacion.get("valores", {}).items():
+        if columna in df.columns:
+            serie = df[columna]
+            # Las categorías no admiten valores nuevos: se sustituye sobre sus valores
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                serie = serie.astype(serie.cat.categories.dtype)
+            df[columna] = serie.replace(mapa)
+    return df
+
+
+# Lectura de una tabla estandarizada aplicando su especificación. `columnas` y `filtros` usan los nombres
+# estandarizados: los filtros sobre columnas cuyos valores se sustituyen se aplican después de sustituirlos
+def leer_estandarizada(ruta, columnas=None, filtros=None):
+    nombre = nombre_tabla(ruta)
+    especificacion = ESPECIFICACIONES.get(nombre)
+    if especificacion is None:
+        return leer_tabla(ruta, columnas=columnas, filtros=filtros)
+
+    origen = {destino: fuente for fuente, destino in especificacion.get("renombrar", {}).items()}
+    mapeadas = set(especificacion.get("valores", {}))
+    filtros = filtros or []
+    directos = [(origen.get(c, c), op, v) for c, op, v in filtros if c not in mapeadas]
+    posteriores = [(c, op, v) for c, op, v in filtros if c in mapeadas]
+    columnas_origen = None if columnas is None else [origen.get(c, c) for c in list(columnas) + [c for c, _, _ in posteriores]]
+
+    df = leer_tabla(ruta, columnas=columnas_origen, filtros=especificacion.get("filtros", []) + directos)
+    df = aplicar_especificacion(nombre, df, filtrar=False)
+    if posteriores:
+        df = df[mascara_filtros(df, posteriores)]
+    if columnas is not None:
+        df = df[[c for c in df.columns if c in set(columnas)]]
+    return df
+
+
+# Expone un fichero en otra carpeta sin copiar su contenido: enlace duro y, si el sistema de ficheros no lo
+# permite, copia. Devuelve la ruta de destino
+def enlazar_tabla(archivo, carpeta):
+    ruta_destino = os.path.join(carpeta, os.path.basename(archivo))
+    if os.path.exists(ruta_destino):
+        if os.path.samefile(archivo, ruta_destino):
+            return ruta_destino
+        os.remove(ruta_destino)
+    try:
+        os.link(archivo, ruta_destino)
+    except OSError:
+        shutil.copy2(archivo, ruta_destino)
+    return ruta_destino